@@ -0,0 +1,115 @@
+"""
+The tourism / non-tourism attribution of analysis_local.ipynb as a
+reusable pipeline, without per-row Python loops.
+
+Python:
+    fires, summary = run(fire_data, maps_data)
+
+Command line:
+    python -m analysis.attribution \\
+        --fires fire/data/fires_spain_since_2010.csv \\
+        --pois tourism/data.csv --out attributed.csv
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from typing import List, Tuple, Optional
+
+# own stuff
+import analysis.scoring as ascore
+
+# colors of analysis_local.ipynb: 'y' if tourism correlated, else 'b'
+COLORS = np.array(["b", "y"])
+
+
+def run(fires: pd.DataFrame, pois: pd.DataFrame,
+        limits: Optional[Tuple[float, float, float, float]] = None,
+        bandwidth: float = ascore.BANDWIDTH, atol: float = ascore.ATOL,
+        n_jobs: int = 1) -> Tuple[pd.DataFrame, dict]:
+    """
+    Attributes every fire inside limits to tourism or non-tourism.
+
+    Args:
+        fires: fire table with columns lat, lon (and usually fire_val, date)
+        pois: POI table with columns lat, lon, type
+        limits: (lat_min, lat_max, lon_min, lon_max). Defaults to the
+            bounding box of pois, as in the notebook.
+        n_jobs: number of processes used for KDE scoring
+
+    Returns:
+        (fires, summary) where fires is the filtered fire table with the
+        columns added by AttributionModel.attribute plus
+            "max_score" : int8 : 1 if tourism correlated, else 0
+            "color"     : str  : 'y' if tourism correlated, else 'b'
+        and summary is a dict with the aggregate numbers of the notebook
+        (n_fires, n_tourism_correlated, log_diff, ...).
+    """
+    if limits is None:
+        limits = ascore.bbox_of(pois)
+    fires = ascore.filter_bbox(fires, limits, inclusive=True)\
+                  .reset_index(drop=True)
+
+    model = ascore.AttributionModel.from_pois(pois, bandwidth=bandwidth,
+                                              atol=atol)
+    fires = model.attribute(fires, n_jobs=n_jobs)
+
+    max_score = fires["tourism_correlated"].to_numpy().astype(np.int8)
+    fires = fires.assign(max_score = max_score,
+                         color     = COLORS[max_score])
+
+    n_tourism = int(np.count_nonzero(pois["type"].to_numpy() == ascore.TOURISM))
+    summary = {
+        "limits"              : [float(x) for x in limits],
+        "n_tourism_pois"      : n_tourism,
+        "n_non_tourism_pois"  : int(len(pois) - n_tourism),
+        "n_fires"             : int(len(fires)),
+        "n_tourism_correlated": int(max_score.sum()),
+        # sum(scores_non_tourism) - sum(scores_tourism) in the notebook
+        "log_diff"            : float(fires["score_non_tourism"].sum()
+                                      - fires["score_tourism"].sum()),
+    }
+    return fires, summary
+
+
+def category_codes(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized replacement for `[types.index(v) for v in values]` in
+    tourism_data_analysis.ipynb.
+
+    Returns:
+        (codes, categories) with categories sorted, so that codes
+        are stable between runs (unlike list(set(...))).
+    """
+    codes, categories = pd.factorize(values, sort=True)
+    return codes, np.asarray(categories)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Attribute fires to tourism / non-tourism activity.")
+    parser.add_argument("--fires", required=True, help="fire table (CSV)")
+    parser.add_argument("--pois", nargs="+", required=True,
+                        help="tourism/data*.csv files")
+    parser.add_argument("--limits", nargs=4, type=float, default=None,
+                        metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"))
+    parser.add_argument("--bandwidth", type=float, default=ascore.BANDWIDTH)
+    parser.add_argument("--atol", type=float, default=ascore.ATOL)
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--out", default=None,
+                        help="CSV file to write the attributed fires to")
+    args = parser.parse_args(argv)
+
+    fires, summary = run(pd.read_csv(args.fires),
+                         ascore.load_pois(args.pois),
+                         limits=args.limits, bandwidth=args.bandwidth,
+                         atol=args.atol, n_jobs=args.n_jobs)
+    if args.out:
+        fires.to_csv(args.out, index=False)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Out-of-core variant of analysis.attribution for fire and POI tables that
+do not fit into memory (planet-scale POIs, many years of fires).
+
+The CSVs are read in chunks of chunk_size rows. POIs are streamed through
+a bbox filter and only their coordinates and tourism flag are kept for
+fitting the density models; fires are scored chunk by chunk and reduced
+into an AttributionSummary (counts and log-likelihood sums). Peak memory
+is thus set by chunk_size and the POIs of the analysed region, not by
+the size of the files.
+
+Python:
+    summary = run_chunked(["fire/data/fires_spain_since_2010.csv"],
+                          ["tourism/data.csv", "tourism/data_galicia.csv"],
+                          out="attributed.csv")
+
+Command line:
+    python -m analysis.chunked \\
+        --fires fire/data/fires_spain_since_2010.csv \\
+        --pois tourism/data.csv --chunk-size 100000 --out attributed.csv
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# own stuff
+import analysis.scoring as ascore
+import analysis.attribution as aattr
+import tourism.encoding as tenc
+
+Limits = Tuple[float, float, float, float] # lat_min, lat_max, lon_min, lon_max
+
+# CONSTANTS
+# ----------------------------------------------------
+CHUNK_SIZE = 100000 # rows per chunk
+# POIs farther than this outside the limits are not fitted. At 1 degree
+# (35 bandwidths) a POI adds less than exp(-600) to the kernel sum.
+MARGIN = 1.0 # degrees
+# ----------------------------------------------------
+
+
+def read_chunks(paths: List[str], chunk_size: int = CHUNK_SIZE,
+                **read_csv_kwargs) -> Iterator[pd.DataFrame]:
+    """
+    Yields the rows of all CSV files in chunks of at most chunk_size rows
+    (one file after the other; a chunk never spans two files).
+    """
+    for path in paths:
+        with pd.read_csv(path, chunksize=chunk_size,
+                         **read_csv_kwargs) as reader:
+            yield from reader
+
+
+def read_poi_chunks(paths: List[str],
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Chunked equivalent of ascore.load_pois; only lat, lon and type are
+    read.
+    """
+    return read_chunks(paths, chunk_size, usecols=["lat", "lon", "type"],
+                       dtype={"lat": tenc.COORD_DTYPE, "lon": tenc.COORD_DTYPE,
+                              "type": "category"})
+
+
+def filter_bbox_chunks(chunks: Iterable[pd.DataFrame], limits: Limits,
+                       inclusive: bool = False) -> Iterator[pd.DataFrame]:
+    """ ascore.filter_bbox applied to every chunk, empty chunks skipped. """
+    for chunk in chunks:
+        chunk = ascore.filter_bbox(chunk, limits, inclusive)
+        if len(chunk):
+            yield chunk
+
+
+def bbox_of_chunks(chunks: Iterable[pd.DataFrame]) -> Limits:
+    """ ascore.bbox_of over all chunks, in a single pass. """
+    lat_min = lon_min = np.inf
+    lat_max = lon_max = -np.inf
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        c_lat_min, c_lat_max, c_lon_min, c_lon_max = ascore.bbox_of(chunk)
+        lat_min, lat_max = min(lat_min, c_lat_min), max(lat_max, c_lat_max)
+        lon_min, lon_max = min(lon_min, c_lon_min), max(lon_max, c_lon_max)
+    if lat_min > lat_max:
+        raise ValueError("no rows to compute a bounding box from")
+    return lat_min, lat_max, lon_min, lon_max
+
+
+def pad_limits(limits: Limits, margin: float) -> Limits:
+    lat_min, lat_max, lon_min, lon_max = limits
+    return lat_min - margin, lat_max + margin, lon_min - margin, lon_max + margin
+
+
+def collect_pois(chunks: Iterable[pd.DataFrame], limits: Limits) -> dict:
+    """
+    Reduces POI chunks to what fitting and the summary need.
+
+    Returns:
+        dict with
+            "lat", "lon"    : float64 arrays : coordinates of the POIs
+                                               inside limits (inclusive)
+            "is_tourism"    : bool array     : type == "tourism" for these
+            "n_tourism"     : int            : tourism POIs in all chunks
+            "n_non_tourism" : int            : other POIs in all chunks
+    """
+    lats, lons, flags = [], [], []
+    n_tourism = n_total = 0
+    for chunk in chunks:
+        n_tourism += int(np.count_nonzero(chunk["type"] == ascore.TOURISM))
+        n_total += len(chunk)
+        chunk = ascore.filter_bbox(chunk, limits, inclusive=True)
+        lats.append(chunk["lat"].to_numpy(dtype=np.float64))
+        lons.append(chunk["lon"].to_numpy(dtype=np.float64))
+        flags.append((chunk["type"] == ascore.TOURISM).to_numpy())
+    if not lats:
+        raise ValueError("no POIs to fit")
+    return {"lat": np.concatenate(lats), "lon": np.concatenate(lons),
+            "is_tourism": np.concatenate(flags),
+            "n_tourism": n_tourism, "n_non_tourism": n_total - n_tourism}
+
+
+class PartialAttributionModel(ascore.AttributionModel):
+    """
+    AttributionModel fitted on the POIs near a region only.
+
+    KernelDensity normalizes by the number of fitted points, so the log
+    scores are shifted to the normalization of all POIs. Within the
+    region they then equal the scores of a model fitted on all POIs, up
+    to the kernels of POIs beyond the margin.
+    """
+    def __init__(self, kde_tourism, kde_non_tourism,
+                 log_norm_tourism: float = 0.0,
+                 log_norm_non_tourism: float = 0.0):
+        super().__init__(kde_tourism, kde_non_tourism)
+        self.log_norm_tourism = log_norm_tourism
+        self.log_norm_non_tourism = log_norm_non_tourism
+
+    @classmethod
+    def from_collected(cls, pois: dict, bandwidth: float = ascore.BANDWIDTH,
+                       atol: float = ascore.ATOL) -> "PartialAttributionModel":
+        """ Fits the models to the output of collect_pois. """
+        t = pois["is_tourism"]
+        n_t, n_nt = np.count_nonzero(t), np.count_nonzero(~t)
+        if n_t == 0 or n_nt == 0:
+            raise ValueError("need tourism and non-tourism POIs near limits")
+        return cls(
+            ascore.fit_kde(pois["lat"][t], pois["lon"][t], bandwidth, atol),
+            ascore.fit_kde(pois["lat"][~t], pois["lon"][~t], bandwidth, atol),
+            np.log(n_t) - np.log(pois["n_tourism"]),
+            np.log(n_nt) - np.log(pois["n_non_tourism"]))
+
+    def log_scores(self, lat: np.ndarray, lon: np.ndarray,
+                   n_jobs: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        log_t, log_nt = super().log_scores(lat, lon, n_jobs)
+        return log_t + self.log_norm_tourism, log_nt + self.log_norm_non_tourism
+
+
+class AttributionSummary():
+    """
+    Incremental version of the summary dict returned by
+    analysis.attribution.run. Chunks are added with update, summaries
+    of partitions can be combined with merge.
+    """
+    def __init__(self, limits: Limits, n_tourism_pois: int = 0,
+                 n_non_tourism_pois: int = 0):
+        self.limits = limits
+        self.n_tourism_pois = n_tourism_pois
+        self.n_non_tourism_pois = n_non_tourism_pois
+        self.n_fires = 0
+        self.n_tourism_correlated = 0
+        self.sum_score_tourism = 0.0
+        self.sum_score_non_tourism = 0.0
+
+    def update(self, attributed: pd.DataFrame) -> "AttributionSummary":
+        """
+        Args:
+            attributed: chunk as returned by AttributionModel.attribute
+        """
+        self.n_fires += len(attributed)
+        self.n_tourism_correlated += int(
+            np.count_nonzero(attributed["tourism_correlated"].to_numpy()))
+        self.sum_score_tourism += float(attributed["score_tourism"].sum())
+        self.sum_score_non_tourism += float(
+            attributed["score_non_tourism"].sum())
+        return self
+
+    def merge(self, other: "AttributionSummary") -> "AttributionSummary":
+        """ Adds the fire counts and sums of other (same region and POIs). """
+        self.n_fires += other.n_fires
+        self.n_tourism_correlated += other.n_tourism_correlated
+        self.sum_score_tourism += other.sum_score_tourism
+        self.sum_score_non_tourism += other.sum_score_non_tourism
+        return self
+
+    def to_dict(self) -> dict:
+        """ Same keys as the summary of analysis.attribution.run. """
+        return {
+            "limits"              : [float(x) for x in self.limits],
+            "n_tourism_pois"      : int(self.n_tourism_pois),
+            "n_non_tourism_pois"  : int(self.n_non_tourism_pois),
+            "n_fires"             : int(self.n_fires),
+            "n_tourism_correlated": int(self.n_tourism_correlated),
+            "log_diff"            : self.sum_score_non_tourism
+                                    - self.sum_score_tourism,
+        }
+
+
+def run_chunked(fire_paths: List[str], poi_paths: List[str],
+                limits: Optional[Limits] = None,
+                chunk_size: int = CHUNK_SIZE,
+                margin: float = MARGIN,
+                bandwidth: float = ascore.BANDWIDTH, atol: float = ascore.ATOL,
+                n_jobs: int = 1, out: Optional[str] = None) -> dict:
+    """
+    analysis.attribution.run for CSV files read in chunks.
+
+    Args:
+        fire_paths: fire tables (CSV) with columns lat, lon, ...; e.g. one
+            partition per region or year
+        poi_paths: tourism/data*.csv files
+        limits: (lat_min, lat_max, lon_min, lon_max). Defaults to the
+            bounding box of all POIs (one extra pass over poi_paths).
+        margin: POIs up to this many degrees outside limits are used for
+            fitting (see PartialAttributionModel). Fires far from any POI
+            are only attributed as with all POIs if margin is large.
+        n_jobs: number of processes used for KDE scoring per chunk
+        out: if given, the attributed fires (with max_score and color)
+            are appended to this CSV file chunk by chunk
+
+    Returns:
+        summary dict as returned by analysis.attribution.run
+    """
+    if limits is None:
+        limits = bbox_of_chunks(read_poi_chunks(poi_paths, chunk_size))
+    pois = collect_pois(read_poi_chunks(poi_paths, chunk_size),
+                        pad_limits(limits, margin))
+    model = PartialAttributionModel.from_collected(pois, bandwidth, atol)
+    summary = AttributionSummary(limits, pois["n_tourism"],
+                                 pois["n_non_tourism"])
+    del pois # only the KDE trees are needed from here on
+
+    write_header = True
+    for fires in filter_bbox_chunks(read_chunks(fire_paths, chunk_size),
+                                    limits, inclusive=True):
+        fires = model.attribute(fires.reset_index(drop=True), n_jobs=n_jobs)
+        summary.update(fires)
+        if out:
+            max_score = fires["tourism_correlated"].to_numpy().astype(np.int8)
+            fires.assign(max_score = max_score,
+                         color     = aattr.COLORS[max_score])\
+                 .to_csv(out, mode="w" if write_header else "a",
+                         header=write_header, index=False)
+            write_header = False
+
+    return summary.to_dict()
+
+
+def run_regions(fire_paths: List[str], poi_paths: List[str],
+                regions: Dict[str, Limits], **kwargs) -> Dict[str, dict]:
+    """
+    run_chunked for several regions, one after the other, so that only
+    the density models of one region are held in memory at a time.
+
+    Returns:
+        dict region name -> summary
+    """
+    return {name: run_chunked(fire_paths, poi_paths, limits, **kwargs)
+            for name, limits in regions.items()}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Attribute fires to tourism / non-tourism activity, "
+                    "reading the CSVs in chunks.")
+    parser.add_argument("--fires", nargs="+", required=True,
+                        help="fire tables (CSV)")
+    parser.add_argument("--pois", nargs="+", required=True,
+                        help="tourism/data*.csv files")
+    parser.add_argument("--limits", nargs=4, type=float, default=None,
+                        metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"))
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--margin", type=float, default=MARGIN,
+                        help="degrees around the limits to fit POIs from")
+    parser.add_argument("--bandwidth", type=float, default=ascore.BANDWIDTH)
+    parser.add_argument("--atol", type=float, default=ascore.ATOL)
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--out", default=None,
+                        help="CSV file to write the attributed fires to")
+    args = parser.parse_args(argv)
+
+    summary = run_chunked(args.fires, args.pois, limits=args.limits,
+                          chunk_size=args.chunk_size, margin=args.margin,
+                          bandwidth=args.bandwidth, atol=args.atol,
+                          n_jobs=args.n_jobs, out=args.out)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
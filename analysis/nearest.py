@@ -0,0 +1,125 @@
+"""
+k nearest tourism and non-tourism POIs for every fire.
+
+The POIs are indexed once in one haversine BallTree per group; the fires
+are queried in chunks on a thread pool (the tree queries release the GIL).
+
+Example:
+    index = NearestPOIIndex(ascore.load_pois(["tourism/data.csv"]))
+    nearest = index.query(fire_data, k=3)
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from typing import Dict, Optional
+
+# own stuff
+import analysis.scoring as ascore
+
+# CONSTANTS
+# ----------------------------------------------------
+EARTH_RADIUS_KM = 6371.0088 # mean earth radius
+GROUPS = ["tourism", "non_tourism"]
+# ----------------------------------------------------
+
+
+class NearestPOIIndex():
+    """
+    Spatial index over a POI table with the schema of tourism/data*.csv.
+    """
+    def __init__(self, pois: pd.DataFrame, leaf_size: int = 40):
+        """
+        Args:
+            pois: table with columns lat, lon, type, subtype. Result rows
+                refer to POIs by their position in this table.
+        """
+        self.types = pois["type"].astype("category")
+        self.subtypes = pois["subtype"].astype("category")
+        is_tourism = (pois["type"] == ascore.TOURISM).to_numpy()
+        X = ascore.to_radians(pois["lat"].to_numpy(), pois["lon"].to_numpy())
+
+        self.trees: Dict[str, BallTree] = {}
+        self.positions: Dict[str, np.ndarray] = {}
+        for group, member in zip(GROUPS, [is_tourism, ~is_tourism]):
+            positions = np.flatnonzero(member).astype(np.int32)
+            if len(positions) == 0:
+                continue
+            self.positions[group] = positions
+            self.trees[group] = BallTree(X[positions], leaf_size=leaf_size,
+                                         metric="haversine")
+
+    def _query_chunk(self, group: str, X: np.ndarray, k: int):
+        dist, idx = self.trees[group].query(X, k=k)
+        return dist, idx
+
+    def query(self, fires: pd.DataFrame, k: int = 5,
+              n_jobs: Optional[int] = None,
+              chunk_size: int = 20000) -> pd.DataFrame:
+        """
+        Args:
+            fires: table with columns lat, lon
+            k: number of neighbors per fire and group
+            n_jobs: number of threads (None: all cores)
+            chunk_size: fires per task
+
+        Returns:
+            pandas.DataFrame with k rows per fire and group, sorted by fire,
+            group and distance, with the columns
+                "fire"    : int32    : position of the fire in fires
+                "group"   : category : "tourism" or "non_tourism"
+                "rank"    : int8     : 0 for the nearest POI
+                "poi"     : int32    : position of the POI in pois
+                "dist_km" : float32  : great-circle distance
+                "type", "subtype" : category : of the POI
+        """
+        X = ascore.to_radians(fires["lat"].to_numpy(), fires["lon"].to_numpy())
+        n_jobs = n_jobs or os.cpu_count() or 1
+        starts = range(0, len(X), chunk_size)
+
+        parts = []
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            for group, tree in self.trees.items():
+                k_group = min(k, len(self.positions[group]))
+                chunks = pool.map(
+                    lambda s: self._query_chunk(group, X[s:s + chunk_size],
+                                                k_group), starts)
+                dists, idxs = zip(*chunks) if len(X) else ([], [])
+                dist = np.concatenate(dists) if dists \
+                       else np.empty((0, k_group))
+                idx = np.concatenate(idxs) if idxs \
+                      else np.empty((0, k_group), dtype=np.intp)
+
+                poi = self.positions[group][idx.ravel()]
+                parts.append(pd.DataFrame({
+                    "fire": np.repeat(np.arange(len(X), dtype=np.int32),
+                                      k_group),
+                    "group": GROUPS.index(group),
+                    "rank": np.tile(np.arange(k_group, dtype=np.int8), len(X)),
+                    "poi": poi,
+                    "dist_km": (dist.ravel() * EARTH_RADIUS_KM)
+                               .astype(np.float32),
+                }))
+
+        if not parts: # no POIs at all
+            parts.append(pd.DataFrame({
+                "fire": np.empty(0, dtype=np.int32),
+                "group": np.empty(0, dtype=np.int8),
+                "rank": np.empty(0, dtype=np.int8),
+                "poi": np.empty(0, dtype=np.int32),
+                "dist_km": np.empty(0, dtype=np.float32),
+            }))
+        result = pd.concat(parts, axis=0, ignore_index=True)
+        result["group"] = pd.Categorical.from_codes(
+            result["group"].to_numpy().astype(np.int8), categories=GROUPS)
+        result = result.sort_values(["fire", "group", "rank"],
+                                    kind="stable", ignore_index=True)
+        poi = result["poi"].to_numpy()
+        result["type"] = pd.Categorical.from_codes(
+            self.types.cat.codes.to_numpy()[poi], dtype=self.types.dtype)
+        result["subtype"] = pd.Categorical.from_codes(
+            self.subtypes.cat.codes.to_numpy()[poi], dtype=self.subtypes.dtype)
+        return result
@@ -0,0 +1,256 @@
+"""
+Precomputed multi-resolution density of a point set (a complete quadtree
+stored level by level), so that densities for any bbox and resolution are
+read from cached cells instead of re-evaluating a KDE on a new grid.
+
+Level d splits the (padded) root bbox into 2**d x 2**d cells and holds
+    counts[d]   : number of points per cell
+    smoothed[d] : mean kernel density per cell
+The finest level is smoothed with the gaussian kernel of the haversine
+KDE (bandwidth in radians, see analysis/scoring.py), in the local
+equirectangular approximation around the center latitude; every coarser
+level is the 2x2 mean of the level below, so a cell of any level holds
+the mean density over its area. Densities are normalised like
+exp(KernelDensity.score_samples), i.e. per steradian.
+
+How to:
+1) build once per point set (same limits for sets that are compared)
+    tourism = DensityPyramid.build(lat_t, lon_t, limits)
+    fires   = DensityPyramid.build(lat_f, lon_f, limits)
+2) query
+    x, y, z = tourism.density_grid(limits, shape=(200, 500))  # as kde_grid
+    z = tourism.density(lat, lon)                            # at points
+    n = fires.count((42, 43, -9, -8))                        # in a bbox
+    r = correlate(tourism, fires, limits, shapes=[(20, 20), (80, 80)])
+3) save / load
+    tourism.save("tourism_density.npz")
+    tourism = DensityPyramid.load("tourism_density.npz")
+"""
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple
+
+# own stuff
+import analysis.scoring as ascore
+
+# CONSTANTS
+# ----------------------------------------------------
+MAX_DEPTH = 11      # 2048 x 2048 cells at the finest level
+CELLS_PER_SIGMA = 2 # finest cells per bandwidth, chooses the depth
+PADDING = 4         # bandwidths added around the limits, so that points
+                    # just outside still contribute to densities inside
+# ----------------------------------------------------
+
+Limits = Tuple[float, float, float, float]
+
+
+class DensityPyramid():
+    def __init__(self, root: Limits, counts: List[np.ndarray],
+                 smoothed: List[np.ndarray], n_points: int,
+                 bandwidth: float):
+        """ Use DensityPyramid.build or DensityPyramid.load. """
+        self.root = tuple(float(v) for v in root)
+        self.counts = counts
+        self.smoothed = smoothed
+        self.n_points = n_points
+        self.bandwidth = bandwidth
+        self.depth = len(counts) - 1
+        self._count_table = None # summed-area table of counts[depth]
+
+    @classmethod
+    def build(cls, lat: np.ndarray, lon: np.ndarray, limits: Limits,
+              bandwidth: float = ascore.BANDWIDTH,
+              depth: Optional[int] = None) -> "DensityPyramid":
+        """
+        Args:
+            lat, lon: points in degrees; points outside the padded
+                limits are ignored
+            limits: (lat_min, lat_max, lon_min, lon_max) of the queries
+            bandwidth: of the gaussian kernel, in radians
+            depth: of the finest level; by default the smallest depth with
+                CELLS_PER_SIGMA cells per bandwidth, at most MAX_DEPTH
+        """
+        from scipy.ndimage import gaussian_filter
+
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        root, cos_lat = _padded_root(limits, bandwidth)
+        lat_min, lat_max, lon_min, lon_max = root
+        h_deg = np.rad2deg(bandwidth)
+        if depth is None:
+            extent = max(lat_max - lat_min, (lon_max - lon_min) * cos_lat)
+            depth = int(np.ceil(np.log2(extent * CELLS_PER_SIGMA / h_deg)))
+            depth = min(max(depth, 0), MAX_DEPTH)
+        size = 1 << depth
+
+        # finest counts, row-major cell keys as in visualisation/aggregate.py
+        row = np.floor((lat - lat_min) / (lat_max - lat_min) * size)
+        col = np.floor((lon - lon_min) / (lon_max - lon_min) * size)
+        inside = (row >= 0) & (row < size) & (col >= 0) & (col < size)
+        cell = row[inside].astype(np.int64) * size + col[inside].astype(np.int64)
+        finest = np.bincount(cell, minlength=size * size)\
+                   .reshape(size, size).astype(np.float32)
+
+        # gaussian_filter normalises its kernel to sum 1 over the cells, so
+        # dividing by the cell area (sr) and n gives the KDE normalisation
+        sigma = (h_deg / ((lat_max - lat_min) / size),
+                 h_deg / ((lon_max - lon_min) / size * cos_lat))
+        smooth = gaussian_filter(finest, sigma, mode="constant", truncate=4.0)
+        cell_area = np.deg2rad((lat_max - lat_min) / size) \
+                    * np.deg2rad((lon_max - lon_min) / size) * cos_lat
+        smooth /= max(len(lat), 1) * cell_area
+
+        counts, smoothed = [finest], [smooth.astype(np.float32)]
+        for _ in range(depth):
+            counts.append(_pool(counts[-1], np.sum))
+            smoothed.append(_pool(smoothed[-1], np.mean))
+        return cls(root, counts[::-1], smoothed[::-1], len(lat), bandwidth)
+
+    # queries
+    # ----------------------------------------------------
+    def level_for(self, cell_deg: float) -> int:
+        """ Coarsest level whose cells are at most cell_deg degrees. """
+        lat_min, lat_max, lon_min, lon_max = self.root
+        extent = max(lat_max - lat_min, lon_max - lon_min)
+        level = int(np.ceil(np.log2(extent / max(cell_deg, 1e-12))))
+        return min(max(level, 0), self.depth)
+
+    def density(self, lat: np.ndarray, lon: np.ndarray,
+                level: Optional[int] = None) -> np.ndarray:
+        """
+        Density at points, bilinear between the cell centers of a level
+        (default: the finest). Points outside the root bbox get 0.
+        """
+        from scipy.ndimage import map_coordinates
+
+        level = self.depth if level is None else level
+        grid = self.smoothed[level]
+        size = grid.shape[0]
+        lat_min, lat_max, lon_min, lon_max = self.root
+        rows = (np.asarray(lat) - lat_min) / (lat_max - lat_min) * size - 0.5
+        cols = (np.asarray(lon) - lon_min) / (lon_max - lon_min) * size - 0.5
+        return map_coordinates(grid, [np.ravel(rows), np.ravel(cols)],
+                               order=1, mode="nearest")\
+               .reshape(np.shape(rows)) \
+               * _inside(self.root, lat, lon)
+
+    def density_grid(self, limits: Limits,
+                     shape: Tuple[int, int] = (200, 500)
+                     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Density on a regular grid, the same (x, y, z) as
+        visualisation.contours.kde_grid. Each grid point reads the level
+        whose cells match the grid spacing, so coarse grids see the mean
+        density around their points rather than point samples.
+        """
+        lat_min, lat_max, lon_min, lon_max = limits
+        x = np.linspace(lon_min, lon_max, shape[1])
+        y = np.linspace(lat_min, lat_max, shape[0])
+        spacing = min((lat_max - lat_min) / max(shape[0] - 1, 1),
+                      (lon_max - lon_min) / max(shape[1] - 1, 1))
+        grid_lon, grid_lat = np.meshgrid(x, y)
+        z = self.density(grid_lat, grid_lon, self.level_for(spacing))
+        return x, y, z
+
+    def count(self, limits: Limits) -> int:
+        """
+        Number of points in the finest cells whose centers are inside
+        limits, from a summed-area table (O(1) per query).
+        """
+        if self._count_table is None:
+            self._count_table = _summed_area(self.counts[self.depth])
+        r0, r1, c0, c1 = self._cell_range(limits)
+        t = self._count_table
+        return int(round(t[r1, c1] - t[r0, c1] - t[r1, c0] + t[r0, c0]))
+
+    def _cell_range(self, limits: Limits) -> Tuple[int, int, int, int]:
+        size = 1 << self.depth
+        lat_min, lat_max, lon_min, lon_max = self.root
+        def index(v, vmin, vmax):
+            i = np.ceil((v - vmin) / (vmax - vmin) * size - 0.5)
+            return int(min(max(i, 0), size))
+        return (index(limits[0], lat_min, lat_max),
+                index(limits[1], lat_min, lat_max),
+                index(limits[2], lon_min, lon_max),
+                index(limits[3], lon_min, lon_max))
+
+    # persistence
+    # ----------------------------------------------------
+    def save(self, path: str) -> None:
+        arrays = {f"counts_{d}": c for d, c in enumerate(self.counts)}
+        arrays.update({f"smoothed_{d}": s for d, s in enumerate(self.smoothed)})
+        np.savez(path, root=np.array(self.root), n_points=self.n_points,
+                 bandwidth=self.bandwidth, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "DensityPyramid":
+        with np.load(path) as npz:
+            depth = sum(k.startswith("counts_") for k in npz.files) - 1
+            return cls(tuple(npz["root"]),
+                       [npz[f"counts_{d}"] for d in range(depth + 1)],
+                       [npz[f"smoothed_{d}"] for d in range(depth + 1)],
+                       int(npz["n_points"]), float(npz["bandwidth"]))
+
+
+def correlate(a: DensityPyramid, b: DensityPyramid, limits: Limits,
+              shapes: List[Tuple[int, int]] = ((20, 20),),
+              log: bool = False) -> Dict[Tuple[int, int], float]:
+    """
+    Pearson correlation of the densities of a and b on probe grids of
+    several resolutions, np.corrcoef(scores_tourism, scores_fire) of
+    analysis.ipynb at several scales.
+
+    Args:
+        a, b: pyramids built with the same limits and bandwidth
+        log: correlate log densities as the notebook does (score_samples);
+            zero densities are raised to the smallest positive one
+
+    Returns:
+        dict probe grid shape -> correlation coefficient
+    """
+    if a.root != b.root or a.depth != b.depth:
+        raise ValueError("pyramids must be built with the same limits "
+                         "and depth")
+    result = {}
+    for shape in shapes:
+        za = a.density_grid(limits, shape)[2].ravel()
+        zb = b.density_grid(limits, shape)[2].ravel()
+        if log:
+            za, zb = _log(za), _log(zb)
+        result[tuple(shape)] = float(np.corrcoef(za, zb)[0, 1])
+    return result
+
+
+def _padded_root(limits: Limits, bandwidth: float) -> Tuple[Limits, float]:
+    lat_min, lat_max, lon_min, lon_max = limits
+    cos_lat = np.cos(np.deg2rad((lat_min + lat_max) / 2))
+    pad = PADDING * np.rad2deg(bandwidth)
+    return ((lat_min - pad, lat_max + pad,
+             lon_min - pad / cos_lat, lon_max + pad / cos_lat), cos_lat)
+
+
+def _pool(grid: np.ndarray, reduce) -> np.ndarray:
+    """ 2x2 blocks of grid -> one cell of the parent level. """
+    n = grid.shape[0] // 2
+    return reduce(grid.reshape(n, 2, n, 2), axis=(1, 3)).astype(grid.dtype)
+
+
+def _summed_area(grid: np.ndarray) -> np.ndarray:
+    """ (n+1, n+1) table t with t[i, j] = grid[:i, :j].sum(). """
+    table = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(grid, axis=0, dtype=np.float64), axis=1,
+              out=table[1:, 1:])
+    return table
+
+
+def _inside(root: Limits, lat, lon) -> np.ndarray:
+    lat_min, lat_max, lon_min, lon_max = root
+    lat, lon = np.asarray(lat), np.asarray(lon)
+    return ((lat >= lat_min) & (lat <= lat_max)
+            & (lon >= lon_min) & (lon <= lon_max))
+
+
+def _log(z: np.ndarray) -> np.ndarray:
+    positive = z[z > 0]
+    floor = positive.min() if len(positive) else 1.
+    return np.log(np.maximum(z, floor))
@@ -0,0 +1,284 @@
+"""
+What-if attribution for POI categories: the tourism / non-tourism
+attribution of analysis/scoring.py when categories (values of the "type"
+column, or "type:subtype" pairs) are removed, added to either side or
+reweighted, for many scenarios at once.
+
+The KDE of a set of POIs is a weighted sum of per-category kernel sums,
+    density(x) = sum_c w_c S_c(x) / (sum_c w_c n_c),
+so the (normalised) kernel sums S_c at every fire are computed once (one
+KDE per category) and a scenario is a pair of weight vectors (w_tourism,
+w_non_tourism) over the categories. All scenarios are then
+    log density = log(P @ W) - log(n @ W)
+for a (n_fires, n_categories) matrix P and a (n_categories, n_scenarios)
+matrix W. Rows of P are scaled by their maximum (log-sum-exp), which does
+not change the attribution and keeps far-away fires from underflowing.
+
+Python:
+    engine = ScenarioEngine.from_pois(pois, fires)
+    scenarios = [engine.scenario("baseline"),
+                 engine.scenario("no shops", remove=["shop"]),
+                 engine.scenario("leisure as tourism",
+                                 tourism=["tourism", "leisure"]),
+                 engine.scenario("double tourism", scale={"tourism": 2})]
+    summary = engine.summarize(scenarios)      # one row per scenario
+    fires_b = engine.attribute(fires, scenarios[1])
+
+Command line (scenarios as a JSON list of keyword arguments of
+ScenarioEngine.scenario, e.g. [{"name": "no shops", "remove": ["shop"]}]):
+    python -m analysis.scenarios \\
+        --fires fire/data/fires_spain_since_2010.csv \\
+        --pois tourism/data.csv --scenarios scenarios.json --out summary.csv
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# own stuff
+import analysis.scoring as ascore
+
+# CONSTANTS
+# ----------------------------------------------------
+ROW_CHUNK = 20000 # fires per block of the batched evaluation
+# ----------------------------------------------------
+
+
+class Scenario():
+    """ Category weights of the tourism and the non-tourism density. """
+    def __init__(self, name: str, w_tourism: np.ndarray,
+                 w_non_tourism: np.ndarray):
+        self.name = name
+        self.w_tourism = w_tourism
+        self.w_non_tourism = w_non_tourism
+
+    def __repr__(self) -> str:
+        return f"Scenario({self.name!r})"
+
+
+class ScenarioEngine():
+    """
+    How to:
+    1) compute the per-category kernel sums at the fires once
+        engine = ScenarioEngine.from_pois(pois, fires, n_jobs=4)
+    2) define and evaluate any number of scenarios
+        summary = engine.summarize([engine.scenario("no shops",
+                                                    remove=["shop"])])
+    """
+    def __init__(self, categories: List[str], n_pois: np.ndarray,
+                 partial: np.ndarray, log_scale: np.ndarray):
+        """
+        Use ScenarioEngine.from_pois.
+
+        Args:
+            categories: category names, the columns of partial
+            n_pois: POIs per category
+            partial: (n_fires, n_categories) kernel sums, each row divided
+                by exp(log_scale) of the row
+            log_scale: (n_fires,) log of the row scale of partial
+        """
+        self.categories = list(categories)
+        self.index = {c: i for i, c in enumerate(self.categories)}
+        self.n_pois = np.asarray(n_pois, dtype=np.float64)
+        self.partial = partial
+        self.log_scale = log_scale
+
+    @classmethod
+    def from_pois(cls, pois: pd.DataFrame, fires: pd.DataFrame,
+                  column: str = "type",
+                  bandwidth: float = ascore.BANDWIDTH,
+                  atol: float = ascore.ATOL,
+                  n_jobs: int = 1) -> "ScenarioEngine":
+        """
+        Args:
+            pois: table with columns lat, lon, type and column (see
+                load_pois)
+            fires: table with columns lat, lon; the rows of all results
+            column: POI column whose values are the categories. For
+                columns other than "type" the categories are the pairs
+                "type:value", because a subtype (e.g. "hotel" or "yes")
+                can belong to tourism and to other types.
+            atol: of each per-category KDE, see analysis/scoring.py
+            n_jobs: number of processes, one KDE per category at a time
+        """
+        if column == "type":
+            keys = pois["type"]
+        else:
+            keys = pois["type"].astype(str) + ":" + pois[column].astype(str)
+        codes, categories = pd.factorize(keys, sort=True)
+        lat = pois["lat"].to_numpy()
+        lon = pois["lon"].to_numpy()
+        X = ascore.to_radians(fires["lat"].to_numpy(),
+                              fires["lon"].to_numpy())
+
+        def log_kernel_sum(c):
+            kde = ascore.fit_kde(lat[codes == c], lon[codes == c],
+                                 bandwidth, atol)
+            # score_samples = log(kernel sum / n_c), the kernel normalised
+            return kde.score_samples(X) + np.log(np.count_nonzero(codes == c))
+
+        columns = Parallel(n_jobs=n_jobs)(
+            delayed(log_kernel_sum)(c) for c in range(len(categories)))
+        log_partial = np.stack(columns, axis=1) if columns \
+                      else np.empty((len(X), 0))
+        log_scale = log_partial.max(axis=1) if len(categories) \
+                    else np.zeros(len(X))
+        partial = np.exp(log_partial - log_scale[:, None])
+
+        n_pois = np.bincount(codes[codes >= 0], minlength=len(categories))
+        return cls(list(categories), n_pois, partial, log_scale)
+
+    # scenarios
+    # ----------------------------------------------------
+    def scenario(self, name: str = "baseline",
+                 tourism: Iterable[str] = (ascore.TOURISM,),
+                 remove: Iterable[str] = (),
+                 scale: Optional[Dict[str, float]] = None) -> Scenario:
+        """
+        Args:
+            tourism: categories that form the tourism density, all other
+                categories form the non-tourism density
+            remove: categories left out of both
+            scale: category -> weight, e.g. {"hotel": 2} to count every
+                hotel twice (a category with more POIs), 0.5 for half
+
+        With "type:subtype" categories, a type or a subtype stands for all
+        categories with it, e.g. "tourism" for all tourism subtypes and
+        "hotel" for "tourism:hotel" and "building:hotel".
+        """
+        w = np.ones(len(self.categories))
+        for category, weight in (scale or {}).items():
+            w[self._indices(category)] = weight
+        for category in remove:
+            w[self._indices(category)] = 0.
+        is_tourism = np.zeros(len(self.categories), dtype=bool)
+        for category in tourism:
+            is_tourism[self._indices(category)] = True
+        return Scenario(name, np.where(is_tourism, w, 0.),
+                        np.where(is_tourism, 0., w))
+
+    def _indices(self, category: str) -> List[int]:
+        if category in self.index:
+            return [self.index[category]]
+        indices = [i for i, c in enumerate(self.categories)
+                   if category in c.split(":", 1)]
+        if not indices:
+            raise KeyError(f"unknown category {category!r}")
+        return indices
+
+    # evaluation
+    # ----------------------------------------------------
+    def log_scores(self, scenarios: List[Scenario], n_jobs: int = 1
+                  ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            (log density of tourism, log density of non-tourism), each
+            (n_fires, n_scenarios); the same as AttributionModel.log_scores
+            with the POIs of each scenario. A side without POIs gets -inf.
+        """
+        W_t = np.stack([s.w_tourism for s in scenarios], axis=1)
+        W_nt = np.stack([s.w_non_tourism for s in scenarios], axis=1)
+        W = np.concatenate([W_t, W_nt], axis=1)
+        n = self.n_pois @ W
+
+        blocks = [slice(i, i + ROW_CHUNK)
+                  for i in range(0, len(self.partial), ROW_CHUNK)]
+        # matmul releases the GIL, so threads share partial without copies
+        sums = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(np.matmul)(self.partial[b], W) for b in blocks)
+        sums = np.concatenate(sums, axis=0) if sums \
+               else np.empty((0, W.shape[1]))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_density = (np.log(sums) + self.log_scale[:, None]
+                           - np.log(n)[None, :])
+        log_density[:, n == 0] = -np.inf
+        return log_density[:, :len(scenarios)], log_density[:, len(scenarios):]
+
+    def summarize(self, scenarios: List[Scenario],
+                  n_jobs: int = 1) -> pd.DataFrame:
+        """
+        Returns:
+            one row per scenario with the columns
+                "scenario"             : name
+                "n_tourism_pois"       : POIs weighted into the tourism side
+                "n_non_tourism_pois"   : the same for non-tourism
+                "n_fires"              : fires scored
+                "n_tourism_correlated" : fires with log_t > log_nt
+                "share_tourism"        : n_tourism_correlated / n_fires
+        """
+        log_t, log_nt = self.log_scores(scenarios, n_jobs)
+        correlated = np.count_nonzero(log_t > log_nt, axis=0)
+        n_fires = len(self.partial)
+        return pd.DataFrame({
+            "scenario": [s.name for s in scenarios],
+            "n_tourism_pois": [float(self.n_pois @ s.w_tourism)
+                               for s in scenarios],
+            "n_non_tourism_pois": [float(self.n_pois @ s.w_non_tourism)
+                                   for s in scenarios],
+            "n_fires": n_fires,
+            "n_tourism_correlated": correlated,
+            "share_tourism": correlated / max(n_fires, 1),
+        })
+
+    def attribute(self, fires: pd.DataFrame,
+                  scenario: Scenario) -> pd.DataFrame:
+        """
+        AttributionModel.attribute of one scenario; fires must be the
+        table the engine was built with.
+        """
+        if len(fires) != len(self.partial):
+            raise ValueError("fires is not the table of the engine")
+        log_t, log_nt = self.log_scores([scenario])
+        return fires.assign(score_tourism      = log_t[:, 0],
+                            score_non_tourism  = log_nt[:, 0],
+                            tourism_correlated = log_t[:, 0] > log_nt[:, 0])
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Attribution of fires for POI category scenarios.")
+    parser.add_argument("--fires", required=True, help="fire table (CSV)")
+    parser.add_argument("--pois", nargs="+", required=True,
+                        help="tourism/data*.csv files")
+    parser.add_argument("--scenarios", default=None,
+                        help="JSON list of scenarios; default: one "
+                             "scenario per category left out")
+    parser.add_argument("--column", default="type",
+                        choices=["type", "subtype"])
+    parser.add_argument("--limits", nargs=4, type=float, default=None,
+                        metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"))
+    parser.add_argument("--bandwidth", type=float, default=ascore.BANDWIDTH)
+    parser.add_argument("--atol", type=float, default=ascore.ATOL)
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--out", default=None,
+                        help="CSV file to write the summary to")
+    args = parser.parse_args(argv)
+
+    pois = ascore.load_pois(args.pois)
+    limits = args.limits or ascore.bbox_of(pois)
+    # the bounds of analysis/attribution.py
+    fires = ascore.filter_bbox(pd.read_csv(args.fires), limits,
+                               inclusive=True).reset_index(drop=True)
+    engine = ScenarioEngine.from_pois(pois, fires, args.column,
+                                      args.bandwidth, args.atol, args.n_jobs)
+
+    if args.scenarios:
+        with open(args.scenarios, "rt") as f:
+            scenarios = [engine.scenario(**s) for s in json.load(f)]
+    else:
+        scenarios = [engine.scenario()] + [
+            engine.scenario(f"without {c}", remove=[c])
+            for c in engine.categories]
+    summary = engine.summarize(scenarios, args.n_jobs)
+    if args.out:
+        summary.to_csv(args.out, index=False)
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
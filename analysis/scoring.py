@@ -0,0 +1,175 @@
+"""
+Density models for attributing fires to tourism or non-tourism activity.
+
+A fire is "tourism correlated" if the kernel density of tourism POIs at the
+fire location is higher than the density of non-tourism POIs, i.e.
+score_tourism > score_non_tourism as in visualisation/folium_map.py.
+"""
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.neighbors import KernelDensity
+
+from typing import List, Tuple, Optional
+
+# own stuff
+import tourism.encoding as tenc
+
+# CONSTANTS
+# ----------------------------------------------------
+BANDWIDTH = 5e-4 # radians, as used in folium_map.py and the notebooks
+ATOL      = 0.1  # absolute tolerance of the KDE tree approximation
+TOURISM   = "tourism" # value of the type column for tourism POIs
+# ----------------------------------------------------
+
+
+def load_pois(paths: List[str]) -> pd.DataFrame:
+    """
+    Reads and concatenates tourism/data*.csv files.
+
+    Args:
+        paths: CSV files as written by tourism/tourism.py
+
+    Returns:
+        pandas.DataFrame with columns lat, lon (float32) and type, subtype
+        (categoricals of the shared vocabulary, see tourism/encoding.py)
+    """
+    return tenc.read_pois(paths)
+
+
+def filter_bbox(df: pd.DataFrame,
+                limits: Tuple[float, float, float, float],
+                inclusive: bool = False) -> pd.DataFrame:
+    """
+    Keeps rows inside limits = (lat_min, lat_max, lon_min, lon_max).
+
+    Args:
+        inclusive: if False (default), rows on the border are dropped
+            as in folium_map.py, otherwise kept as in the notebooks.
+    """
+    lat_min, lat_max, lon_min, lon_max = limits
+    lat = df["lat"].to_numpy()
+    lon = df["lon"].to_numpy()
+    if inclusive:
+        inside = ((lat >= lat_min) & (lat <= lat_max)
+                  & (lon >= lon_min) & (lon <= lon_max))
+    else:
+        inside = ((lat > lat_min) & (lat < lat_max)
+                  & (lon > lon_min) & (lon < lon_max))
+    return df.loc[inside]
+
+
+def bbox_of(df: pd.DataFrame) -> Tuple[float, float, float, float]:
+    """
+    Returns (lat_min, lat_max, lon_min, lon_max) of a table with lat, lon.
+    """
+    lat = df["lat"].to_numpy()
+    lon = df["lon"].to_numpy()
+    return lat.min(), lat.max(), lon.min(), lon.max()
+
+
+def to_radians(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Stacks lat, lon (degrees) into an (n, 2) array in radians, the
+    input format expected by the haversine KDE.
+    """
+    X = np.empty((len(lat), 2), dtype=np.float64)
+    X[:, 0] = lat
+    X[:, 1] = lon
+    return np.deg2rad(X, out=X)
+
+
+def fit_kde(lat: np.ndarray, lon: np.ndarray,
+            bandwidth: float = BANDWIDTH, atol: float = ATOL) -> KernelDensity:
+    kde = KernelDensity(kernel="gaussian", bandwidth=bandwidth,
+                        metric="haversine", atol=atol)
+    return kde.fit(to_radians(lat, lon))
+
+
+def score_samples(kde: KernelDensity, X: np.ndarray, n_jobs: int = 1,
+                  chunk_size: int = 50000) -> np.ndarray:
+    """
+    kde.score_samples(X), split into chunks that are scored in n_jobs
+    worker processes (the KDE tree holds the GIL, so threads won't help).
+    """
+    if n_jobs == 1 or len(X) <= chunk_size:
+        return kde.score_samples(X)
+    chunks = [X[i:i + chunk_size] for i in range(0, len(X), chunk_size)]
+    scores = Parallel(n_jobs=n_jobs)(
+        delayed(kde.score_samples)(c) for c in chunks)
+    return np.concatenate(scores)
+
+
+class AttributionModel():
+    """
+    Holds the fitted tourism and non-tourism KDEs and scores fires
+    against both.
+
+    How to:
+    1) fit both density models once
+        model = AttributionModel.from_pois(pois)
+    2) score any number of fire tables
+        attributed = model.attribute(fire_df)
+    """
+    def __init__(self, kde_tourism: KernelDensity,
+                 kde_non_tourism: KernelDensity):
+        self.kde_tourism = kde_tourism
+        self.kde_non_tourism = kde_non_tourism
+
+    @classmethod
+    def from_pois(cls, pois: pd.DataFrame,
+                  limits: Optional[Tuple[float, float, float, float]] = None,
+                  bandwidth: float = BANDWIDTH,
+                  atol: float = ATOL) -> "AttributionModel":
+        """
+        Args:
+            pois: table with columns lat, lon, type (see load_pois)
+            limits: optional (lat_min, lat_max, lon_min, lon_max) to
+                restrict the POIs to before fitting
+        """
+        if limits is not None:
+            pois = filter_bbox(pois, limits)
+        is_tourism = (pois["type"] == TOURISM).to_numpy()
+        lat = pois["lat"].to_numpy()
+        lon = pois["lon"].to_numpy()
+        return cls(
+            fit_kde(lat[is_tourism], lon[is_tourism], bandwidth, atol),
+            fit_kde(lat[~is_tourism], lon[~is_tourism], bandwidth, atol))
+
+    def log_scores(self, lat: np.ndarray, lon: np.ndarray,
+                   n_jobs: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Args:
+            n_jobs: number of processes used for scoring, see score_samples
+
+        Returns:
+            (log density of tourism, log density of non-tourism) at
+            each location. Comparing log densities gives the same
+            attribution as comparing densities, without underflow.
+        """
+        X = to_radians(lat, lon)
+        if len(X) == 0:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty.copy()
+        return (score_samples(self.kde_tourism, X, n_jobs),
+                score_samples(self.kde_non_tourism, X, n_jobs))
+
+    def attribute(self, fires: pd.DataFrame, n_jobs: int = 1) -> pd.DataFrame:
+        """
+        Scores fires against both density models.
+
+        Args:
+            fires: table with at least the columns lat and lon
+            n_jobs: number of processes used for scoring
+
+        Returns:
+            copy of fires with the added columns
+                "score_tourism"      : float : log density of tourism POIs
+                "score_non_tourism"  : float : log density of other POIs
+                "tourism_correlated" : bool  : score_tourism > score_non_tourism
+        """
+        log_t, log_nt = self.log_scores(fires["lat"].to_numpy(),
+                                        fires["lon"].to_numpy(), n_jobs)
+        return fires.assign(score_tourism      = log_t,
+                            score_non_tourism  = log_nt,
+                            tourism_correlated = log_t > log_nt)
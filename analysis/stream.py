@@ -0,0 +1,233 @@
+"""
+Long-lived scorer that attributes incoming fire detections in micro-batches.
+
+The density models are fitted once; fire detections then arrive from a
+Python iterator, a growing CSV file or a directory that receives new CSV
+files (e.g. one per ingested MODIS day). Rows are emitted as soon as either
+batch_size rows are buffered or max_latency seconds have passed since the
+oldest buffered row arrived.
+
+Example (command line):
+    python -m analysis.stream --pois tourism/data.csv --watch incoming/
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+from queue import Queue, Empty
+from threading import Thread, Event
+
+import pandas as pd
+
+from typing import Iterable, Iterator, List, Optional, Union
+
+# own stuff
+import analysis.scoring as ascore
+
+FIRE_COLUMNS = ["lat", "lon", "fire_val", "date"]
+
+_END = object() # sentinel marking the end of a source
+
+
+def tail_csv(path: str, poll_interval: float = 1.0,
+             stop: Optional[Event] = None) -> Iterator[pd.DataFrame]:
+    """
+    Follows a CSV file (like `tail -f`) and yields the complete lines that
+    were appended since the last poll as a DataFrame.
+
+    Args:
+        path: CSV file with a header line, e.g. fires_spain_since_2010.csv
+        poll_interval: seconds to wait when no new data is available
+        stop: the generator returns once this event is set
+    """
+    stop = stop or Event()
+    with open(path, "rt") as f:
+        header = f.readline()
+        while not header.endswith("\n"):
+            if stop.wait(poll_interval):
+                return
+            header += f.readline()
+
+        partial = ""
+        while not stop.is_set():
+            chunk = f.read()
+            if not chunk:
+                stop.wait(poll_interval)
+                continue
+            # only parse complete lines, keep the rest for the next poll
+            chunk = partial + chunk
+            cut = chunk.rfind("\n") + 1
+            complete, partial = chunk[:cut], chunk[cut:]
+            if complete:
+                yield pd.read_csv(io.StringIO(header + complete))
+
+
+def watch_directory(path: str, pattern: str = "*.csv",
+                    poll_interval: float = 1.0,
+                    stop: Optional[Event] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yields the content of every file matching pattern in path, including
+    files that appear later. Files are read in name order, so date-stamped
+    file names are processed chronologically.
+
+    Details:
+        Writers should move finished files into the directory (rename is
+        atomic), otherwise a half-written file may be picked up.
+        Only files still in the directory are remembered, so consumers can
+        delete processed files; a file that reappears is read again.
+    """
+    stop = stop or Event()
+    seen = set()
+    while not stop.is_set():
+        files = set(glob.glob(os.path.join(path, pattern)))
+        seen &= files # forget deleted files, seen stays bounded
+        new_files = sorted(files - seen)
+        for fpath in new_files:
+            seen.add(fpath)
+            yield pd.read_csv(fpath)
+        if not new_files:
+            stop.wait(poll_interval)
+
+
+def _to_frame(item: Union[pd.DataFrame, dict, tuple, list]) -> pd.DataFrame:
+    if isinstance(item, pd.DataFrame):
+        return item
+    if isinstance(item, dict):
+        return pd.DataFrame([item])
+    return pd.DataFrame([item], columns=FIRE_COLUMNS[:len(item)])
+
+
+class StreamingScorer():
+    """
+    Attributes fire detections from any source in micro-batches.
+
+    How to:
+    1) fit the density models once
+        scorer = StreamingScorer(AttributionModel.from_pois(pois))
+    2) iterate over scored batches
+        for batch in scorer.run(watch_directory("incoming/")):
+            ...
+
+    A source is any iterable of DataFrames (micro-batches), dicts (single
+    rows) or tuples (lat, lon, fire_val, date).
+    """
+    def __init__(self, model: ascore.AttributionModel,
+                 batch_size: int = 1000, max_latency: float = 1.0):
+        """
+        Args:
+            model: fitted density models
+            batch_size: maximum number of fires scored at once
+            max_latency: maximum number of seconds a fire waits in the
+                buffer before its batch is scored
+        """
+        self.model = model
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+
+    def score_batch(self, fires: pd.DataFrame) -> pd.DataFrame:
+        return self.model.attribute(fires.reset_index(drop=True))
+
+    def run(self, source: Iterable) -> Iterator[pd.DataFrame]:
+        """
+        Scores the fires of source and yields one attributed DataFrame per
+        micro-batch (see AttributionModel.attribute for the added columns).
+        """
+        # the source is consumed by a reader thread, so that a blocking
+        # source (tail, watch) does not hold back buffered rows
+        q = Queue(maxsize=64)
+        reader = Thread(target=_read_source, args=(source, q))
+        reader.daemon = True
+        reader.start()
+
+        buffered: List[pd.DataFrame] = []
+        n_buffered = 0
+        deadline = None
+        finished = False
+        error = None
+        while not finished:
+            timeout = None if deadline is None \
+                      else max(0., deadline - time.monotonic())
+            try:
+                item = q.get(timeout=timeout)
+            except Empty:
+                item = None # latency bound reached
+
+            if item is _END:
+                finished = True
+            elif isinstance(item, BaseException):
+                # score the rows read before the error, then raise it
+                error = item
+                finished = True
+            elif item is not None:
+                frame = _to_frame(item)
+                if len(frame) > 0:
+                    buffered.append(frame)
+                    n_buffered += len(frame)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.max_latency
+
+            if n_buffered == 0:
+                continue
+            if (finished or n_buffered >= self.batch_size
+                or time.monotonic() >= deadline):
+                pending = pd.concat(buffered, axis=0, ignore_index=True)
+                for start in range(0, len(pending), self.batch_size):
+                    yield self.score_batch(
+                        pending.iloc[start:start + self.batch_size])
+                buffered, n_buffered, deadline = [], 0, None
+        if error is not None:
+            raise error
+
+
+def _read_source(source: Iterable, q: Queue) -> None:
+    try:
+        for item in source:
+            q.put(item)
+    except Exception as e:
+        q.put(e) # re-raised by the consumer
+    q.put(_END)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Attribute incoming fires to tourism / non-tourism.")
+    parser.add_argument("--pois", nargs="+", required=True,
+                        help="tourism/data*.csv files to fit the KDEs on")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--tail", help="CSV file to follow")
+    src.add_argument("--watch", help="directory to watch for new CSV files")
+    parser.add_argument("--pattern", default="*.csv")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--max-latency", type=float, default=1.0)
+    parser.add_argument("--bandwidth", type=float, default=ascore.BANDWIDTH)
+    parser.add_argument("--out", default=None,
+                        help="CSV file to append results to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    model = ascore.AttributionModel.from_pois(
+        ascore.load_pois(args.pois), bandwidth=args.bandwidth)
+    scorer = StreamingScorer(model, args.batch_size, args.max_latency)
+
+    if args.tail:
+        source = tail_csv(args.tail)
+    else:
+        source = watch_directory(args.watch, args.pattern)
+
+    write_header = args.out is None or not os.path.exists(args.out)
+    out = sys.stdout if args.out is None else open(args.out, "a")
+    try:
+        for batch in scorer.run(source):
+            batch.to_csv(out, header=write_header, index=False)
+            out.flush()
+            write_header = False
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
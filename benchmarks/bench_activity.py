@@ -0,0 +1,49 @@
+"""
+Latency of tourism.activity radius queries.
+
+Run from the repository root:
+    python -m benchmarks.bench_activity --csv tourism/data.csv
+"""
+import argparse
+import time
+
+import numpy as np
+
+# own stuff
+from tourism.activity import ActivityIndex
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", nargs="+", default=["tourism/data.csv"])
+    parser.add_argument("--n", type=int, default=5000,
+                        help="number of single-point queries")
+    parser.add_argument("--radius", type=float, default=5)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    index = ActivityIndex.from_csv(args.csv)
+    print(f"index built in {time.perf_counter() - t0:.2f} s")
+
+    # query locations spread over the bounding box of the indexed POIs
+    rng = np.random.default_rng(0)
+    lat_lng = np.rad2deg(index.tree.data)
+    lo, hi = lat_lng.min(axis=0), lat_lng.max(axis=0)
+    locations = rng.uniform(lo, hi, size=(args.n, 2))
+
+    latencies = np.empty(args.n)
+    for i, (lat, lng) in enumerate(locations):
+        t0 = time.perf_counter()
+        index.query(lat, lng, args.radius)
+        latencies[i] = time.perf_counter() - t0
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+    print(f"single queries: p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+
+    t0 = time.perf_counter()
+    index.query_many(locations[:, 0], locations[:, 1], args.radius)
+    t = time.perf_counter() - t0
+    print(f"batch of {args.n}: {t * 1e3:.1f} ms ({t / args.n * 1e6:.1f} us per location)")
+
+
+if __name__ == "__main__":
+    main()
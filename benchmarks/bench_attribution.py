@@ -0,0 +1,107 @@
+"""
+Benchmark of analysis.attribution against the per-row logic of
+analysis_local.ipynb and tourism_data_analysis.ipynb.
+
+Run from the repository root:
+    python -m benchmarks.bench_attribution --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# own stuff
+import analysis.attribution as aattr
+import analysis.scoring as ascore
+
+
+def synthetic_fires(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "lat": rng.uniform(41.8, 43.8, n),
+        "lon": rng.uniform(-9.3, -6.7, n),
+        "fire_val": rng.integers(7, 10, n).astype(np.uint8),
+        "date": pd.Timestamp("2019-01-01")
+                + pd.to_timedelta(rng.integers(0, 365, n), unit="D"),
+    })
+
+
+def synthetic_pois(n: int, seed: int = 1) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    types = np.array(["tourism", "shop", "place", "school", "sport"])
+    return pd.DataFrame({
+        "lat": rng.uniform(41.8, 43.8, n),
+        "lon": rng.uniform(-9.3, -6.7, n),
+        "type": types[rng.integers(0, len(types), n)],
+        "subtype": "yes",
+    })
+
+
+def notebook_row_logic(fire_data, scores_tourism, scores_non_tourism, df):
+    """ The per-row parts of the notebooks, copied as they are. """
+    X_fire = np.array([[fire_data['lon'][i], fire_data['lat'][i]]
+                       for i in range(len(fire_data))])
+    max_scores = np.ones(len(scores_tourism))
+    for i in range(len(scores_tourism)):
+        if scores_tourism[i] > scores_non_tourism[i]:
+            max_scores[i] = 1
+        else:
+            max_scores[i] = 0
+    colors = [['b','y'][int(max_scores[i])] for i in range(len(scores_tourism))]
+    types = sorted(set(df['type']))
+    type_colors = [types.index(df['type'][i]) for i in range(0, len(df))]
+    return X_fire, max_scores, colors, type_colors
+
+
+def vectorized_row_logic(fire_data, scores_tourism, scores_non_tourism, df):
+    X_fire = fire_data[["lon", "lat"]].to_numpy()
+    max_scores = (scores_tourism > scores_non_tourism).astype(np.int8)
+    colors = aattr.COLORS[max_scores]
+    type_colors, _ = aattr.category_codes(df["type"])
+    return X_fire, max_scores, colors, type_colors
+
+
+def timeit(f, *args):
+    t0 = time.perf_counter()
+    out = f(*args)
+    return time.perf_counter() - t0, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int,
+                        default=[10000, 100000, 1000000])
+    parser.add_argument("--kde-size", type=int, default=20000,
+                        help="number of fires for the end-to-end check")
+    args = parser.parse_args()
+
+    print(f"{'n':>10} {'notebook [s]':>14} {'vectorized [s]':>16} {'speedup':>9}")
+    for n in args.sizes:
+        fires = synthetic_fires(n)
+        pois = synthetic_pois(n)
+        rng = np.random.default_rng(2)
+        s_t, s_nt = rng.normal(size=n), rng.normal(size=n)
+
+        t_nb, out_nb = timeit(notebook_row_logic, fires, s_t, s_nt, pois)
+        t_vec, out_vec = timeit(vectorized_row_logic, fires, s_t, s_nt, pois)
+        for a, b in zip(out_nb, out_vec):
+            assert np.array_equal(np.asarray(a), np.asarray(b))
+        print(f"{n:>10} {t_nb:>14.3f} {t_vec:>16.4f} {t_nb / t_vec:>8.0f}x")
+
+    # end to end: same attribution as fitting the notebook's KDEs by hand
+    fires = synthetic_fires(args.kde_size)
+    pois = synthetic_pois(args.kde_size)
+    t_run, (scored, summary) = timeit(aattr.run, fires, pois)
+    is_t = pois["type"] == "tourism"
+    kde_t = ascore.fit_kde(pois.lat[is_t], pois.lon[is_t])
+    kde_nt = ascore.fit_kde(pois.lat[~is_t], pois.lon[~is_t])
+    X = np.deg2rad(scored[["lat", "lon"]].to_numpy())
+    expected = kde_t.score_samples(X) > kde_nt.score_samples(X)
+    assert np.array_equal(expected, scored["tourism_correlated"].to_numpy())
+    print(f"\nend to end with {args.kde_size} fires: {t_run:.2f} s, "
+          f"{summary['n_tourism_correlated']} tourism correlated")
+
+
+if __name__ == "__main__":
+    main()
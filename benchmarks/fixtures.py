@@ -0,0 +1,221 @@
+"""
+Deterministic synthetic inputs for the benchmarks, so that they run
+offline: MODIS-like fire mask stacks (GeoTIFF), OSM extracts (PBF),
+random fire and POI tables and an LP DAAC-like directory listing that is
+served by a local HTTP server.
+
+Every generator takes a seed; the same arguments give the same files.
+"""
+import contextlib
+import os
+import threading
+from datetime import datetime, timedelta
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+from typing import Iterator, List, Tuple
+
+# own stuff
+import fire.utils.modis as um
+
+# CONSTANTS
+# ----------------------------------------------------
+# sinusoidal projection of the MODIS land products
+SINUSOIDAL = ("+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +R=6371007.181 "
+              "+units=m +no_defs")
+SPAIN_TILES = [(17, 4), (17, 5), (18, 4), (18, 5)] # (h, v)
+# ----------------------------------------------------
+
+
+def modis_fname(sat: str, date: datetime, h: int, v: int,
+                ext: str = "tif") -> str:
+    """ Original-style file name, e.g. MOD14A1.A2019213.h17v04.006.x.tif """
+    return (f"{sat}14A1.A{date:%Y%j}.h{h:02d}v{v:02d}.006."
+            f"2019269172641.{ext}")
+
+
+def write_firemask_stack(path: str, h: int, v: int, start: datetime,
+                         n_days: int = 8, fire_rate: float = 0.002,
+                         seed: int = 0, size: int = 1200) -> str:
+    """
+    Writes a GeoTIFF that looks like the FireMask subdataset of a
+    MOD14A1 file: one uint8 band per day, a "Dates" tag and the
+    sinusoidal grid of tile (h, v). Background classes are 3 (water)
+    and 5 (land), a fraction fire_rate of the pixels are fires (7-9).
+    """
+    import rasterio as rio
+    from rasterio.transform import from_origin
+
+    rng = np.random.default_rng(seed)
+    data = np.where(rng.random((n_days, size, size)) < 0.3, 3, 5)\
+             .astype(np.uint8)
+    fires = rng.random(data.shape) < fire_rate
+    data[fires] = rng.integers(7, 10, int(fires.sum()))
+
+    pixel = float(um.T) / size
+    transform = from_origin(float(um.XMIN) + h * float(um.T),
+                            float(um.YMAX) - v * float(um.T), pixel, pixel)
+    dates = " ".join(f"{start + timedelta(days=i):%Y-%m-%d}"
+                     for i in range(n_days))
+    with rio.open(path, "w", driver="GTiff", width=size, height=size,
+                  count=n_days, dtype="uint8", crs=SINUSOIDAL,
+                  transform=transform, tiled=True, compress="deflate") as dst:
+        dst.write(data)
+        dst.update_tags(Dates=dates)
+    return path
+
+
+def firemask_stacks(directory: str, n_tiles: int, seed: int = 0,
+                    sats: Tuple[str, ...] = ("MOD",),
+                    start: datetime = datetime(2019, 8, 1)) -> List[str]:
+    """
+    n_tiles fire mask stacks per satellite, tiles taken from around Spain
+    and repeated for consecutive 8-day periods if n_tiles > 4.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(n_tiles):
+        h, v = SPAIN_TILES[i % len(SPAIN_TILES)]
+        date = start + timedelta(days=8 * (i // len(SPAIN_TILES)))
+        for j, sat in enumerate(sats):
+            path = os.path.join(directory, modis_fname(sat, date, h, v))
+            if not os.path.exists(path):
+                write_firemask_stack(path, h, v, date,
+                                     seed=seed + 100 * i + j)
+            paths.append(path)
+    return paths
+
+
+def fires(n: int, seed: int = 0) -> pd.DataFrame:
+    """ Fire table with the columns of get_fires, around Galicia. """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "lat": rng.uniform(41.8, 43.8, n),
+        "lon": rng.uniform(-9.3, -6.7, n),
+        "fire_val": rng.integers(7, 10, n).astype(np.uint8),
+        "date": pd.Timestamp("2019-01-01")
+                + pd.to_timedelta(rng.integers(0, 365, n), unit="D"),
+    })
+
+
+def pois(n: int, seed: int = 1) -> pd.DataFrame:
+    """ POI table with the columns of tourism/data*.csv. """
+    rng = np.random.default_rng(seed)
+    types = np.array(["tourism", "shop", "place", "school", "sport"])
+    subtypes = np.array(["hotel", "yes", "village", "museum", "viewpoint"])
+    return pd.DataFrame({
+        "lat": rng.uniform(41.8, 43.8, n),
+        "lon": rng.uniform(-9.3, -6.7, n),
+        "type": types[rng.integers(0, len(types), n)],
+        "subtype": subtypes[rng.integers(0, len(subtypes), n)],
+    })
+
+
+def write_pbf(path: str, n_nodes: int, seed: int = 2) -> str:
+    """
+    Writes an OSM extract with n_nodes nodes: a third tourism nodes, a
+    third with tags counted as non-tourism and a third other nodes.
+    """
+    import osmium
+
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(41.8, 43.8, n_nodes)
+    lons = rng.uniform(-9.3, -6.7, n_nodes)
+    kinds = rng.integers(0, 3, n_nodes)
+    tag_sets = [{"tourism": "hotel", "name": "x"},
+                {"shop": "bakery"},
+                {"highway": "crossing"}]
+
+    if os.path.exists(path):
+        os.remove(path) # osmium does not overwrite
+    writer = osmium.SimpleWriter(path)
+    try:
+        for i in range(n_nodes):
+            writer.add_node(osmium.osm.mutable.Node(
+                id=i + 1, version=1, location=(lons[i], lats[i]),
+                tags=tag_sets[kinds[i]]))
+    finally:
+        writer.close()
+    return path
+
+
+def write_listing(root: str, n_dates: int, files_per_date: int,
+                  file_size: int = 64 * 1024, seed: int = 3,
+                  product: str = "MOD14A1.006") -> str:
+    """
+    Writes an LP DAAC Data Pool-like tree below root:
+        {product}/index.html              links to the date directories
+        {product}/YYYY.MM.DD/index.html   links to the hdf files
+        {product}/YYYY.MM.DD/*.hdf        file_size random bytes each
+
+    Returns:
+        the product directory, relative to root
+    """
+    rng = np.random.default_rng(seed)
+    product_dir = os.path.join(root, product)
+    os.makedirs(product_dir, exist_ok=True)
+    start = datetime(2019, 1, 1)
+
+    date_links = []
+    for d in range(n_dates):
+        date = start + timedelta(days=8 * d)
+        date_dir = f"{date:%Y.%m.%d}"
+        date_links.append(f'<a href="{date_dir}/">{date_dir}/</a>')
+        os.makedirs(os.path.join(product_dir, date_dir), exist_ok=True)
+
+        file_links = ['<a href="../">Parent Directory</a>']
+        for k in range(files_per_date):
+            h, v = k % 36, (k // 36) % 18
+            fname = modis_fname("MOD", date, h, v, ext="hdf")
+            file_links.append(f'<a href="{fname}">{fname}</a>')
+            file_links.append(f'<a href="{fname}.xml">{fname}.xml</a>')
+            fpath = os.path.join(product_dir, date_dir, fname)
+            if not os.path.exists(fpath):
+                with open(fpath, "wb") as f:
+                    f.write(rng.bytes(file_size))
+        _write_index(os.path.join(product_dir, date_dir), file_links)
+
+    _write_index(product_dir, date_links)
+    return product
+
+
+def _write_index(directory: str, links: List[str]) -> None:
+    with open(os.path.join(directory, "index.html"), "wt") as f:
+        f.write("<html><body><pre>\n")
+        f.write("\n".join(links))
+        f.write("\n</pre></body></html>\n")
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    # the default backlog of 5 drops connections of parallel downloads,
+    # which then wait a full second for the TCP retransmit
+    request_queue_size = 128
+
+
+@contextlib.contextmanager
+def serve_directory(root: str) -> Iterator[str]:
+    """
+    Serves root on a free localhost port while the context is open.
+
+    Yields:
+        the base URL, e.g. "http://127.0.0.1:40123/"
+    """
+    handler = partial(_QuietHandler, directory=root)
+    httpd = _Server(("127.0.0.1", 0), handler)
+    # short poll interval: shutdown() waits for it, and this is timed
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True,
+                              kwargs={"poll_interval": 0.01})
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}/"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
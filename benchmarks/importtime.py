@@ -0,0 +1,91 @@
+"""
+Import-time budget for the entry points of the fire package.
+
+Every module is imported in a fresh interpreter with `python -X importtime`.
+The check fails if an import takes longer than its budget or pulls in one
+of the heavy libraries it must not load (plotting, geo libraries, HTTP).
+
+Run from the repository root:
+    python -m benchmarks.importtime
+    python -m benchmarks.importtime --scale 2   # e.g. on a slow CI box
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# module: (budget in ms, modules that must not be loaded by the import)
+BUDGETS = {
+    "fire.utils.modis": (250, ["pandas", "rasterio", "pyproj",
+                               "matplotlib", "cartopy"]),
+    "fire.utils.geo": (250, ["rasterio", "pyproj", "matplotlib", "cartopy"]),
+    "fire.utils.io": (50, ["rasterio", "numpy"]),
+    "fire.utils.plot": (250, ["rasterio", "matplotlib", "cartopy"]),
+    "fire.downloader": (300, ["bs4", "requests", "rasterio", "pandas",
+                              "matplotlib", "cartopy"]),
+    "fire.cube": (250, ["pandas", "rasterio", "pyproj",
+                        "matplotlib", "cartopy"]),
+    "fire.dataloader": (800, ["rasterio", "pyproj", "affine",
+                              "matplotlib", "cartopy"]),
+}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module: str, heavy: list) -> dict:
+    """
+    Imports module in a fresh interpreter.
+
+    Returns:
+        dict with the cumulative import time in ms and the heavy
+        modules that were loaded
+    """
+    code = (f"import sys, json, {module}; "
+            f"print(json.dumps([m for m in {heavy!r} if m in sys.modules]))")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=REPO_ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{proc.stderr}")
+
+    # lines look like "import time:  self [us] | cumulative | name"
+    cumulative_us = 0
+    for line in proc.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative_us = int(parts[1])
+    return {"ms": cumulative_us / 1000,
+            "loaded_heavy": json.loads(proc.stdout.strip().splitlines()[-1])}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply all budgets by this factor")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="imports per module, the fastest one counts")
+    parser.add_argument("--json", default=None,
+                        help="write the measurements to this file")
+    args = parser.parse_args()
+
+    results, failed = {}, False
+    for module, (budget, heavy) in BUDGETS.items():
+        runs = [measure(module, heavy) for _ in range(args.repeat)]
+        best = min(r["ms"] for r in runs)
+        loaded = runs[0]["loaded_heavy"]
+        ok = best <= budget * args.scale and not loaded
+        failed |= not ok
+        results[module] = {"ms": best, "budget_ms": budget * args.scale,
+                           "loaded_heavy": loaded, "ok": ok}
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<20} {best:8.1f} ms "
+              f"(budget {budget * args.scale:.0f} ms)"
+              + (f", loads {', '.join(loaded)}" if loaded else ""))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
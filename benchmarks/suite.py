@@ -0,0 +1,298 @@
+"""
+End-to-end benchmark suite for the hot paths of the repository, on
+synthetic inputs (see benchmarks/fixtures.py), runnable offline.
+
+Every stage is timed at several scales (the input sizes grow linearly
+with the scale); the best of --repeat runs is kept. Results are written
+as JSON together with the git commit, so runs of different commits can
+be compared with --compare. Stages whose libraries are not installed are
+recorded as skipped, stages that fail as errors; neither stops the run.
+
+Run from the repository root:
+    python -m benchmarks.suite --scales 1 2 4 --out bench.json
+    python -m benchmarks.suite --stages kde_scoring --compare bench.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+# own stuff
+import benchmarks.fixtures as bfix
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a stage prepares its inputs for a scale and returns (run, n), where
+# run() is the timed call and n the number of items it processes
+Setup = Callable[[int, str], Tuple[Callable[[], object], int]]
+
+
+def _navigate_forward(scale: int, workdir: str):
+    import fire.utils.modis as um
+    n = 2000 * scale
+    rng = np.random.default_rng(0)
+    lat = np.deg2rad(rng.uniform(36, 44, n))
+    lon = np.deg2rad(rng.uniform(-9.5, 3, n))
+    return lambda: [um.navigate_forward(a, o) for a, o in zip(lat, lon)], n
+
+
+def _navigate_inverse(scale: int, workdir: str):
+    import fire.utils.modis as um
+    n = 100000 * scale
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, 1200, n)
+    cols = rng.integers(0, 1200, n)
+    v = np.full(n, 4)
+    h = np.full(n, 17)
+    return lambda: um.navigate_inverse(v, h, rows, cols), n
+
+
+def _global_pixels(scale: int, workdir: str):
+    import fire.utils.modis as um
+    n = 100000 * scale
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(36, 44, n)
+    lon = rng.uniform(-9.5, 3, n)
+    return lambda: um.global_pixels_from_latlon(lat, lon), n
+
+
+def _coords_for_pixels(scale: int, workdir: str):
+    import rasterio as rio
+    import fire.utils.geo as ugeo
+    path = bfix.firemask_stacks(os.path.join(workdir, "modis"), 1)[0]
+    n = 10000 * scale
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, 1200, n)
+    cols = rng.integers(0, 1200, n)
+    dataset = rio.open(path)
+    return lambda: ugeo.get_coords_for_pixels(dataset, rows, cols), n
+
+
+def _hdf_index(scale: int, workdir: str):
+    import fire.utils.modis as um
+    n = 100000 * scale
+    rng = np.random.default_rng(0)
+    days = rng.integers(1, 366, n)
+    urls = [f"https://e4ftl01.cr.usgs.gov/MOLT/MOD14A1.006/2019.01.01/"
+            f"{bfix.modis_fname('MOD', datetime(2019, 1, 1), h, v, 'hdf')}"
+            .replace("A2019001", f"A2019{d:03d}")
+            for d, h, v in zip(days, rng.integers(0, 36, n),
+                               rng.integers(0, 18, n))]
+    return lambda: um.make_hdf_index_from_paths(urls), n
+
+
+def _get_fires(scale: int, workdir: str):
+    # GDAL cannot write HDF4, so the fire mask "subdatasets" are GeoTIFFs
+    # and the per-file part of get_fires is timed
+    import fire.dataloader as dl
+    paths = bfix.firemask_stacks(os.path.join(workdir, "modis"), scale)
+    return lambda: [dl._get_fires_from_single_subdataset(p)
+                    for p in paths], len(paths)
+
+
+def _get_fires_merged(scale: int, workdir: str):
+    import fire.dataloader as dl
+    paths = bfix.firemask_stacks(os.path.join(workdir, "modis"), scale,
+                                 sats=("MOD", "MYD"))
+    groups = [paths[i:i + 2] for i in range(0, len(paths), 2)]
+    return lambda: [dl._get_fires_from_merged_subdatasets(g)
+                    for g in groups], len(paths)
+
+
+def _collect_hdf_urls(scale: int, workdir: str):
+    import fire.downloader as fd
+    root = os.path.join(workdir, f"lpdaac_{scale}")
+    product = bfix.write_listing(root, n_dates=4 * scale, files_per_date=50,
+                                 file_size=1024)
+
+    def run():
+        with bfix.serve_directory(root) as url:
+            return fd.collect_hdf_urls_from_lpdaac(url + product + "/",
+                                                   verbose=False)
+    return run, 4 * scale * 50
+
+
+def _fetch_many_files(scale: int, workdir: str):
+    import fire.downloader as fd
+    root = os.path.join(workdir, f"fetch_{scale}")
+    n_files = 20 * scale
+    product = bfix.write_listing(root, n_dates=1, files_per_date=n_files,
+                                 file_size=256 * 1024)
+    date_dir = os.path.join(root, product, "2019.01.01")
+    fnames = sorted(f for f in os.listdir(date_dir) if f.endswith(".hdf"))
+    target_dir = os.path.join(workdir, f"fetched_{scale}")
+    targets = [os.path.join(target_dir, f) for f in fnames]
+
+    def run():
+        with bfix.serve_directory(root) as url:
+            urls = [f"{url}{product}/2019.01.01/{f}" for f in fnames]
+            ok = fd.fetch_many_files(urls, targets, auth=None,
+                                     overwrite_existing=True, verbose=False)
+        if not all(ok):
+            raise RuntimeError(f"{len(ok) - sum(ok)} downloads failed")
+    return run, n_files
+
+
+def _tourism_handler(scale: int, workdir: str):
+    import tourism.tourism as tt
+    n = 20000 * scale
+    path = os.path.join(workdir, f"nodes_{scale}.osm.pbf")
+    if not os.path.exists(path):
+        bfix.write_pbf(path, n)
+
+    def run():
+        h = tt.TourismCounterHandler()
+        h.apply_file(path, locations=True, idx="flex_mem")
+        return h.get_dataframe()
+    return run, n
+
+
+def _kde_fit(scale: int, workdir: str):
+    import analysis.scoring as ascore
+    pois = bfix.pois(50000 * scale)
+    return lambda: ascore.AttributionModel.from_pois(pois), len(pois)
+
+
+def _kde_scoring(scale: int, workdir: str):
+    # the scoring step of visualisation/folium_map.py
+    import analysis.scoring as ascore
+    model = ascore.AttributionModel.from_pois(bfix.pois(50000))
+    fires = bfix.fires(20000 * scale)
+    return lambda: model.attribute(fires), len(fires)
+
+
+# name: (modules required, setup)
+STAGES: Dict[str, Tuple[List[str], Setup]] = {
+    "navigate_forward": ([], _navigate_forward),
+    "navigate_inverse": ([], _navigate_inverse),
+    "global_pixels_from_latlon": ([], _global_pixels),
+    "get_coords_for_pixels": (["rasterio", "pyproj"], _coords_for_pixels),
+    "make_hdf_index": (["pandas"], _hdf_index),
+    "get_fires": (["rasterio", "pyproj", "pandas"], _get_fires),
+    "get_fires_merged": (["rasterio", "pyproj", "pandas"], _get_fires_merged),
+    "collect_hdf_urls": (["bs4", "lxml"], _collect_hdf_urls),
+    "fetch_many_files": (["requests"], _fetch_many_files),
+    "tourism_handler": (["osmium", "pandas"], _tourism_handler),
+    "kde_fit": (["sklearn", "pandas"], _kde_fit),
+    "kde_scoring": (["sklearn", "pandas"], _kde_scoring),
+}
+
+
+def missing_modules(modules: List[str]) -> List[str]:
+    return [m for m in modules if importlib.util.find_spec(m) is None]
+
+
+def run_stage(setup: Setup, scale: int, workdir: str, repeat: int) -> dict:
+    """ Best of repeat runs, with the time per item in microseconds. """
+    run, n = setup(scale, workdir)
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+    best = min(times)
+    return {"n": n, "seconds": best, "us_per_item": best / max(n, 1) * 1e6}
+
+
+def git_state() -> dict:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD") or None,
+                "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except OSError: # no git
+        return {"commit": None, "dirty": None}
+
+
+def run_suite(stages: List[str], scales: List[int], workdir: str,
+              repeat: int = 3, verbose: bool = True) -> dict:
+    results = {}
+    for name in stages:
+        requires, setup = STAGES[name]
+        missing = missing_modules(requires)
+        results[name] = {}
+        for scale in scales:
+            if missing:
+                result = {"skipped": "missing " + ", ".join(missing)}
+            else:
+                try:
+                    result = run_stage(setup, scale, workdir, repeat)
+                except Exception as e:
+                    result = {"error": f"{type(e).__name__}: {e}"}
+            results[name][str(scale)] = result
+            if verbose:
+                print(f"{name:28s} x{scale:<3d} {_fmt(result)}", flush=True)
+    return {
+        **git_state(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "scales": scales,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """ Prints baseline / current time per stage and scale. """
+    print(f"\nspeedup vs {str(baseline.get('commit'))[:10]}:")
+    for name, by_scale in current["results"].items():
+        for scale, result in by_scale.items():
+            old = baseline["results"].get(name, {}).get(scale, {})
+            if "seconds" in result and "seconds" in old:
+                ratio = old["seconds"] / max(result["seconds"], 1e-12)
+                print(f"{name:28s} x{scale:<3s} {ratio:6.2f}x "
+                      f"({old['seconds']:.4f} s -> {result['seconds']:.4f} s)")
+
+
+def _fmt(result: dict) -> str:
+    if "seconds" in result:
+        return (f"{result['seconds']:9.4f} s  {result['n']:>9d} items  "
+                f"{result['us_per_item']:10.2f} us/item")
+    return result.get("skipped") or result.get("error")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Time the hot paths on synthetic inputs.")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES),
+                        choices=list(STAGES))
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", default=None,
+                        help="where fixtures are generated (and reused); "
+                             "default: a temporary directory")
+    parser.add_argument("--out", default=None, help="JSON file for the results")
+    parser.add_argument("--compare", default=None,
+                        help="JSON results of an earlier run")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="fire_bench_")
+    try:
+        report = run_suite(args.stages, args.scales, workdir, args.repeat)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "wt") as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare, "rt") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
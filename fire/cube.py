@@ -0,0 +1,388 @@
+"""
+Daily fire-mask data cube (days x rows x cols, uint8) for a set of MODIS
+tiles, stored as a directory of chunked, memory-mapped .npy files.
+
+The cube covers the rectangle of tiles spanned by the given tiles on the
+global MODIS sinusoidal grid (see fire.utils.modis.global_pixels_from_latlon);
+row 0, col 0 is the top left pixel of the top left tile. Values are the
+MOD14A1/MYD14A1 fire mask classes (0 = not processed / no data, >= 7 fire).
+
+Layout of a cube directory:
+    meta.json          : shape, chunks, start date, tiles, grid origin
+    c{t}.{r}.{c}.npy   : chunk t (time), r (row), c (col); chunks that
+                         were never written are all 0 and have no file
+
+Queries only open (memory-map) the chunks they touch, e.g. the time series
+of a pixel reads one spatial chunk column through time.
+
+Example:
+    cube = build_cube(hdf_paths, "data/cube_spain")
+    cube = FireMaskCube("data/cube_spain")
+    series = cube.pixel_timeseries(lat=42.1, lon=-7.9)
+    frequency = cube.fire_count()                     # days on fire per pixel
+    weekly = cube.period_counts(period_days=7)        # (weeks, rows, cols)
+"""
+import glob
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+# own stuff
+import fire.utils.modis as um
+
+# CONSTANTS
+# ----------------------------------------------------
+TILE_PIXELS = 1200 # rows and cols of a tile at res=1
+FIRE = 7 # fire mask classes >= FIRE are fires
+DEFAULT_CHUNKS = (32, 256, 256) # days, rows, cols
+VERSION = 1
+# ----------------------------------------------------
+
+
+class FireMaskCube():
+    """
+    Opens an existing cube directory, see create and build_cube for
+    writing one.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "rt") as f:
+            meta = json.load(f)
+        if meta["version"] > VERSION:
+            raise ValueError(f"cube version {meta['version']} not supported")
+        self.meta = meta
+        self.shape = tuple(meta["shape"])
+        self.chunks = tuple(meta["chunks"])
+        self.start_date = datetime.strptime(meta["start_date"], r"%Y-%m-%d")
+        self.res = meta["res"]
+        self.origin = tuple(meta["origin"]) # global (row, col) of pixel 0, 0
+        self.tiles = [tuple(t) for t in meta["tiles"]]
+
+    @classmethod
+    def create(cls, path: str, tiles: List[Tuple[int, int]],
+               start_date: datetime, end_date: datetime, res: int = 1,
+               chunks: Tuple[int, int, int] = DEFAULT_CHUNKS,
+               overwrite: bool = False) -> "FireMaskCube":
+        """
+        Creates an empty cube for tiles (h, v) and the days from start_date
+        to end_date (inclusive).
+
+        Args:
+            overwrite: replace a cube at path, i.e. delete its chunks.
+                Otherwise an existing cube raises FileExistsError.
+        """
+        hs = [h for h, _ in tiles]
+        vs = [v for _, v in tiles]
+        tile_px = TILE_PIXELS * res
+        n_days = (end_date - start_date).days + 1
+        if n_days < 1:
+            raise ValueError("end_date is before start_date")
+        meta = {
+            "version": VERSION,
+            "dtype": "uint8",
+            "shape": [n_days, (max(vs) - min(vs) + 1) * tile_px,
+                      (max(hs) - min(hs) + 1) * tile_px],
+            "chunks": list(chunks),
+            "start_date": start_date.strftime(r"%Y-%m-%d"),
+            "res": res,
+            "origin": [min(vs) * tile_px, min(hs) * tile_px],
+            "tiles": sorted([int(h), int(v)] for h, v in set(tiles)),
+        }
+        meta_path = os.path.join(path, "meta.json")
+        chunk_paths = glob.glob(os.path.join(path, "c*.*.*.npy"))
+        if (os.path.exists(meta_path) or chunk_paths) and not overwrite:
+            raise FileExistsError(f"{path} already holds a cube, "
+                                  "pass overwrite=True to replace it")
+        for chunk_path in chunk_paths:
+            os.remove(chunk_path)
+        os.makedirs(path, exist_ok=True)
+        with open(meta_path, "wt") as f:
+            json.dump(meta, f, indent=1)
+        return cls(path)
+
+    # indexing
+    # ----------------------------------------------------
+    def dates(self) -> List[datetime]:
+        return [self.start_date + timedelta(days=i)
+                for i in range(self.shape[0])]
+
+    def day_index(self, date: datetime) -> int:
+        i = (date - self.start_date).days
+        if not 0 <= i < self.shape[0]:
+            raise IndexError(f"{date:%Y-%m-%d} is not in the cube")
+        return i
+
+    def pixel_index(self, lat: np.ndarray, lon: np.ndarray
+                   ) -> Tuple[np.ndarray, np.ndarray]:
+        """ (row, col) in the cube of locations in degrees. """
+        grow, gcol = um.global_pixels_from_latlon(lat, lon, self.res)
+        return grow - self.origin[0], gcol - self.origin[1]
+
+    def tile_slices(self, h: int, v: int) -> Tuple[slice, slice]:
+        """ Rows and cols of tile (h, v) in the cube. """
+        tile_px = TILE_PIXELS * self.res
+        r0 = v * tile_px - self.origin[0]
+        c0 = h * tile_px - self.origin[1]
+        if r0 < 0 or c0 < 0 or r0 >= self.shape[1] or c0 >= self.shape[2]:
+            raise IndexError(f"tile h{h:02d}v{v:02d} is not in the cube")
+        return slice(r0, r0 + tile_px), slice(c0, c0 + tile_px)
+
+    # chunk access
+    # ----------------------------------------------------
+    def _chunk_path(self, ti: int, ri: int, ci: int) -> str:
+        return os.path.join(self.path, f"c{ti}.{ri}.{ci}.npy")
+
+    def _chunk_shape(self, ti: int, ri: int, ci: int) -> Tuple[int, int, int]:
+        return tuple(min(n, (i + 1) * c) - i * c for n, c, i
+                     in zip(self.shape, self.chunks, (ti, ri, ci)))
+
+    def _chunk(self, ti: int, ri: int, ci: int,
+               mode: str = "r") -> Optional[np.ndarray]:
+        """
+        Memory-maps a chunk. Missing chunks are None in mode "r" and
+        created (all 0) in mode "r+".
+        """
+        path = self._chunk_path(ti, ri, ci)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode=mode)
+        if mode == "r":
+            return None
+        return np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.uint8,
+            shape=self._chunk_shape(ti, ri, ci))
+
+    def _blocks(self, box: Tuple[slice, slice, slice]
+               ) -> Iterator[Tuple[Tuple[int, int, int], tuple, tuple]]:
+        """
+        Yields (chunk index, slices in the chunk, slices in the box) for
+        every chunk overlapping box (slices with explicit start and stop).
+        """
+        ranges = []
+        for s, c in zip(box, self.chunks):
+            ranges.append(range(s.start // c, (s.stop - 1) // c + 1))
+        for ti in ranges[0]:
+            for ri in ranges[1]:
+                for ci in ranges[2]:
+                    in_chunk, in_box = [], []
+                    for s, c, i in zip(box, self.chunks, (ti, ri, ci)):
+                        lo = max(s.start, i * c)
+                        hi = min(s.stop, (i + 1) * c)
+                        in_chunk.append(slice(lo - i * c, hi - i * c))
+                        in_box.append(slice(lo - s.start, hi - s.start))
+                    yield (ti, ri, ci), tuple(in_chunk), tuple(in_box)
+
+    def _box(self, days: Optional[slice] = None, rows: Optional[slice] = None,
+             cols: Optional[slice] = None) -> Tuple[slice, slice, slice]:
+        box = []
+        for s, n in zip((days, rows, cols), self.shape):
+            start, stop, step = (s or slice(None)).indices(n)
+            if step != 1 or stop <= start:
+                raise IndexError("only non-empty, contiguous slices")
+            box.append(slice(start, stop))
+        return tuple(box)
+
+    # writing
+    # ----------------------------------------------------
+    def write(self, data: np.ndarray, day: int, row: int = 0,
+              col: int = 0) -> None:
+        """
+        Writes data (days x rows x cols) at (day, row, col) of the cube,
+        keeping the maximum of data and the existing values. The maximum
+        makes writes order-independent, e.g. for MOD and MYD files of the
+        same day (see fire.dataloader.get_fires_merged).
+        """
+        box = self._box(slice(day, day + data.shape[0]),
+                        slice(row, row + data.shape[1]),
+                        slice(col, col + data.shape[2]))
+        if tuple(s.stop - s.start for s in box) != data.shape:
+            raise IndexError("data does not fit into the cube")
+        for idx, in_chunk, in_box in self._blocks(box):
+            chunk = self._chunk(*idx, mode="r+")
+            np.maximum(chunk[in_chunk], data[in_box], out=chunk[in_chunk])
+            chunk.flush()
+            del chunk
+
+    def write_tile(self, h: int, v: int, dates: List[datetime],
+                   rasters: np.ndarray) -> None:
+        """
+        Writes the fire masks of tile (h, v), one raster per date. Dates
+        outside the cube are skipped.
+        """
+        rows, cols = self.tile_slices(h, v)
+        rasters = np.asarray(rasters)
+        day = np.array([(d - self.start_date).days for d in dates], dtype=int)
+        order = np.argsort(day, kind="stable")
+        order = order[(day[order] >= 0) & (day[order] < self.shape[0])]
+
+        # runs of consecutive days are written in one go
+        breaks = np.flatnonzero(np.diff(day[order]) != 1) + 1
+        for run in np.split(order, breaks):
+            if len(run):
+                self.write(rasters[run], int(day[run[0]]),
+                           rows.start, cols.start)
+
+    # reading
+    # ----------------------------------------------------
+    def read(self, days: Optional[slice] = None, rows: Optional[slice] = None,
+             cols: Optional[slice] = None) -> np.ndarray:
+        """ Reads a box of the cube into memory. """
+        box = self._box(days, rows, cols)
+        out = np.zeros([s.stop - s.start for s in box], dtype=np.uint8)
+        for idx, in_chunk, in_box in self._blocks(box):
+            chunk = self._chunk(*idx)
+            if chunk is not None:
+                out[in_box] = chunk[in_chunk]
+        return out
+
+    def pixel_timeseries(self, lat: Optional[float] = None,
+                         lon: Optional[float] = None,
+                         row: Optional[int] = None, col: Optional[int] = None,
+                         days: Optional[slice] = None) -> np.ndarray:
+        """
+        Fire mask of one pixel (given by lat, lon or by row, col) for
+        every day. Reads one spatial chunk per time chunk.
+        """
+        if row is None or col is None:
+            row, col = (int(x[0]) for x in self.pixel_index([lat], [lon]))
+        if not (0 <= row < self.shape[1] and 0 <= col < self.shape[2]):
+            raise IndexError("pixel is not in the cube")
+        return self.read(days, slice(row, row + 1), slice(col, col + 1))[:, 0, 0]
+
+    def reduce_time(self, func: Callable[[np.ndarray], np.ndarray],
+                    combine: Callable[[np.ndarray, np.ndarray], np.ndarray],
+                    days: Optional[slice] = None, rows: Optional[slice] = None,
+                    cols: Optional[slice] = None,
+                    dtype=np.int32) -> np.ndarray:
+        """
+        Reduces the cube over time, one chunk at a time.
+
+        Args:
+            func: maps a (days, rows, cols) block to (rows, cols)
+            combine: merges two partial results, e.g. np.add or np.maximum
+                (0 must be the neutral element; missing chunks are skipped)
+
+        Returns:
+            (rows, cols) array of dtype
+        """
+        box = self._box(days, rows, cols)
+        out = np.zeros([s.stop - s.start for s in box[1:]], dtype=dtype)
+        for idx, in_chunk, in_box in self._blocks(box):
+            chunk = self._chunk(*idx)
+            if chunk is None:
+                continue
+            target = out[in_box[1:]]
+            combine(target, func(chunk[in_chunk]).astype(dtype), out=target)
+        return out
+
+    def fire_count(self, days: Optional[slice] = None,
+                   rows: Optional[slice] = None,
+                   cols: Optional[slice] = None) -> np.ndarray:
+        """ Number of days on fire per pixel (fire frequency). """
+        return self.reduce_time(lambda b: np.count_nonzero(b >= FIRE, axis=0),
+                                np.add, days, rows, cols)
+
+    def max_over_time(self, days: Optional[slice] = None,
+                      rows: Optional[slice] = None,
+                      cols: Optional[slice] = None) -> np.ndarray:
+        """ Highest fire mask class per pixel. """
+        return self.reduce_time(lambda b: b.max(axis=0), np.maximum,
+                                days, rows, cols, dtype=np.uint8)
+
+    def period_counts(self, period_days: int = 7,
+                      rows: Optional[slice] = None,
+                      cols: Optional[slice] = None) -> np.ndarray:
+        """
+        Fire days per pixel in consecutive periods of period_days days
+        starting at start_date, e.g. weeks for anomalies against the
+        mean of all weeks.
+
+        Returns:
+            (n_periods, rows, cols) uint16 array; the last period may be
+            shorter
+        """
+        n_periods = -(-self.shape[0] // period_days)
+        _, rows, cols = self._box(None, rows, cols)
+        out = np.zeros((n_periods, rows.stop - rows.start,
+                        cols.stop - cols.start), dtype=np.uint16)
+        for p in range(n_periods):
+            days = slice(p * period_days,
+                         min((p + 1) * period_days, self.shape[0]))
+            out[p] = self.fire_count(days, rows, cols)
+        return out
+
+    def repeated_burns(self, min_gap_days: int = 30,
+                       rows: Optional[slice] = None,
+                       cols: Optional[slice] = None) -> np.ndarray:
+        """
+        Number of separate burns per pixel: fire days that follow the
+        previous fire day of the pixel by more than min_gap_days count as
+        a new burn. Reads the box time chunk by time chunk.
+        """
+        box = self._box(None, rows, cols)
+        shape = [s.stop - s.start for s in box[1:]]
+        burns = np.zeros(shape, dtype=np.int32)
+        last_fire = np.full(shape, -(min_gap_days + 1), dtype=np.int64)
+        t_chunk = self.chunks[0]
+        for t0 in range(0, self.shape[0], t_chunk):
+            block = self.read(slice(t0, min(t0 + t_chunk, self.shape[0])),
+                              box[1], box[2])
+            for i, day in enumerate(block):
+                on_fire = day >= FIRE
+                new_burn = on_fire & (t0 + i - last_fire > min_gap_days)
+                burns += new_burn
+                last_fire[on_fire] = t0 + i
+        return burns
+
+
+def build_cube(files: Union[List[str], "pd.DataFrame"], path: str,
+               start_date: Optional[datetime] = None,
+               end_date: Optional[datetime] = None,
+               chunks: Tuple[int, int, int] = DEFAULT_CHUNKS,
+               overwrite: bool = False,
+               path_col_name: Optional[str] = None,
+               verbose: bool = True) -> FireMaskCube:
+    """
+    Writes the fire masks of MOD14A1/MYD14A1 hdf files into a new cube.
+
+    Args:
+        files: hdf files with their original names, or an hdf index of
+            them (see fire.utils.modis.load_hdf_index); the tiles of the
+            cube are those of the files
+        start_date, end_date: days of the cube. Default to the first date
+            of the files and 7 days after the last one (files hold 8 days).
+        overwrite: replace an existing cube at path, see
+            FireMaskCube.create
+        path_col_name: path column of an hdf index, see
+            fire.utils.modis.path_column
+    """
+    from rasterio.errors import RasterioIOError
+    import fire.utils.io as uio
+    import fire.utils.etc as uetc
+    from fire.dataloader import _read_firemask
+
+    hdf_index = um.as_hdf_index(files)
+    start_date = start_date or hdf_index["fname_date"].min().to_pydatetime()
+    end_date = end_date or (hdf_index["fname_date"].max().to_pydatetime()
+                            + timedelta(days=7))
+    tiles = list(zip(hdf_index["h"], hdf_index["v"]))
+    cube = FireMaskCube.create(path, tiles, start_date, end_date,
+                               chunks=chunks, overwrite=overwrite)
+
+    if verbose:
+        progr = uetc.ProgressDisplay(len(hdf_index)).start_timer()
+    paths = hdf_index[um.path_column(hdf_index, path_col_name)]
+    for f, h, v in zip(paths, hdf_index["h"], hdf_index["v"]):
+        try:
+            _, dates, rasters = _read_firemask(uio.get_subdataset_path(f, 0))
+            cube.write_tile(h, v, dates, rasters)
+        except RasterioIOError:
+            print(f"File {f} could not be read.")
+        if verbose:
+            progr.update_and_print()
+    if verbose:
+        progr.stop()
+    return cube
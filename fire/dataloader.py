@@ -1,77 +1,213 @@
 #
+import os
 import numpy as np
 import pandas as pd
 from datetime import datetime
 
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Union
 
-# geo stuff
-import rasterio as rio # for dataset reading
-from rasterio.errors import RasterioIOError
-import pyproj # for projection stuff
-from affine import Affine # class for transform matrices
-
-# for plotting
-import cartopy.crs as ccrs # cartopy CRSs
-import matplotlib.pyplot as plt
-import matplotlib as mpl
+# geo libraries (rasterio, pyproj) are imported where they are used,
+# so that importing this module stays cheap for ingestion workers
 
 # own stuff
 import fire.utils.modis as um
 import fire.utils.io as uio
 import fire.utils.geo as ugeo
-from fire.utils.etc import ProgressDisplay
-
-
-
-def get_fires(files: List[str]) -> pd.DataFrame:
-    all_dfs = list()
-
-    progress = ProgressDisplay(len(files))
-    progress.start_timer()
+import fire.utils.metrics as umetrics
+import fire.utils.columns as ucols
+
+
+
+def get_fires(files: List[str],
+              metrics: Optional[umetrics.Metrics] = None) -> pd.DataFrame:
+    """
+    Args:
+        files: paths to MOD14A1/MYD14A1 hdf files
+        metrics: records files ("files_ok", "files_failed"), "bytes",
+            "fires" and the timers "decode", "reprojection" and 
+            "dataframe". If None, a Metrics with a progress bar is used.
+            Pass one with a JsonReportSink to get a run report.
+    """
+    from rasterio.errors import RasterioIOError
+
+    # fires of all files go into the same typed column buffers
+    acc = ucols.FireAccumulator()
+
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = umetrics.Metrics(
+            "ingest", sinks=[umetrics.ConsoleSink(len(files))])
     for f in files:
         try:
             firemask_sds_path = uio.get_subdataset_path(f, 0)
-            all_dfs.append(_get_fires_from_single_subdataset(firemask_sds_path))
+            n_before = len(acc)
+            _get_fires_from_single_subdataset(firemask_sds_path, metrics, acc)
+            metrics.count("files_ok")
+            metrics.count("bytes", os.path.getsize(f))
+            metrics.count("fires", len(acc) - n_before)
         except RasterioIOError:
             print(f"File {f} could not be read.")
-        progress.update_and_print()
+            metrics.count("files_failed")
+        metrics.step()
+
+    with metrics.timer("dataframe"):
+        fires = acc.to_frame()
+
+    if own_metrics:
+        metrics.close()
+    return fires
+
+
+
+def get_fires_merged(files: Union[List[str], pd.DataFrame],
+                     metrics: Optional[umetrics.Metrics] = None,
+                     path_col_name: Optional[str] = None
+                    ) -> pd.DataFrame:
+    """
+    Like get_fires, but Terra (MOD14A1) and Aqua (MYD14A1) files of the
+    same date and tile are read together: their fire masks are combined
+    pixel by pixel with the higher (more confident) fire class winning,
+    before fire pixels are converted to coordinates. A fire seen by both
+    satellites on the same day and pixel thus yields one row, and each
+    fire pixel is reprojected once.
+
+    Args:
+        files: paths to MOD14A1 and/or MYD14A1 hdf files with their
+            original names (see fire.utils.modis.meta_from_hdf_filename),
+            or an hdf index of them (see fire.utils.modis.load_hdf_index)
+        metrics: as in get_fires, plus the counter "groups"
+        path_col_name: path column of an hdf index, see
+            fire.utils.modis.path_column
+    """
+    from rasterio.errors import RasterioIOError
+
+    hdf_index = um.as_hdf_index(files)
+    path_col_name = um.path_column(hdf_index, path_col_name)
+    groups = [group[path_col_name].tolist() for _, group
+              in hdf_index.groupby(["fname_date", "h", "v"], sort=True)]
+
+    acc = ucols.FireAccumulator()
+
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = umetrics.Metrics(
+            "ingest", sinks=[umetrics.ConsoleSink(len(groups))])
+    for group in groups:
+        try:
+            sds_paths = [uio.get_subdataset_path(f, 0) for f in group]
+            n_before = len(acc)
+            _get_fires_from_merged_subdatasets(sds_paths, metrics, acc)
+            metrics.count("groups")
+            metrics.count("files_ok", len(group))
+            metrics.count("bytes", sum(os.path.getsize(f) for f in group))
+            metrics.count("fires", len(acc) - n_before)
+        except RasterioIOError:
+            print(f"Files {group} could not be read.")
+            metrics.count("files_failed", len(group))
+        metrics.step()
+
+    with metrics.timer("dataframe"):
+        fires = acc.to_frame()
+
+    if own_metrics:
+        metrics.close()
+    return fires
 
-    progress.stop()
-    return pd.concat(all_dfs, axis=0).reset_index(drop=True)
 
 
+def _read_firemask(sds: str) -> Tuple["rio.DatasetReader", List[datetime], np.ndarray]:
+    import rasterio as rio # for dataset reading
 
-def _get_fires_from_single_subdataset(sds: str) -> pd.DataFrame:
     rio_sds = rio.open(sds, mode="r")
 
     # get dates available in subdataset
     dates = rio_sds.get_tag_item("Dates").split()
     dates = [datetime.strptime(d, r"%Y-%m-%d") for d in dates]
 
-    all_dfs = list() # will hold one DF for each date
-    for i, d in enumerate(dates):
-        raster_of_date_i = rio_sds.read()[i]
-        pixel_is_fire    = raster_of_date_i >= 7
-
-        if np.any(pixel_is_fire):
-            # pixel locations of fires
-            ii, jj     = np.where(pixel_is_fire)
+    rasters = rio_sds.read() # (date, row, col)
+    return rio_sds, dates, rasters
+
+
+
+def _get_fires_from_single_subdataset(
+    sds: str, metrics: Optional[umetrics.Metrics] = None,
+    acc: Optional[ucols.FireAccumulator] = None
+) -> Optional[pd.DataFrame]:
+    """
+    Appends the fires of sds to acc; without acc, returns them as a table.
+    """
+    metrics = metrics or umetrics.Metrics("ingest")
+
+    with metrics.timer("decode"):
+        rio_sds, dates, rasters = _read_firemask(sds)
+
+    return _fires_from_rasters(rio_sds, dates, rasters, metrics, acc)
+
+
+
+def _get_fires_from_merged_subdatasets(
+    sds_paths: List[str], metrics: Optional[umetrics.Metrics] = None,
+    acc: Optional[ucols.FireAccumulator] = None
+) -> Optional[pd.DataFrame]:
+    """
+    Fire mask subdatasets of the same tile (e.g. from MOD14A1 and MYD14A1)
+    are combined date by date with np.maximum: fire classes are 7 (low),
+    8 (nominal) and 9 (high confidence), so the maximum keeps a fire if
+    any satellite saw it, with the highest confidence.
+
+    Appends the fires to acc; without acc, returns them as a table.
+    """
+    metrics = metrics or umetrics.Metrics("ingest")
+
+    merged = dict() # date -> combined raster
+    rio_sds = None
+    for sds in sds_paths:
+        with metrics.timer("decode"):
+            sds_i, dates, rasters = _read_firemask(sds)
+        if rio_sds is None:
+            rio_sds = sds_i # same tile => same grid for all subdatasets
+        elif (sds_i.transform != rio_sds.transform
+              or sds_i.shape != rio_sds.shape):
+            raise ValueError(f"{sds} is not on the grid of {sds_paths[0]}")
+
+        for d, raster in zip(dates, rasters):
+            if d in merged:
+                np.maximum(merged[d], raster, out=merged[d])
+            else:
+                merged[d] = raster.copy()
+
+    dates = sorted(merged)
+    rasters = [merged[d] for d in dates]
+    return _fires_from_rasters(rio_sds, dates, rasters, metrics, acc)
+
+
+
+def _fires_from_rasters(rio_sds: "rio.DatasetReader", dates: List[datetime],
+                        rasters, metrics: umetrics.Metrics,
+                        acc: Optional[ucols.FireAccumulator] = None
+                       ) -> Optional[pd.DataFrame]:
+    """
+    One row per fire pixel (fire mask >= 7) and date, appended to acc.
+    Without acc, the rows are returned as a table.
+    """
+    own_acc = acc is None
+    if own_acc:
+        acc = ucols.FireAccumulator()
+
+    for d, raster_of_date_i in zip(dates, rasters):
+        # flat pixel indices of fires
+        flat = np.flatnonzero(raster_of_date_i >= 7)
+        if len(flat) == 0:
+            continue
+        ii, jj = np.divmod(flat, raster_of_date_i.shape[1])
+        with metrics.timer("reprojection"):
             lons, lats = ugeo.get_coords_for_pixels(
                 rio_sds, rows = ii, cols = jj)
-            
-            pixel_values = raster_of_date_i[ii, jj]
-
-            all_dfs.append(pd.DataFrame({
-                "lat": lats, 
-                "lon": lons, 
-                "fire_val": pixel_values, 
-                "date": d
-            }))
-
-    if len(all_dfs) == 0:
-        empty_df_with_correct_cols = pd.DataFrame({
-            "lat": [], "lon": [], "fire_val": [], "date": []})
-        return empty_df_with_correct_cols
-    else:
-        return pd.concat(all_dfs, axis=0)
+
+        with metrics.timer("dataframe"):
+            # cast into the column buffers, no intermediate table
+            acc.append(lats, lons, raster_of_date_i.ravel()[flat], d)
+
+    if own_acc:
+        return acc.to_frame()
+    return None
@@ -2,11 +2,11 @@ import numpy as np
 from datetime import datetime
 from urllib.request import urlopen
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
-import requests #todo: use either requests or urllib if possible
 from netrc import netrc
 import io
+import logging
 import os
+import time
 from queue import Queue
 from threading import Thread
 from typing import List, Set, Dict, Tuple, Optional, Union, Any
@@ -14,6 +14,8 @@ from typing import List, Set, Dict, Tuple, Optional, Union, Any
 # own utils
 import fire.utils.etc as uetc
 import fire.utils.io as uio
+import fire.utils.metrics as umetrics
+import fire.utils.modis as um
 
 
 def collect_hyperlinks(page_url: str) -> List[str]:
@@ -26,6 +28,8 @@ def collect_hyperlinks(page_url: str) -> List[str]:
     Returns:
         List of str; URLs found in <a href=...> fields on the page.
     """
+    from bs4 import BeautifulSoup # imported on first use
+
     urls = []
     page = urlopen( page_url ).read()
     soup = BeautifulSoup(page, "lxml")
@@ -104,6 +108,28 @@ def collect_hdf_urls_from_lpdaac(
     
     return hdf_urls
 
+def collect_hdf_index_from_lpdaac(product_root_url: str,
+                                  index_path: Optional[str] = None,
+                                  **kwargs) -> "pd.DataFrame":
+    """
+    collect_hdf_urls_from_lpdaac as an hdf index (see
+    fire.utils.modis.make_hdf_index_from_paths), e.g. to select tiles
+    and dates before downloading.
+
+    Args:
+        index_path: .npz file of the index. If it exists, the index is
+            read from it instead of crawling the Data Pool; otherwise the
+            crawled index is written to it.
+        kwargs: passed to collect_hdf_urls_from_lpdaac
+    """
+    if index_path is not None and os.path.exists(index_path):
+        return um.load_hdf_index(index_path)
+    urls = collect_hdf_urls_from_lpdaac(product_root_url, **kwargs)
+    hdf_index = um.make_hdf_index_from_paths(urls)
+    if index_path is not None:
+        um.save_hdf_index(hdf_index, index_path)
+    return hdf_index
+
 def _get_dir_date_from_lpdaac_url(url: str) -> datetime:
     date_str = uetc.extract(url, r"[12][0-9]{3}\.[01][0-9]\.[0-3][0-9]")
     return datetime.strptime(date_str, r"%Y.%m.%d")
@@ -121,7 +147,8 @@ def fetch_hdf_files_from_lpdaac(urls: List[str],
 def fetch_file(url:str, target_path:str, auth:object,
                overwrite_existing:bool=True, 
                return_if_exists:bool=True,
-               verbose:bool=True, log:bool=True) -> Union[bool, io.BytesIO]:
+               verbose:bool=True, log:bool=True,
+               metrics:Optional[umetrics.Metrics]=None) -> Union[bool, io.BytesIO]:
     """
     Downloads a file from url and writes it to target_path.
     
@@ -147,17 +174,23 @@ def fetch_file(url:str, target_path:str, auth:object,
             If True and verbose True as well, warnings
             (file already exists or bad response) are written
             to logger instead of being printed to the console.
+        metrics:
+            If given, the bytes written ("bytes") and the 
+            download time ("download") are recorded.
     Returns:
         True or False indicating whether the file was success-
-        fully fetched and written to the target path. 
+        fully fetched and written to the target path.
     """
-    if (os.path.exists(target_path) 
+    import requests #todo: use either requests or urllib if possible
+
+    if (os.path.exists(target_path)
         and not overwrite_existing):
         if verbose:
             msg = f"File already exists. {target_path}"
             logging.info(msg) if log else print(msg)
         return return_if_exists
     
+    t0 = time.perf_counter()
     with requests.get(url, stream=True, auth=auth) as response:
         # check for bad response
         if response.status_code != 200:
@@ -168,9 +201,13 @@ def fetch_file(url:str, target_path:str, auth:object,
             return False
         else:
             uio.makedirs(target_path)
+            nbytes = 0
             with open(target_path, 'wb') as f:
                 for chunk in response.iter_content(chunk_size=1024):
-                    f.write(chunk)
+                    nbytes += f.write(chunk)
+            if metrics is not None:
+                metrics.count("bytes", nbytes)
+                metrics.add_time("download", time.perf_counter() - t0)
             return True
 
 
@@ -182,7 +219,8 @@ def fetch_file(url:str, target_path:str, auth:object,
 #todo: urllib3.exceptions.ProtocolError: ('Connection aborted.', RemoteDisconnected('Remote end closed connection without response'))
 def fetch_many_files(urls: List[str], target_paths:List[str], auth: Any,
                      n_parallel_downloads: int=10, overwrite_existing: bool=False, 
-                     return_fetched_urls: bool=True, verbose: bool=True
+                     return_fetched_urls: bool=True, verbose: bool=True,
+                     metrics: Optional[umetrics.Metrics]=None
                     ) -> List[str]:
     """
     
@@ -193,6 +231,11 @@ def fetch_many_files(urls: List[str], target_paths:List[str], auth: Any,
             n_threads and all content of one batch is held in 
             memory until this batch is processed. Only then the
             content is written to disk #todo. 
+        metrics:
+            Records files ("files_ok", "files_failed", "files_skipped"
+            for existing files that are not overwritten), bytes and
+            download times. If None, a Metrics with a progress bar
+            (if verbose) is used and closed at the end.
             
     Details:
         With a lot of help of https://www.shanelynn.ie/using-python-threading-for-multiple-results-queue/
@@ -218,14 +261,15 @@ def fetch_many_files(urls: List[str], target_paths:List[str], auth: Any,
     # progress display
     if verbose:
         print(f"Downloading {n} files.\n")
-        progr = uetc.ProgressDisplay(n).start_timer()
-    else:
-        progr = None
+    own_metrics = metrics is None
+    if own_metrics:
+        sinks = [umetrics.ConsoleSink(n)] if verbose else []
+        metrics = umetrics.Metrics("download", sinks=sinks)
         
     # start worker threads
     for _ in range(n_parallel_downloads):
         worker = Thread(target=_fetch_files_worker,
-                        args=(q, auth, results, overwrite_existing, progr))
+                        args=(q, auth, results, overwrite_existing, metrics))
         worker.setDaemon(True) # allows to exit a hanging thread
         worker.start()
         
@@ -233,8 +277,9 @@ def fetch_many_files(urls: List[str], target_paths:List[str], auth: Any,
     q.join()
     
     # end progress display
+    if own_metrics:
+        metrics.close()
     if verbose:
-        progr.stop()
         print("")
         print(f"\n{np.sum(results)}/{n} files downloaded successfully "
               f"({np.round(100*np.sum(results)/n,2)} %)")
@@ -245,7 +290,7 @@ def fetch_many_files(urls: List[str], target_paths:List[str], auth: Any,
 def _fetch_files_worker(q:Queue, auth:object,
                         results:List[Union[str, io.BytesIO]],
                         overwrite_existing:bool=False,
-                        progress_display=None
+                        metrics:Optional[umetrics.Metrics]=None
                        ) -> None:
     while not q.empty():
         # get unfinished task from tuple
@@ -253,16 +298,20 @@ def _fetch_files_worker(q:Queue, auth:object,
         i, url, target_path = task
         
         # process task, thus a single url
+        # (existing files are not fetched again, fetch_file returns True)
+        skipped = os.path.exists(target_path) and not overwrite_existing
         results[i] = fetch_file(url, target_path, auth, 
                                 overwrite_existing=overwrite_existing,
-                                verbose=False)
+                                verbose=False, metrics=metrics)
+        
+        # update metrics and progress display
+        if metrics is not None:
+            metrics.count("files_skipped" if skipped
+                          else "files_ok" if results[i] else "files_failed")
+            metrics.step()
         
         # notify queue that task has been processed
         q.task_done()
-        
-        # update progress display
-        if progress_display is not None:
-            progress_display.update_and_print()
     return True
     
     
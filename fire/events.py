@@ -0,0 +1,137 @@
+"""
+Spatio-temporal clustering of fire pixels into fire events.
+
+get_fires emits one row per burning 1 km pixel per day. Here, detections
+are linked if their pixels touch on the MODIS grid (8-neighborhood) and
+their dates are at most max_gap_days apart. Each connected component is
+one fire event.
+
+Linking is done with hash joins on integer (day, grid row, grid column)
+keys (sort + searchsorted) and the components are found with
+scipy's connected_components, so the run time is O(n log n).
+
+Example:
+    fires = pd.read_csv("fire/data/fires_spain_since_2010.csv")
+    labelled, events = build_events(fires, max_gap_days=1)
+"""
+import numpy as np
+import pandas as pd
+
+from typing import Tuple
+
+# own stuff
+import fire.utils.modis as um
+
+
+def _day_numbers(dates: pd.Series) -> np.ndarray:
+    """ Days since 1970-01-01 as int64. """
+    days = pd.to_datetime(dates).to_numpy().astype("datetime64[D]")
+    return days.astype(np.int64)
+
+
+def link_detections(fires: pd.DataFrame, max_gap_days: int = 1,
+                    res: int = 1) -> np.ndarray:
+    """
+    Assigns an event label to every detection.
+
+    Args:
+        fires: table with columns lat, lon, date (as written by get_fires)
+        max_gap_days: detections on the same or neighboring pixels are
+            linked if their dates differ by at most this many days
+        res: resolution of the MODIS product the fires come from
+
+    Returns:
+        int64 array of event labels 0..n_events-1, one per row of fires
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    grow, gcol = um.global_pixels_from_latlon(
+        fires["lat"].to_numpy(), fires["lon"].to_numpy(), res)
+    day = _day_numbers(fires["date"])
+    if len(day) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # one integer key per (day, grow, gcol), rows and cols shifted by one
+    # so neighbors at the grid border stay non-negative
+    n_rows = 18 * 1200 * res + 2
+    n_cols = 36 * 1200 * res + 2
+    day = day - day.min()
+    keys = (day * n_rows + (grow + 1)) * n_cols + (gcol + 1)
+
+    # duplicates (e.g. Terra and Aqua on the same pixel and day) share a node
+    nodes, node_of_detection = np.unique(keys, return_inverse=True)
+
+    # half of the neighborhood suffices, the graph is undirected
+    offsets = [(0, 0, 1), (0, 1, -1), (0, 1, 0), (0, 1, 1)]
+    offsets += [(dd, dr, dc) for dd in range(1, max_gap_days + 1)
+                for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+
+    src, dst = [], []
+    for dd, dr, dc in offsets:
+        neighbor_keys = nodes + (dd * n_rows + dr) * n_cols + dc
+        pos = np.searchsorted(nodes, neighbor_keys)
+        pos[pos == len(nodes)] = 0
+        found = nodes[pos] == neighbor_keys
+        src.append(np.flatnonzero(found))
+        dst.append(pos[found])
+    src = np.concatenate(src)
+    dst = np.concatenate(dst)
+
+    graph = coo_matrix((np.ones(len(src), dtype=np.int8), (src, dst)),
+                       shape=(len(nodes), len(nodes)))
+    _, node_labels = connected_components(graph, directed=False)
+    return node_labels[node_of_detection].astype(np.int64)
+
+
+def build_events(fires: pd.DataFrame, max_gap_days: int = 1,
+                 res: int = 1) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Clusters fire detections into events.
+
+    Returns:
+        (fires, events) where fires is a copy of the input with an added
+        "event" column and events has one row per event with the columns
+            "event"         : int      : label, see link_detections
+            "n_detections"  : int      : rows of fires in the event
+            "n_pixels"      : int      : distinct burning pixels (footprint)
+            "area_km2"      : float    : footprint area
+            "start_date"    : datetime : first day of the event
+            "end_date"      : datetime : last day of the event
+            "duration_days" : int      : end_date - start_date + 1
+            "max_fire_val"  : int      : highest fire mask value
+            "lat", "lon"    : float    : mean location of the detections
+            "lat_min", "lat_max", "lon_min", "lon_max" : bounding box
+    """
+    labels = link_detections(fires, max_gap_days, res)
+    grow, gcol = um.global_pixels_from_latlon(
+        fires["lat"].to_numpy(), fires["lon"].to_numpy(), res)
+    dates = pd.to_datetime(fires["date"])
+
+    detections = pd.DataFrame({
+        "event": labels,
+        "lat": fires["lat"].to_numpy(),
+        "lon": fires["lon"].to_numpy(),
+        "date": dates.to_numpy(),
+        "fire_val": fires["fire_val"].to_numpy(),
+        "pixel": grow * (36 * 1200 * res) + gcol,
+    })
+    events = detections.groupby("event").agg(
+        n_detections = ("lat", "size"),
+        n_pixels     = ("pixel", "nunique"),
+        start_date   = ("date", "min"),
+        end_date     = ("date", "max"),
+        max_fire_val = ("fire_val", "max"),
+        lat          = ("lat", "mean"),
+        lon          = ("lon", "mean"),
+        lat_min      = ("lat", "min"),
+        lat_max      = ("lat", "max"),
+        lon_min      = ("lon", "min"),
+        lon_max      = ("lon", "max"),
+    ).reset_index()
+
+    pixel_km = float(um.W) / res / 1000
+    events.insert(3, "area_km2", events["n_pixels"] * pixel_km**2)
+    events.insert(6, "duration_days",
+                  (events["end_date"] - events["start_date"]).dt.days + 1)
+    return fires.assign(event=labels), events
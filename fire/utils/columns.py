@@ -0,0 +1,128 @@
+"""
+Growable typed column buffers, to build a table from many small pieces
+without intermediate DataFrames and concatenations.
+
+How to:
+1) append pieces (arrays are cast into the buffers' dtypes on write)
+    acc = FireAccumulator()
+    acc.append(lats, lons, values, day)   # day: datetime or day number
+2) take the table; the DataFrame shares the buffers' memory
+    fires = acc.to_frame()
+"""
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from typing import Dict, Union
+
+# CONSTANTS
+# ----------------------------------------------------
+INITIAL_CAPACITY = 1 << 16
+GROWTH = 2 # capacity factor when a buffer is full
+# column dtypes of the fire table
+COORD_DTYPE = np.float32 # ~1 m resolution at 45 deg, MODIS pixels are ~1 km
+VALUE_DTYPE = np.uint8   # fire mask classes 0-9
+DAY_DTYPE = np.int32     # days since 1970-01-01
+# ----------------------------------------------------
+
+
+def day_number(date: Union[datetime, np.datetime64]) -> int:
+    """ Days since 1970-01-01. """
+    return int(np.datetime64(date, "D").astype(np.int64))
+
+
+class GrowableColumn():
+    """
+    A 1d array with amortised O(1) appends: the buffer grows by GROWTH
+    when full; view() is the filled part, without a copy.
+    """
+    def __init__(self, dtype, capacity: int = INITIAL_CAPACITY):
+        self._buf = np.empty(max(1, capacity), dtype=dtype)
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._buf.dtype
+
+    def reserve(self, n: int) -> np.ndarray:
+        """
+        Makes room for n more items and returns the slice they go to,
+        e.g. as `out=` of a numpy function. The items count as appended.
+        """
+        end = self._n + n
+        if end > len(self._buf):
+            capacity = len(self._buf)
+            while capacity < end:
+                capacity *= GROWTH
+            buf = np.empty(capacity, dtype=self._buf.dtype)
+            buf[:self._n] = self._buf[:self._n]
+            self._buf = buf
+        out = self._buf[self._n:end]
+        self._n = end
+        return out
+
+    def append(self, values) -> None:
+        values = np.asarray(values)
+        self.reserve(len(values))[...] = values # casts to the buffer dtype
+
+    def fill(self, value, n: int) -> None:
+        """ Appends value n times. """
+        self.reserve(n)[...] = value
+
+    def view(self) -> np.ndarray:
+        return self._buf[:self._n]
+
+    def shrink(self) -> np.ndarray:
+        """ Releases the unused capacity (in place if possible). """
+        if len(self._buf) > self._n:
+            try:
+                self._buf.resize(max(1, self._n), refcheck=True)
+            except ValueError: # views of the buffer exist
+                self._buf = self._buf[:self._n].copy()
+        return self.view()
+
+
+class FireAccumulator():
+    """
+    Fire table columns lat, lon (float32), fire_val (uint8) and day
+    (int32 days since 1970-01-01) across many files and dates.
+    """
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self.columns: Dict[str, GrowableColumn] = {
+            "lat": GrowableColumn(COORD_DTYPE, capacity),
+            "lon": GrowableColumn(COORD_DTYPE, capacity),
+            "fire_val": GrowableColumn(VALUE_DTYPE, capacity),
+            "day": GrowableColumn(DAY_DTYPE, capacity),
+        }
+
+    def __len__(self) -> int:
+        return len(self.columns["day"])
+
+    def append(self, lats, lons, values,
+               day: Union[datetime, np.datetime64, int]) -> None:
+        """ One piece of fires, all of the same day. """
+        n = len(values)
+        if not len(lats) == len(lons) == n:
+            raise ValueError("lats, lons and values differ in length")
+        if not isinstance(day, (int, np.integer)):
+            day = day_number(day)
+        self.columns["lat"].append(lats)
+        self.columns["lon"].append(lons)
+        self.columns["fire_val"].append(values)
+        self.columns["day"].fill(day, n)
+
+    def to_frame(self, dates: bool = True) -> pd.DataFrame:
+        """
+        Args:
+            dates: add the "date" column (datetime64) instead of "day",
+                as returned by fire.dataloader.get_fires. This is the
+                only column that is converted (and thus copied).
+        """
+        data = {name: col.shrink() for name, col in self.columns.items()}
+        if dates:
+            day = data.pop("day")
+            data["date"] = day.astype("datetime64[D]").astype("datetime64[ns]")
+        return pd.DataFrame(data, copy=False)
@@ -1,6 +1,7 @@
 import numpy as np
 import re
 import time
+from threading import Lock
 
 from typing import List
 
@@ -56,6 +57,10 @@ class ProgressDisplay():
     4) when finished
         progr.stop()
         
+    update_and_print may be called from several threads at once.
+    For counters and timers besides the progress bar, see 
+    fire.utils.metrics.
+        
     Developed during ML Lab Course.
     """
     def __init__(self, ntotal, nprocessed = 0, unit="m", eol = "\r"):
@@ -65,6 +70,7 @@ class ProgressDisplay():
         self.nleft = ntotal
         self.unit = unit
         self.len_of_last_line = 1
+        self._lock = Lock()
         
     def start_timer(self):
         self.tstart = time.time()
@@ -108,8 +114,9 @@ class ProgressDisplay():
         self.len_of_last_line = len(display)
         
     def update_and_print(self, nnew=1):
-        self.update(nnew)
-        self.print_status()
+        with self._lock:
+            self.update(nnew)
+            self.print_status()
     
     def stop(self):
         total_time = self.calc_time_in_unit( time.time()-self.tstart )
@@ -1,19 +1,51 @@
 import numpy as np
-import rasterio as rio # for dataset reading
-import pyproj # for projection stuff
-from affine import Affine # class for transform matrices
+from functools import lru_cache
 
 from typing import List, Tuple, Optional
 
+# rasterio and pyproj are slow to import and are therefore only
+# imported on first use, see _geo_libs()
+
 # CONSTANTS
-CRS_LATLON = pyproj.CRS.from_epsg(4326)
+# CRS_LATLON (EPSG:4326) is created on first access, see __getattr__
+_CRS_LATLON = None
+
+
+def __getattr__(name: str):
+    if name == "CRS_LATLON":
+        return _crs_latlon()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _crs_latlon() -> "pyproj.crs.CRS":
+    global _CRS_LATLON
+    if _CRS_LATLON is None:
+        _, pyproj = _geo_libs()
+        _CRS_LATLON = pyproj.CRS.from_epsg(4326)
+    return _CRS_LATLON
+
+
+def _geo_libs():
+    import rasterio as rio # for dataset reading
+    import pyproj # for projection stuff
+    return rio, pyproj
 
 
-def get_coords_for_pixels(dataset: rio.DatasetReader, 
+@lru_cache(maxsize=16)
+def _transformer(src_wkt: str, dst_wkt: str) -> "pyproj.Transformer":
+    # building a transformer costs more than reprojecting the fires of a
+    # day, and all files of a product share the same CRS
+    _, pyproj = _geo_libs()
+    return pyproj.Transformer.from_crs(pyproj.CRS.from_wkt(src_wkt),
+                                       pyproj.CRS.from_wkt(dst_wkt),
+                                       always_xy=True)
+
+
+def get_coords_for_pixels(dataset: "rio.DatasetReader", 
                           rows: np.array, 
                           cols: np.array, 
-                          dst_crs: Optional[pyproj.crs.CRS] = None
-                         ) -> Tuple[List[float], List[float]]:
+                          dst_crs: Optional["pyproj.crs.CRS"] = None
+                         ) -> Tuple[np.ndarray, np.ndarray]:
     """
     Args:
         dataset (rasterio.DatasetReader): must be opened (?) #todo
@@ -23,8 +55,8 @@ def get_coords_for_pixels(dataset: rio.DatasetReader,
             EPSG:4326 (lat lon) will be used. Defaults to None.
     
     Returns:
-        tuple: two lists of floats, xs and ys. If dst_crs is default, output 
-            will be lon, lat. #todo or lat lon??
+        tuple: two float64 arrays, xs and ys of the pixel centers. If
+            dst_crs is default, output will be lon, lat.
     """
     # sanity check
     assert len(rows) == len(cols), \
@@ -32,19 +64,18 @@ def get_coords_for_pixels(dataset: rio.DatasetReader,
     
     # set destination CRS (projection) to lat lon, if not given
     if dst_crs is None:
-        dst_crs = CRS_LATLON
+        dst_crs = _crs_latlon()
+
+    # get coordinates of pixel centers in src projection, as arrays
+    # (rasterio.transform.xy goes through python lists)
+    a, b, c, d, e, f = tuple(dataset.transform)[:6]
+    cols_c = np.asarray(cols, dtype=np.float64) + 0.5
+    rows_c = np.asarray(rows, dtype=np.float64) + 0.5
+    src_xs = a * cols_c + b * rows_c + c
+    src_ys = d * cols_c + e * rows_c + f
 
-    # get projection info about dataset
-    src_tf:  Affine         = dataset.transform
-    src_crs: pyproj.crs.CRS = pyproj.CRS.from_wkt(dataset.crs.to_wkt())
-    
-    # get coordinates of pixel ijs in src projection
-    src_xs, src_ys = rio.transform.xy(dataset.transform, rows, cols)
-    src_xs, src_ys = np.array(src_xs), np.array(src_ys)
-    
     # reproject coordinates to destination CRS (projection)
-    dst_xs, dst_ys = pyproj.transform(src_crs, dst_crs, src_xs, src_ys, 
-                                      errcheck=True, always_xy=True, 
-                                      skip_equivalent=True)
-    
+    transformer = _transformer(dataset.crs.to_wkt(), dst_crs.to_wkt())
+    dst_xs, dst_ys = transformer.transform(src_xs, src_ys, errcheck=True)
+
     return dst_xs, dst_ys
\ No newline at end of file
@@ -1,9 +1,9 @@
 import os
-import rasterio as rio
 from typing import List
 
 
 def get_subdataset_path(src_filepath: str, i: int) -> str:
+    import rasterio as rio # imported lazily, it is slow to import
     with rio.open(src_filepath, mode="r") as rio_file:
         sds_path = rio_file.subdatasets[i]
     return sds_path
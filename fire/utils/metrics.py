@@ -0,0 +1,183 @@
+"""
+Lightweight throughput instrumentation: counters and timers.
+
+How to:
+1) set up metrics with any number of sinks
+    metrics = Metrics("ingest", sinks=[ConsoleSink(ntotal),
+                                       JsonReportSink("report.json")])
+2) count and time things, from any thread
+    metrics.count("bytes", nbytes)
+    with metrics.timer("decode"):
+        ...
+3) after each step (e.g. a finished file), notify the sinks
+    metrics.step()
+4) when finished, write the report to all sinks
+    report = metrics.close()
+
+Each process keeps its own Metrics. Worker processes return
+metrics.snapshot() (a plain dict) and the parent adds it with
+metrics.merge(snapshot).
+"""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from typing import Dict, List, Optional
+
+from fire.utils.etc import ProgressDisplay
+
+
+class Metrics():
+    def __init__(self, name: str = "run", sinks: Optional[List] = None):
+        self.name = name
+        self.sinks = sinks or []
+        self.counters: Dict[str, float] = {}
+        self.timers: Dict[str, dict] = {}
+        self.nsteps = 0
+        self._lock = Lock()
+        self.tstart = time.time()
+        for sink in self.sinks:
+            sink.start(self)
+
+    def count(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name: str, seconds: float, n: int = 1) -> None:
+        with self._lock:
+            t = self.timers.setdefault(
+                name, {"count": 0, "total": 0., "max": 0.})
+            t["count"] += n
+            t["total"] += seconds
+            t["max"] = max(t["max"], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t0)
+
+    def step(self, n: int = 1) -> None:
+        """ Marks n units of work (e.g. files) as done, updates the sinks. """
+        with self._lock:
+            self.nsteps += n
+        for sink in self.sinks:
+            sink.update(self, n)
+
+    def snapshot(self) -> dict:
+        """ Picklable copy of the counters and timers. """
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "timers": {k: dict(v) for k, v in self.timers.items()},
+                    "nsteps": self.nsteps}
+
+    def merge(self, snapshot: dict) -> None:
+        """ Adds the snapshot of another Metrics (e.g. of a worker process). """
+        with self._lock:
+            for k, v in snapshot["counters"].items():
+                self.counters[k] = self.counters.get(k, 0) + v
+            for k, v in snapshot["timers"].items():
+                t = self.timers.setdefault(
+                    k, {"count": 0, "total": 0., "max": 0.})
+                t["count"] += v["count"]
+                t["total"] += v["total"]
+                t["max"] = max(t["max"], v["max"])
+            self.nsteps += snapshot.get("nsteps", 0)
+
+    def report(self) -> dict:
+        """
+        Returns:
+            dict with the elapsed wall time, all counters with their rate
+            per second, and per timer the count, total, mean and max seconds
+        """
+        snap = self.snapshot()
+        elapsed = time.time() - self.tstart
+        return {
+            "name": self.name,
+            "pid": os.getpid(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S",
+                                     time.localtime(self.tstart)),
+            "elapsed_s": elapsed,
+            "steps": snap["nsteps"],
+            "counters": {k: {"total": v,
+                             "per_s": v / elapsed if elapsed > 0 else None}
+                         for k, v in snap["counters"].items()},
+            "timers": {k: dict(v, mean=v["total"] / v["count"]
+                                    if v["count"] else None)
+                       for k, v in snap["timers"].items()},
+        }
+
+    def close(self) -> dict:
+        report = self.report()
+        for sink in self.sinks:
+            sink.close(report)
+        return report
+
+
+class Sink():
+    """ Base class of the outputs of Metrics. All methods are optional. """
+    def start(self, metrics: Metrics) -> None:
+        pass
+
+    def update(self, metrics: Metrics, nnew: int) -> None:
+        pass
+
+    def close(self, report: dict) -> None:
+        pass
+
+
+class ConsoleSink(Sink):
+    """ The carriage-return progress bar of ProgressDisplay. """
+    def __init__(self, ntotal: int, unit: str = "m"):
+        self.progress = ProgressDisplay(ntotal, unit=unit)
+
+    def start(self, metrics: Metrics) -> None:
+        self.progress.start_timer()
+
+    def update(self, metrics: Metrics, nnew: int) -> None:
+        self.progress.update_and_print(nnew)
+
+    def close(self, report: dict) -> None:
+        self.progress.stop()
+
+
+class JsonReportSink(Sink):
+    """ Writes the final report as JSON. """
+    def __init__(self, path: str):
+        self.path = path
+
+    def close(self, report: dict) -> None:
+        dirpath = os.path.dirname(self.path)
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+class LoggingSink(Sink):
+    """ Logs the counters at most every `interval` seconds and at the end. """
+    def __init__(self, logger: Optional[logging.Logger] = None,
+                 interval: float = 10.):
+        self.logger = logger or logging.getLogger("fire.metrics")
+        self.interval = interval
+        self._last = 0.
+        self._lock = Lock() # update is called from the worker threads
+
+    def update(self, metrics: Metrics, nnew: int) -> None:
+        now = time.time()
+        with self._lock:
+            due = now - self._last >= self.interval
+            if due:
+                self._last = now
+        if due:
+            self.logger.info("%s: %d steps, %s", metrics.name,
+                             metrics.nsteps, metrics.snapshot()["counters"])
+
+    def close(self, report: dict) -> None:
+        self.logger.info("%s finished: %s", report["name"],
+                         json.dumps(report))
@@ -5,10 +5,9 @@ import os
 import datetime
 import warnings
 
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Union
 
 import numpy as np
-import pandas as pd
 
 from fire.utils.etc import max_precision, extract
 
@@ -24,6 +23,17 @@ YMAX = max_precision( 10007555) # m, the northern limit of the projection plane
 W    = max_precision(926.62543305)
 #W    = T/1200 # = 926.62543305 m, the actual size of a "1-km" 
               # MODIS sinusoidal grid cell.
+
+# layout of original file names after the product name, e.g.
+#   MOD14A1.A2019257.h11v12.006.2019269172641.hdf
+#          ^ offsets from this dot: (start, stop) of each field
+HDF_FNAME_FIELDS = {"year": (2, 6), "doy": (6, 9), "h": (11, 13),
+                    "v": (14, 16), "collection": (17, 20),
+                    "production": (21, 34)}
+HDF_FNAME_LITERALS = {0: b".", 1: b"A", 9: b".", 10: b"h", 13: b"v",
+                      16: b".", 20: b".", 34: b"."}
+HDF_FNAME_EXTENSION = b"hdf" # at offset 35, the end of the name
+HDF_INDEX_VERSION = 1
 # ----------------------------------------------------
 
 
@@ -126,10 +136,45 @@ def navigate_inverse(v:int, h:int, row:int, col:int, res:int=1) -> (float, float
     
     lat = y / R
     lon = x / (R*np.cos(lat))
-    
+
     return np.rad2deg(lat), np.rad2deg(lon)
 
 
+def global_pixels_from_latlon(lat: np.ndarray, lon: np.ndarray,
+                              res: int = 1) -> (np.ndarray, np.ndarray):
+    """
+    Vectorized forward mapping of many locations onto the global MODIS
+    sinusoidal grid, i.e. the grid of all tiles side by side.
+
+    Args:
+        lat: latitudes in degrees
+        lon: longitudes in degrees
+        res: resolution of MODIS product; 1 for "1-km", 2 for "500-m",
+             4 for "250-m"
+
+    Returns:
+        (grow, gcol) as int64 arrays, where
+            grow = v * 1200*res + row
+            gcol = h * 1200*res + col
+        with (v, h, row, col) as returned by navigate_forward.
+
+    Details:
+        Computed in float64 (not max_precision) for speed. Unlike
+        navigate_forward, there is no -0.5 pixel shift, so pixel centers
+        (as written by get_fires) map robustly onto their own pixel.
+    """
+    lat = np.deg2rad(np.asarray(lat, dtype=np.float64))
+    lon = np.deg2rad(np.asarray(lon, dtype=np.float64))
+    w = np.float64(W) / res
+
+    x = np.float64(R) * lon * np.cos(lat)
+    y = np.float64(R) * lat
+
+    gcol = np.floor((x - np.float64(XMIN)) / w).astype(np.int64)
+    grow = np.floor((np.float64(YMAX) - y) / w).astype(np.int64)
+    return grow, gcol
+
+
 def meta_from_hdf_filename(hdf_fname:str) -> dict:
     """
     Returns meta data that can be inferred from .hdf filenames.
@@ -200,14 +245,183 @@ def default_target_path_scheme(url:str, data_root_path:str) -> str:
 
 def make_hdf_index_from_paths(hdf_paths: List[str], 
                               path_col_name: str = "url"
-                             ) -> pd.DataFrame:
-    hdf_index = ( pd
-        .DataFrame({path_col_name: hdf_paths})
-        .assign(fname      = lambda df: df.url.apply(os.path.basename),
-                sat_name   = lambda df: df.fname.apply(sat_name_from_hdf_filename),
-                fname_date = lambda df: df.fname.apply(date_from_hdf_filename),
-                h          = lambda df: df.fname.apply(h_from_hdf_filename),
-                v          = lambda df: df.fname.apply(v_from_hdf_filename)
-        )
-    )
-    return hdf_index
\ No newline at end of file
+                             ) -> "pd.DataFrame":
+    """
+    Parses the original file names of many hdf paths or URLs at once:
+    the names are laid out as rows of a byte matrix and all fields are
+    read column-wise with numpy (no per-row parsing or strptime).
+
+    Returns:
+        pandas.DataFrame with one row per path and the columns
+            path_col_name : str : the path or URL
+            "fname"       : str : file name
+            "product"     : category : e.g. "MOD14A1"
+            "sat_name"    : category : "MOD" or "MYD"
+            "fname_date"  : datetime64 : date of the data (Ayyyyjjj)
+            "h", "v"      : int32 : tile numbers
+            "collection"  : category : e.g. "006"
+            "production"  : datetime64 : production time stamp
+
+    Raises:
+        ValueError if a file name does not follow the scheme
+    """
+    import pandas as pd # only needed here, keeps the MODIS math light
+
+    paths = list(hdf_paths)
+    fnames = [p.rpartition("/")[2].rpartition("\\")[2] for p in paths]
+    n = len(fnames)
+    try:
+        names = np.array(fnames, dtype=bytes) if n else np.empty(0, "S1")
+    except UnicodeEncodeError:
+        bad = [f for f in fnames if not f.isascii()]
+        raise ValueError(f"{len(bad)} paths are no MODIS file names, "
+                         f"e.g. {bad[0]!r}") from None
+    width = names.dtype.itemsize
+    # one row per name, padded with zeros behind the longest name, so that
+    # the fields and the end of the extension can be read behind any dot
+    pad = 35 + len(HDF_FNAME_EXTENSION) + 1
+    mat = np.zeros((n, width + pad), dtype=np.uint8)
+    if n:
+        mat[:, :width] = names.view(np.uint8).reshape(n, width)
+
+    dot = np.argmax(mat == ord("."), axis=1) # end of the product name
+    rows = np.arange(n)
+
+    def field(start, stop):
+        return mat[rows[:, None], dot[:, None] + np.arange(start, stop)]
+
+    ok = (dot >= 4) & (mat[:, :3] >= ord("A")).all(axis=1) \
+         & (mat[:, :3] <= ord("Z")).all(axis=1)
+    for offset, char in HDF_FNAME_LITERALS.items():
+        ok &= mat[rows, dot + offset] == ord(char)
+    for i, char in enumerate(HDF_FNAME_EXTENSION):
+        ok &= mat[rows, dot + 35 + i] == char
+    ok &= mat[rows, dot + 35 + len(HDF_FNAME_EXTENSION)] == 0 # the end
+    digits = {}
+    for name, (start, stop) in HDF_FNAME_FIELDS.items():
+        d = field(start, stop).astype(np.int64) - ord("0")
+        ok &= ((d >= 0) & (d <= 9)).all(axis=1)
+        digits[name] = d @ 10 ** np.arange(stop - start - 1, -1, -1)
+    production = digits["production"]
+    ok &= _valid_doy(digits["year"], digits["doy"]) \
+          & (digits["h"] <= 35) & (digits["v"] <= 17) \
+          & _valid_doy(production // 1000000000,
+                       production // 1000000 % 1000) \
+          & (production // 10000 % 100 < 24) \
+          & (production // 100 % 100 < 60) & (production % 100 < 60)
+    if not ok.all():
+        bad = [f for f, good in zip(fnames, ok) if not good]
+        raise ValueError(f"{len(bad)} paths are no MODIS file names, "
+                         f"e.g. {bad[0]!r}")
+
+    def category(byte_rows):
+        # few distinct values: decode the unique byte strings only
+        keys = np.ascontiguousarray(byte_rows)
+        keys = keys.view(f"S{keys.shape[1]}").ravel() if n \
+               else np.empty(0, "S1")
+        uniques, codes = np.unique(keys, return_inverse=True)
+        return pd.Categorical.from_codes(
+            codes.ravel(), [u.decode() for u in uniques])
+
+    product = np.where(np.arange(width + pad) < dot[:, None], mat, 0)\
+                [:, :max(int(dot.max()) if n else 1, 1)]
+    hdf_index = pd.DataFrame({
+        path_col_name: np.array(paths, dtype=object),
+        "fname"      : np.array(fnames, dtype=object),
+        "product"    : category(product),
+        "sat_name"   : category(mat[:, :3]),
+        "fname_date" : _days_of_year(digits["year"], digits["doy"]),
+        "h"          : digits["h"].astype(np.int32),
+        "v"          : digits["v"].astype(np.int32),
+        "collection" : category(field(*HDF_FNAME_FIELDS["collection"])),
+        "production" : _days_of_year(production // 1000000000,
+                                     production // 1000000 % 1000)
+                       + ((production // 10000 % 100) * 3600
+                          + (production // 100 % 100) * 60
+                          + production % 100).astype("timedelta64[s]"),
+    })
+    # kept by column selections and row filters, see path_column
+    hdf_index.attrs["path_col_name"] = path_col_name
+    return hdf_index
+
+
+def _valid_doy(year: np.ndarray, doy: np.ndarray) -> np.ndarray:
+    """ 1 <= doy <= 365, or 366 in leap years """
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return (doy >= 1) & (doy <= 365 + leap)
+
+
+def _days_of_year(year: np.ndarray, doy: np.ndarray) -> np.ndarray:
+    """ datetime64[ns] of year and day of year (1-366) """
+    return ((year - 1970).astype("datetime64[Y]").astype("datetime64[D]")
+            + (doy - 1).astype("timedelta64[D]")).astype("datetime64[ns]")
+
+
+def as_hdf_index(files: "Union[List[str], pd.DataFrame]",
+                 path_col_name: str = "url") -> "pd.DataFrame":
+    """ files as an hdf index; an index (see load_hdf_index) is passed on. """
+    if hasattr(files, "columns"):
+        return files
+    return make_hdf_index_from_paths(files, path_col_name)
+
+
+def path_column(hdf_index: "pd.DataFrame",
+                path_col_name: Optional[str] = None) -> str:
+    """
+    Name of the path column of an hdf index: path_col_name if given,
+    else the one the index was made with (hdf_index.attrs), else "url".
+
+    Raises:
+        KeyError if the index has no such column
+    """
+    name = path_col_name or hdf_index.attrs.get("path_col_name", "url")
+    if name not in hdf_index.columns:
+        raise KeyError(f"hdf index has no path column {name!r}")
+    return name
+
+
+def save_hdf_index(hdf_index: "pd.DataFrame", path: str,
+                   path_col_name: Optional[str] = None) -> None:
+    """
+    Writes an index of make_hdf_index_from_paths to a compressed .npz,
+    e.g. the listing of a crawl, for the downloader and the dataloader.
+    Paths are stored as directory codes plus file names; the other
+    columns are parsed again by load_hdf_index.
+
+    Args:
+        path_col_name: default: the path column of hdf_index
+    """
+    import pandas as pd
+
+    path_col_name = path_column(hdf_index, path_col_name)
+    dirs = [p[:len(p) - len(f)] for p, f
+            in zip(hdf_index[path_col_name], hdf_index["fname"])]
+    dir_codes, dir_names = pd.factorize(np.array(dirs, dtype=object))
+    np.savez_compressed(path, version=HDF_INDEX_VERSION,
+                        path_col_name=path_col_name,
+                        dirs=_join_lines(dir_names),
+                        dir_codes=dir_codes.astype(np.int32),
+                        fnames=_join_lines(hdf_index["fname"]))
+
+
+def load_hdf_index(path: str) -> "pd.DataFrame":
+    """ Reads an index written by save_hdf_index. """
+    with np.load(path) as npz:
+        if int(npz["version"]) != HDF_INDEX_VERSION:
+            raise ValueError(f"{path} has hdf index version "
+                             f"{int(npz['version'])}, "
+                             f"expected {HDF_INDEX_VERSION}")
+        dirs = np.array(_split_lines(npz["dirs"]), dtype=object)
+        fnames = np.array(_split_lines(npz["fnames"]), dtype=object)
+        paths = dirs[npz["dir_codes"]] + fnames
+        return make_hdf_index_from_paths(paths.tolist(),
+                                         str(npz["path_col_name"]))
+
+
+def _join_lines(values) -> np.ndarray:
+    # strings as one utf-8 blob, much smaller than a fixed-width str array
+    return np.frombuffer("\n".join(values).encode(), dtype=np.uint8)
+
+
+def _split_lines(blob: np.ndarray) -> List[str]:
+    return blob.tobytes().decode().split("\n") if len(blob) else []
@@ -1,59 +1,233 @@
 import numpy as np
-import rasterio as rio # for dataset reading
-import pyproj # for projection stuff
-from affine import Affine # class for transform matrices
 
-import cartopy.crs as ccrs # cartopy CRSs
-import matplotlib.pyplot as plt
-import matplotlib as mpl
+from typing import List, Optional, Sequence, Tuple
 
+# rasterio, cartopy and matplotlib are imported when plotting,
+# importing this module does not pull them in
 
-def plot_onto_map(src: rio.DataSetReader, crs: ccrs, 
+# (left, right, bottom, top) in the CRS of the dataset, as used by imshow
+Extent = Tuple[float, float, float, float]
+
+
+def plot_onto_map(src: "rio.DatasetReader", crs: "ccrs.CRS",
                   override_raster: Optional[np.ndarray] = None,
-                  bands: List[int]=None, factor: float=None, tf: Affine=None,
-                  figsize=(10,10), cmap=None
+                  bands: List[int]=None, factor: float=None, tf: "Affine"=None,
+                  figsize=(10,10), cmap=None, extent: Optional[Extent]=None,
+                  dpi: int=100, coastlines: Optional[str]="auto"
                  ) -> "cartopy.mpl.geoaxes.GeoAxesSubplot":
     """
     Quick and dirty plot function.
     Args:
         factor: hacky way to plot classification maps (e.g.) (low values)
         bands: 0-based! Works definitely with lists of length 3, e.g. [0,0,0].
-        override_raster: overrides raster read from src, but still uses geo 
-            properties from src. If not None, bands and factor is ignored. 
-            Defaults to None.
-    """
-    if isinstance(src, rio.DatasetReader):
-        # read image into ndarray
-        im = src.read()
-        
-        # transpose the array from (band, row, col) to (row, col, band)
-        im = np.transpose(im, [1,2,0])
+        override_raster: overrides raster read from src, but still uses geo
+            properties from src (it covers the bounds of src). If not None,
+            bands and factor is ignored. Defaults to None.
+        tf: affine transform of src if src is an ndarray
+        extent: (left, right, bottom, top) in the CRS of src. Only the
+            window inside it is read; an override raster or an ndarray src
+            is cropped to the pixels that touch it. Defaults to the bounds
+            of src.
+        dpi: with figsize, sets the resolution the raster is read at
+            (decimated reads, using overviews of the file if present)
+        coastlines: resolution of the coastlines ("10m", "50m", "110m"),
+            "auto" to choose by the extent of the map, None for none
+    """
+    import rasterio as rio # for dataset reading
+
+    max_shape = _figure_pixels(figsize, dpi)
+    if override_raster is not None:
+        im, extent = _crop(override_raster, _extent_of(src, tf), extent)
+    elif isinstance(src, rio.DatasetReader):
+        im, extent = read_window(src, extent, bands, max_shape)
     elif isinstance(src, np.ndarray): # format (row, col, band)
-        im = src
+        im = src if not bands else src[:,:,bands]
+        im, extent = _crop(im, _extent_of(src, tf), extent)
     else:
         raise TypeError("src wrong type")
-        
-    if override_raster is not None:
-        im = override_raster
-    else:
-        if bands:
-            im = im[:,:,bands]
-            print(im.shape)
-        if factor:
-            im *= factor
-    
+
+    if override_raster is None and factor:
+        im = im * factor # new array, src data and dtypes stay untouched
+
+    return _show(im, extent, crs, figsize, dpi, cmap, coastlines)
+
+
+def plot_mosaic(srcs: Sequence["rio.DatasetReader"], crs: "ccrs.CRS",
+                bands: List[int]=None, factor: float=None,
+                figsize=(10,10), cmap=None, extent: Optional[Extent]=None,
+                dpi: int=100, coastlines: Optional[str]="auto"
+               ) -> "cartopy.mpl.geoaxes.GeoAxesSubplot":
+    """
+    plot_onto_map for several datasets in the same CRS, e.g. the MODIS
+    tiles covering Spain. Each tile is read decimated into one canvas of
+    the size of the figure, see read_mosaic.
+    """
+    im, extent = read_mosaic(srcs, extent, bands, _figure_pixels(figsize, dpi))
+    if factor:
+        im = im * factor
+    return _show(im, extent, crs, figsize, dpi, cmap, coastlines)
+
+
+def read_window(src: "rio.DatasetReader", extent: Optional[Extent] = None,
+                bands: Optional[List[int]] = None,
+                max_shape: Optional[Tuple[int, int]] = None
+               ) -> Tuple[np.ndarray, Extent]:
+    """
+    Reads the part of src inside extent, at most at max_shape (rows, cols).
+
+    Returns:
+        (im, extent) with im as (row, col, band) array covering extent
+        (default: the bounds of src); pixels outside src are 0
+    """
+    return read_mosaic([src], extent, bands, max_shape)
+
+
+def read_mosaic(srcs: Sequence["rio.DatasetReader"],
+                extent: Optional[Extent] = None,
+                bands: Optional[List[int]] = None,
+                max_shape: Optional[Tuple[int, int]] = None
+               ) -> Tuple[np.ndarray, Extent]:
+    """
+    Reads several datasets of the same CRS into one (row, col, band) array
+    covering extent (default: the union of their bounds). The array is
+    at most max_shape and at most the native resolution of the first
+    dataset. Every dataset is read once, only in the window overlapping
+    extent and directly at the output resolution (GDAL picks overviews
+    if present), so no full-resolution array is created. Where datasets
+    overlap, the first one wins.
+
+    Args:
+        bands: 0-based band indices, e.g. [0,0,0]; each band is read once
+    """
+    from rasterio.enums import Resampling
+    from rasterio.transform import from_bounds
+    from rasterio.windows import from_bounds as window_from_bounds
+
+    if len(srcs) == 0:
+        raise ValueError("no datasets to read")
+    if extent is None:
+        extent = (min(s.bounds.left for s in srcs),
+                  max(s.bounds.right for s in srcs),
+                  min(s.bounds.bottom for s in srcs),
+                  max(s.bounds.top for s in srcs))
+    left, right, bottom, top = extent
+    res_x, res_y = srcs[0].res
+
+    # output grid: native resolution, reduced to fit max_shape
+    width = max(1, int(round((right - left) / res_x)))
+    height = max(1, int(round((top - bottom) / res_y)))
+    if max_shape is not None:
+        scale = min(1.0, max_shape[0] / height, max_shape[1] / width)
+        height = max(1, int(np.ceil(height * scale)))
+        width = max(1, int(np.ceil(width * scale)))
+    transform = from_bounds(left, bottom, right, top, width, height)
+
+    # only read each distinct band once, e.g. [0,0,0] reads band 1 once
+    bands = list(bands) if bands else list(range(srcs[0].count))
+    unique_bands, band_pos = np.unique(bands, return_inverse=True)
+    indexes = [int(b) + 1 for b in unique_bands] # rasterio is 1-based
+
+    canvas = np.zeros((height, width, len(indexes)), dtype=srcs[0].dtypes[0])
+    filled = np.zeros((height, width), dtype=bool)
+    for src in srcs:
+        # overlap of src and extent, in canvas pixels
+        o_left, o_right = max(left, src.bounds.left), min(right, src.bounds.right)
+        o_bottom, o_top = max(bottom, src.bounds.bottom), min(top, src.bounds.top)
+        if o_left >= o_right or o_bottom >= o_top:
+            continue
+        c0, r0 = ~transform * (o_left, o_top)
+        c1, r1 = ~transform * (o_right, o_bottom)
+        r0, c0 = int(round(r0)), int(round(c0))
+        r1, c1 = int(round(r1)), int(round(c1))
+        if r1 <= r0 or c1 <= c0:
+            continue
+
+        window = window_from_bounds(o_left, o_bottom, o_right, o_top,
+                                    transform=src.transform)
+        data = src.read(indexes, window=window,
+                        out_shape=(len(indexes), r1 - r0, c1 - c0),
+                        resampling=Resampling.nearest)
+        target = canvas[r0:r1, c0:c1]
+        empty = ~filled[r0:r1, c0:c1]
+        target[empty] = np.moveaxis(data, 0, -1)[empty]
+        filled[r0:r1, c0:c1] = True
+
+    return canvas[:, :, band_pos], extent
+
+
+def coastline_resolution(width_deg: float) -> str:
+    """
+    Natural Earth resolution matching a map width in degrees: 10m
+    coastlines are only worth drawing (and loading) for regional maps.
+    """
+    if width_deg > 30:
+        return "110m"
+    if width_deg > 5:
+        return "50m"
+    return "10m"
+
+
+def _figure_pixels(figsize, dpi: int) -> Tuple[int, int]:
+    """ (rows, cols) of a figure of figsize inches. """
+    return int(figsize[1] * dpi), int(figsize[0] * dpi)
+
+
+def _extent_of(src, tf: "Affine" = None) -> Extent:
+    if hasattr(src, "bounds"):
+        return (src.bounds.left, src.bounds.right,
+                src.bounds.bottom, src.bounds.top)
+    if tf is None:
+        raise ValueError("tf is needed to place an ndarray on the map")
+    from rasterio.transform import array_bounds
+    west, south, east, north = array_bounds(src.shape[0], src.shape[1], tf)
+    return west, east, south, north
+
+
+def _crop(im: np.ndarray, bounds: Extent, extent: Optional[Extent]
+         ) -> Tuple[np.ndarray, Extent]:
+    """
+    The pixels of im (covering bounds) that touch extent, and their extent.
+    Without extent, im and bounds.
+    """
+    if extent is None:
+        return im, bounds
+    west, east, south, north = bounds
+    px_w = (east - west) / im.shape[1]
+    px_h = (north - south) / im.shape[0]
+    c0 = int(np.clip(np.floor((extent[0] - west) / px_w), 0, im.shape[1]))
+    c1 = int(np.clip(np.ceil((extent[1] - west) / px_w), 0, im.shape[1]))
+    r0 = int(np.clip(np.floor((north - extent[3]) / px_h), 0, im.shape[0]))
+    r1 = int(np.clip(np.ceil((north - extent[2]) / px_h), 0, im.shape[0]))
+    if c0 >= c1 or r0 >= r1:
+        raise ValueError("extent does not overlap the raster")
+    return im[r0:r1, c0:c1], (west + c0 * px_w, west + c1 * px_w,
+                              north - r1 * px_h, north - r0 * px_h)
+
+
+def _show(im: np.ndarray, extent: Extent, crs: "ccrs.CRS", figsize, dpi: int,
+          cmap, coastlines: Optional[str]
+         ) -> "cartopy.mpl.geoaxes.GeoAxesSubplot":
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+
+    if im.ndim == 3 and im.shape[2] == 1:
+        im = im[:, :, 0] # single band: let cmap apply
+
     # create figure
-    fig, ax = plt.subplots(figsize=figsize, subplot_kw={'projection': crs})
+    fig, ax = plt.subplots(figsize=figsize, dpi=dpi,
+                           subplot_kw={'projection': crs})
     ax.set_xmargin(0.05) # doesn't do anything???
     ax.set_ymargin(0.10) # doesn't do anything???
-    
+
     # plot raster
-    plt.imshow(im, origin='upper', 
-               extent=[src.bounds.left, src.bounds.right, 
-                       src.bounds.bottom, src.bounds.top], 
+    plt.imshow(im, origin='upper', extent=list(extent),
                transform=crs, interpolation='nearest', cmap=cmap)
-    
+
     # plot coastlines
-    ax.coastlines(resolution='10m', color='red', linewidth=1)
-    
-    return ax
\ No newline at end of file
+    if coastlines == "auto":
+        lon_min, lon_max, _, _ = ax.get_extent(ccrs.PlateCarree())
+        coastlines = coastline_resolution(lon_max - lon_min)
+    if coastlines:
+        ax.coastlines(resolution=coastlines, color='red', linewidth=1)
+
+    return ax
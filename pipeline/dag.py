@@ -0,0 +1,399 @@
+"""
+A small DAG runner with content-hash caching for the fire / tourism
+pipeline (download -> extract -> store -> index -> score -> render).
+
+Stages are declared in a JSON config:
+    {
+      "cache_dir": ".pipeline_cache",
+      "params": {"limits": [41.7, 43.8, -9.4, -4.3], "bandwidth": 5e-4},
+      "stages": {
+        "pois":  {"run": "pipeline.stages:load_pois",
+                  "files": ["tourism/data.csv"],
+                  "params": {"limits": "$limits"}},
+        "model": {"run": "pipeline.stages:fit_model", "inputs": ["pois"],
+                  "params": {"bandwidth": "$bandwidth"}},
+        ...
+        "render": {..., "publish": "folium_map.html"}
+      }
+    }
+"run" names a function fn(inputs, params, out_dir): inputs maps the names
+of the input stages to their output directories, params are the stage
+params (with "$name" replaced by the shared params and the resolved
+"files" added), out_dir is the directory to write the outputs to.
+
+The output of a stage is cached in cache_dir/<stage>/<key>/, where key
+hashes the function name, the source of every repository module the
+function imports (directly or through other repository modules, see
+code_dependencies), the params, the content of the files and the content
+hashes of the input stages' outputs.
+Changing a param thus only re-runs the stages downstream of it, and a
+re-run stage whose output did not change does not invalidate its
+dependents. Stages whose inputs are done run in parallel processes.
+
+Command line (from the repository root):
+    python -m pipeline.dag pipeline/galicia.json --jobs 4
+    python -m pipeline.dag pipeline/galicia.json --set bandwidth=1e-3
+    python -m pipeline.dag pipeline/galicia.json --set render.tiles=true
+    python -m pipeline.dag pipeline/galicia.json --dry-run
+"""
+import argparse
+import ast
+import copy
+import glob
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from typing import Any, Callable, Dict, List, Optional
+
+MANIFEST = "_manifest.json"
+
+
+def resolve(dotted: str) -> Callable:
+    """ "package.module:function" -> function """
+    module, _, name = dotted.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def hash_file(path: str, h: Optional["hashlib._Hash"] = None) -> str:
+    h = h or hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_directory(path: str) -> str:
+    """ Content hash of all files below path (names and bytes). """
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name == MANIFEST:
+                continue
+            fpath = os.path.join(root, name)
+            h.update(os.path.relpath(fpath, path).encode() + b"\0")
+            hash_file(fpath, h)
+    return h.hexdigest()
+
+
+def _imported_modules(nodes) -> List[str]:
+    """ Dotted names imported by the statements below nodes. """
+    names = []
+    for node in nodes:
+        for sub in ast.walk(node):
+            if isinstance(sub, ast.Import):
+                names += [a.name for a in sub.names]
+            elif isinstance(sub, ast.ImportFrom) and sub.module \
+                    and not sub.level:
+                # "from pkg import module" or "from module import name"
+                names.append(sub.module)
+                names += [f"{sub.module}.{a.name}" for a in sub.names]
+    return names
+
+
+def _module_file(name: str, base_dir: str) -> Optional[str]:
+    """ Source file of a repository module, None for other modules. """
+    path = os.path.join(base_dir, *name.split(".")) + ".py"
+    return path if os.path.isfile(path) else None
+
+
+def code_dependencies(run: str, base_dir: str = ".") -> List[str]:
+    """
+    Source files of the repository modules that the stage function run
+    ("package.module:function") depends on: its own module and, through
+    the imports at module level and inside the function, every repository
+    module reachable from there (all of whose imports count). Imports in
+    other functions of the stage module are not followed, so that e.g.
+    the render stage does not depend on fire.dataloader.
+    """
+    module, _, function = run.partition(":")
+    path = _module_file(module, base_dir)
+    if path is None:
+        raise ValueError(f"{module} is not a module of {base_dir}")
+    with open(path, "rt") as f:
+        tree = ast.parse(f.read(), path)
+    nodes = [n for n in tree.body
+             if not isinstance(n, (ast.FunctionDef, ast.ClassDef))
+             or n.name == function]
+
+    files, todo = {path}, _imported_modules(nodes)
+    while todo:
+        dep = _module_file(todo.pop(), base_dir)
+        if dep is None or dep in files:
+            continue
+        files.add(dep)
+        with open(dep, "rt") as f:
+            todo += _imported_modules([ast.parse(f.read(), dep)])
+    return sorted(files)
+
+
+def parse_value(text: str) -> Any:
+    """ JSON if possible, e.g. 1e-3 or [1, 2], else the string itself. """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+class Pipeline():
+    """
+    How to:
+    1) load and optionally override params
+        pipeline = Pipeline.from_json("pipeline/galicia.json")
+        pipeline.set("bandwidth", 1e-3)
+    2) run (cached stages are skipped)
+        outputs = pipeline.run(jobs=4)   # stage -> output directory
+    """
+    def __init__(self, config: dict, base_dir: str = "."):
+        self.config = copy.deepcopy(config)
+        self.base_dir = base_dir
+        self.cache_dir = os.path.join(base_dir,
+                                      config.get("cache_dir", ".pipeline_cache"))
+        self.stages: Dict[str, dict] = self.config["stages"]
+        self.params: Dict[str, Any] = self.config.get("params", {})
+        for name, stage in self.stages.items():
+            for dep in stage.get("inputs", []):
+                if dep not in self.stages:
+                    raise ValueError(f"stage {name}: unknown input {dep}")
+        self.order = self._topological_order()
+        self._code: Dict[str, Dict[str, str]] = {} # run -> file hashes
+
+    @classmethod
+    def from_json(cls, path: str, base_dir: str = ".") -> "Pipeline":
+        with open(path, "rt") as f:
+            return cls(json.load(f), base_dir)
+
+    def set(self, name: str, value: Any) -> None:
+        """
+        Overrides a shared param ("bandwidth") or a stage param
+        ("render.tiles").
+        """
+        stage, _, param = name.rpartition(".")
+        if stage:
+            if stage not in self.stages:
+                raise KeyError(f"unknown stage {stage}")
+            self.stages[stage].setdefault("params", {})[param] = value
+        else:
+            self.params[name] = value
+
+    def _topological_order(self) -> List[str]:
+        order, state = [], {} # state: 1 = visiting, 2 = done
+        def visit(name, path):
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError("cycle: " + " -> ".join(path + [name]))
+            state[name] = 1
+            for dep in self.stages[name].get("inputs", []):
+                visit(dep, path + [name])
+            state[name] = 2
+            order.append(name)
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    # cache keys
+    # ----------------------------------------------------
+    def stage_params(self, name: str) -> dict:
+        """ Params of a stage with shared params and files resolved. """
+        def subst(value):
+            if isinstance(value, str) and value.startswith("$"):
+                return self.params[value[1:]]
+            if isinstance(value, list):
+                return [subst(v) for v in value]
+            if isinstance(value, dict):
+                return {k: subst(v) for k, v in value.items()}
+            return value
+        stage = self.stages[name]
+        params = subst(stage.get("params", {}))
+        files = []
+        for pattern in subst(stage.get("files", [])):
+            matches = sorted(glob.glob(os.path.join(self.base_dir, pattern)))
+            if not matches:
+                raise FileNotFoundError(f"stage {name}: no file {pattern}")
+            files += matches
+        if files:
+            params["files"] = files
+        return params
+
+    def stage_key(self, name: str, input_hashes: Dict[str, str]) -> str:
+        stage = self.stages[name]
+        params = self.stage_params(name)
+        description = {
+            "run": stage["run"],
+            "code": self.code_hashes(stage["run"]),
+            "params": {k: v for k, v in params.items() if k != "files"},
+            "files": {os.path.relpath(f, self.base_dir): hash_file(f)
+                      for f in params.get("files", [])},
+            "inputs": input_hashes,
+        }
+        blob = json.dumps(description, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()[:20]
+
+    def code_hashes(self, run: str) -> Dict[str, str]:
+        """ relative path -> content hash of the code_dependencies of run """
+        if run not in self._code:
+            self._code[run] = {
+                os.path.relpath(f, self.base_dir): hash_file(f)
+                for f in code_dependencies(run, self.base_dir)}
+        return self._code[run]
+
+    def output_dir(self, name: str, key: str) -> str:
+        return os.path.join(self.cache_dir, name, key)
+
+    def cached(self, name: str, key: str) -> Optional[dict]:
+        path = os.path.join(self.output_dir(name, key), MANIFEST)
+        if os.path.exists(path):
+            with open(path, "rt") as f:
+                return json.load(f)
+        return None
+
+    # running
+    # ----------------------------------------------------
+    def run(self, jobs: int = 1, force: List[str] = (),
+            dry_run: bool = False, verbose: bool = True) -> Dict[str, str]:
+        """
+        Runs all stages that are not cached.
+
+        Args:
+            jobs: number of stages run in parallel (processes)
+            force: stages to re-run even if cached
+            dry_run: only report which stages are cached; stages below a
+                stage that would run are reported as "pending"
+
+        Returns:
+            dict stage -> output directory
+        """
+        log = print if verbose else (lambda *a, **k: None)
+        content: Dict[str, str] = {} # stage -> content hash of output
+        outputs: Dict[str, str] = {}
+        running = {} # future -> (stage, key, tmp dir, start time)
+        blocked = set()
+        pending = list(self.order)
+
+        with ProcessPoolExecutor(max_workers=max(1, jobs)) as pool:
+            while pending or running:
+                for name in list(pending):
+                    deps = self.stages[name].get("inputs", [])
+                    if any(d in blocked for d in deps):
+                        pending.remove(name)
+                        blocked.add(name)
+                        log(f"{name:12s} pending")
+                        continue
+                    if not all(d in content for d in deps):
+                        continue
+                    pending.remove(name)
+                    key = self.stage_key(name, {d: content[d] for d in deps})
+                    manifest = self.cached(name, key)
+                    if manifest and name not in force:
+                        content[name] = manifest["content_hash"]
+                        outputs[name] = self.output_dir(name, key)
+                        log(f"{name:12s} cached   {outputs[name]}")
+                        continue
+                    if dry_run:
+                        blocked.add(name)
+                        log(f"{name:12s} would run")
+                        continue
+                    tmp = os.path.join(self.cache_dir, name,
+                                       f".tmp-{uuid.uuid4().hex}")
+                    os.makedirs(tmp)
+                    inputs = {d: outputs[d] for d in deps}
+                    future = pool.submit(_execute, self.stages[name]["run"],
+                                         inputs, self.stage_params(name), tmp)
+                    running[future] = (name, key, tmp, time.perf_counter())
+                    log(f"{name:12s} started")
+
+                if not running:
+                    continue
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, key, tmp, t0 = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        shutil.rmtree(tmp, ignore_errors=True)
+                        for f in running:
+                            f.cancel()
+                        raise
+                    outputs[name], content[name] = self._commit(
+                        name, key, tmp, time.perf_counter() - t0)
+                    log(f"{name:12s} done     {outputs[name]} "
+                        f"({time.perf_counter() - t0:.1f} s)")
+
+        if not dry_run:
+            self._publish(outputs, log)
+        return outputs
+
+    def _commit(self, name: str, key: str, tmp: str, seconds: float):
+        content_hash = hash_directory(tmp)
+        with open(os.path.join(tmp, MANIFEST), "wt") as f:
+            json.dump({"stage": name, "key": key,
+                       "content_hash": content_hash,
+                       "seconds": seconds,
+                       "created": time.strftime("%Y-%m-%dT%H:%M:%S")}, f,
+                      indent=1)
+        final = self.output_dir(name, key)
+        if os.path.exists(final):
+            shutil.rmtree(final) # forced re-run
+        os.rename(tmp, final)
+        return final, content_hash
+
+    def _publish(self, outputs: Dict[str, str], log) -> None:
+        """ Copies outputs to the "publish" path of their stage. """
+        for name, out_dir in outputs.items():
+            target = self.stages[name].get("publish")
+            if not target:
+                continue
+            target = os.path.join(self.base_dir, target)
+            files = [f for f in os.listdir(out_dir) if f != MANIFEST]
+            dirs = [f for f in files if os.path.isdir(os.path.join(out_dir, f))]
+            if len(files) - len(dirs) == 1 and not target.endswith(os.sep):
+                # single output file, e.g. the map, with the directories it
+                # refers to (e.g. tiles/) replaced next to it
+                main = next(f for f in files if f not in dirs)
+                shutil.copyfile(os.path.join(out_dir, main), target)
+                for d in dirs:
+                    published = os.path.join(os.path.dirname(target), d)
+                    shutil.rmtree(published, ignore_errors=True)
+                    shutil.copytree(os.path.join(out_dir, d), published)
+            else:
+                shutil.copytree(out_dir, target, dirs_exist_ok=True,
+                                ignore=shutil.ignore_patterns(MANIFEST))
+            log(f"{name:12s} -> {target}")
+
+
+def _execute(run: str, inputs: Dict[str, str], params: dict,
+             out_dir: str) -> None:
+    resolve(run)(inputs, params, out_dir)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline declared in a JSON config.")
+    parser.add_argument("config", help="pipeline config (JSON)")
+    parser.add_argument("--set", nargs="+", default=[], metavar="NAME=VALUE",
+                        help="override a shared param (bandwidth=1e-3) or "
+                             "a stage param (render.tiles=tiles)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="stages run in parallel")
+    parser.add_argument("--force", nargs="+", default=[],
+                        help="stages to re-run even if cached")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only show which stages are cached")
+    args = parser.parse_args(argv)
+
+    pipeline = Pipeline.from_json(args.config)
+    for assignment in args.set:
+        name, _, value = assignment.partition("=")
+        pipeline.set(name, parse_value(value))
+    pipeline.run(jobs=args.jobs, force=args.force, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Stage functions for pipeline.dag, covering
+    download -> extract -> store -> index -> score -> render.
+
+Every stage has the signature fn(inputs, params, out_dir):
+    inputs:  dict input stage name -> its output directory
+    params:  the stage params of the config ("files" holds the resolved
+             paths of the stage's "files")
+    out_dir: empty directory the stage writes its outputs to
+
+Outputs, by stage:
+    download            : hdf/*.hdf
+    extract, load_fires : fires.csv   (lat, lon, fire_val, date)
+    load_pois,
+    extract_pois        : pois.npz, vocabulary.json (see tourism/encoding.py)
+    cube                : cube/       (see fire/cube.py)
+    events              : fires.csv with an "event" column, events.csv
+    fit_model           : model.joblib (analysis.scoring.AttributionModel)
+    score               : scores.csv, summary.json
+    render              : folium_map.html, tiles/ (optional)
+"""
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List, Optional
+
+# own stuff
+import analysis.scoring as ascore
+import tourism.encoding as tenc
+
+
+# helpers to read the outputs of other stages
+# ----------------------------------------------------
+def read_fires(out_dir: str) -> pd.DataFrame:
+    return pd.read_csv(os.path.join(out_dir, "fires.csv"))
+
+
+def read_pois(out_dir: str) -> pd.DataFrame:
+    vocab = tenc.Vocabulary.load(os.path.join(out_dir, "vocabulary.json"))
+    return tenc.load_npz(os.path.join(out_dir, "pois.npz"), vocab)
+
+
+def write_pois(pois: pd.DataFrame, vocab: tenc.Vocabulary,
+               out_dir: str) -> None:
+    tenc.save_npz(os.path.join(out_dir, "pois.npz"), pois, vocab)
+    vocab.save(os.path.join(out_dir, "vocabulary.json"))
+
+
+def _limit(df: pd.DataFrame, limits: Optional[List[float]]) -> pd.DataFrame:
+    # borders excluded, as in visualisation/folium_map.py
+    if limits is None:
+        return df.reset_index(drop=True)
+    return ascore.filter_bbox(df, limits).reset_index(drop=True)
+
+
+def _fire_inputs(inputs: Dict[str, str]) -> List[pd.DataFrame]:
+    return [read_fires(d) for d in inputs.values()
+            if os.path.exists(os.path.join(d, "fires.csv"))]
+
+
+# download / extract / store
+# ----------------------------------------------------
+def download(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    params:
+        product_url: e.g. "https://e4ftl01.cr.usgs.gov/MOLT/MOD14A1.006/"
+        min_date, max_date: "YYYY-MM-DD", optional
+        hdf_regex: filter of the file URLs, e.g. tiles r"h1[78]v0[45].*\\.hdf$"
+        netrc_token: machine name of the Earthdata login in ~/.netrc
+        n_parallel_downloads: default 10
+    """
+    from datetime import datetime
+    import fire.downloader as fd
+
+    def date(key):
+        return datetime.strptime(params[key], r"%Y-%m-%d") \
+               if params.get(key) else None
+
+    urls = fd.collect_hdf_urls_from_lpdaac(
+        params["product_url"], hdf_regex=params.get("hdf_regex", r"\.hdf$"),
+        min_date=date("min_date"), max_date=date("max_date"), verbose=False)
+    auth = fd.get_auth_from_netrc(params["netrc_token"]) \
+           if params.get("netrc_token") else None
+    targets = [os.path.join(out_dir, "hdf", os.path.basename(u)) for u in urls]
+    ok = fd.fetch_many_files(urls, targets, auth,
+                             params.get("n_parallel_downloads", 10),
+                             verbose=False)
+    if not all(ok):
+        raise RuntimeError(f"{len(ok) - sum(ok)} of {len(ok)} downloads failed")
+
+
+def _hdf_files(inputs: Dict[str, str], params: dict) -> List[str]:
+    files = list(params.get("files", []))
+    for d in inputs.values():
+        files += sorted(glob.glob(os.path.join(d, "hdf", "*.hdf")))
+    return files
+
+
+def extract(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    Fires from the hdf files of the input stages (and "files").
+
+    params:
+        merge_satellites: combine MOD and MYD files, see get_fires_merged
+        limits: [lat_min, lat_max, lon_min, lon_max], optional
+    """
+    import fire.dataloader as dl
+
+    files = _hdf_files(inputs, params)
+    if params.get("merge_satellites", True):
+        fires = dl.get_fires_merged(files)
+    else:
+        fires = dl.get_fires(files)
+    _limit(fires, params.get("limits"))\
+        .to_csv(os.path.join(out_dir, "fires.csv"), index=False)
+
+
+def load_fires(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    Concatenates fire tables from "files" and the input stages.
+
+    params:
+        limits: [lat_min, lat_max, lon_min, lon_max], optional
+    """
+    dfs = [pd.read_csv(f) for f in params.get("files", [])]
+    fires = pd.concat(dfs + _fire_inputs(inputs), axis=0)
+    _limit(fires, params.get("limits"))\
+        .to_csv(os.path.join(out_dir, "fires.csv"), index=False)
+
+
+def cube(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    Daily fire-mask cube of the hdf files, see fire/cube.py.
+
+    params:
+        chunks: [days, rows, cols], optional
+    """
+    import fire.cube as fcube
+
+    chunks = tuple(params.get("chunks", fcube.DEFAULT_CHUNKS))
+    fcube.build_cube(_hdf_files(inputs, params), os.path.join(out_dir, "cube"),
+                     chunks=chunks, verbose=False)
+
+
+def load_pois(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    POIs from tourism/data*.csv "files".
+
+    params:
+        limits: [lat_min, lat_max, lon_min, lon_max], optional
+    """
+    vocab = tenc.Vocabulary.load()
+    pois = tenc.read_pois(params["files"], vocab)
+    write_pois(_limit(pois, params.get("limits")), vocab, out_dir)
+
+
+def extract_pois(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    POIs from OSM extracts ("files", .osm.pbf), see tourism/tourism.py.
+
+    params:
+        limits: [lat_min, lat_max, lon_min, lon_max], optional
+    """
+    import tourism.tourism as tt
+
+    vocab = tenc.Vocabulary.load()
+    dfs = [tt.load(f, vocab).get_dataframe() for f in params["files"]]
+    pois = pd.concat(dfs, axis=0, ignore_index=True)
+    write_pois(_limit(pois, params.get("limits")), vocab, out_dir)
+
+
+# index / score / render
+# ----------------------------------------------------
+def events(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    Fire events, see fire/events.py.
+
+    params:
+        max_gap_days: default 1
+    """
+    import fire.events as fevents
+
+    fires = pd.concat(_fire_inputs(inputs), axis=0, ignore_index=True)
+    labelled, table = fevents.build_events(fires,
+                                           params.get("max_gap_days", 1))
+    labelled.to_csv(os.path.join(out_dir, "fires.csv"), index=False)
+    table.to_csv(os.path.join(out_dir, "events.csv"), index=False)
+
+
+def fit_model(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    Tourism / non-tourism KDEs of the POIs of the input stage.
+
+    params:
+        bandwidth, atol: see analysis/scoring.py
+    """
+    import joblib
+
+    pois = pd.concat([read_pois(d) for d in inputs.values()],
+                     axis=0, ignore_index=True)
+    model = ascore.AttributionModel.from_pois(
+        pois, bandwidth=params.get("bandwidth", ascore.BANDWIDTH),
+        atol=params.get("atol", ascore.ATOL))
+    joblib.dump(model, os.path.join(out_dir, "model.joblib"))
+
+
+def score(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    Scores the fires of the input stages with the model of the input
+    stage that has one.
+
+    params:
+        n_jobs: processes used for scoring, default 1
+    """
+    import joblib
+
+    model_dirs = [d for d in inputs.values()
+                  if os.path.exists(os.path.join(d, "model.joblib"))]
+    if len(model_dirs) != 1:
+        raise ValueError("score needs exactly one fit_model input")
+    model = joblib.load(os.path.join(model_dirs[0], "model.joblib"))
+    fires = pd.concat(_fire_inputs(inputs), axis=0, ignore_index=True)
+
+    scored = model.attribute(fires, n_jobs=params.get("n_jobs", 1))
+    scored.to_csv(os.path.join(out_dir, "scores.csv"), index=False)
+    correlated = scored["tourism_correlated"].to_numpy()
+    summary = {
+        "n_fires": int(len(scored)),
+        "n_tourism_correlated": int(np.count_nonzero(correlated)),
+        "log_diff": float(scored["score_non_tourism"].sum()
+                          - scored["score_tourism"].sum()),
+    }
+    with open(os.path.join(out_dir, "summary.json"), "wt") as f:
+        json.dump(summary, f, indent=1)
+
+
+def render(inputs: Dict[str, str], params: dict, out_dir: str) -> None:
+    """
+    The folium map of visualisation/folium_map.py.
+
+    inputs: one stage with POIs, one with scores (scores.csv, the fires
+            with their scores)
+    params:
+        limits: [lat_min, lat_max, lon_min, lon_max]
+        bandwidth: of the KDE contours
+        tiles: if true, export point layers as tile pyramids into
+            out_dir/tiles/, published next to the map, optional
+        tiles_url: URL under which the published tiles/ is served
+    """
+    import visualisation.folium_map as fmap
+
+    pois = [read_pois(d) for d in inputs.values()
+            if os.path.exists(os.path.join(d, "pois.npz"))]
+    scores = [pd.read_csv(os.path.join(d, "scores.csv"))
+              for d in inputs.values()
+              if os.path.exists(os.path.join(d, "scores.csv"))]
+    if len(pois) != 1 or len(scores) != 1:
+        raise ValueError("render needs one POI and one score input")
+    # tiles inside out_dir, so that they are cached and published with
+    # the map they belong to
+    tiles = os.path.join(out_dir, "tiles") if params.get("tiles") else None
+    fmap.build_map(pois[0], scores[0], params["limits"],
+                   bandwidth=params.get("bandwidth", ascore.BANDWIDTH),
+                   out=os.path.join(out_dir, "folium_map.html"),
+                   tiles=tiles,
+                   tiles_url=params.get("tiles_url", "http://localhost:8000"))
@@ -0,0 +1,199 @@
+"""
+Radius queries for tourist activity around locations.
+
+The POIs extracted by tourism.py are indexed once in a haversine BallTree;
+a query counts the POIs per subtype within a radius and sums their
+weights. Single queries take well below a millisecond, batches of
+locations are answered in one tree traversal per location without Python
+loops over the POIs.
+
+Example:
+    index = ActivityIndex.from_csv(["tourism/data.csv"])
+    index.query(42.88, -8.54, radius=5)
+    index.query_many(fire_data["lat"], fire_data["lon"], radius=5)
+
+The index can also be served over HTTP to other services:
+    python -m tourism.activity --csv tourism/data.csv --port 8080
+    curl "localhost:8080/activity?lat=42.88&lng=-8.54&radius=5"
+"""
+import argparse
+import json
+from functools import partial
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from typing import Dict, List, Optional
+
+# own stuff
+import tourism.encoding as tenc
+
+# CONSTANTS
+# ----------------------------------------------------
+EARTH_RADIUS_KM = 6371.0088 # mean earth radius
+# ----------------------------------------------------
+
+
+class ActivityIndex():
+    """
+    Spatial index over POIs for counting tourist activity.
+    """
+    def __init__(self, pois: pd.DataFrame,
+                 types: Optional[List[str]] = ("tourism",),
+                 weights: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            pois: table with columns lat, lon, type, subtype
+            types: POI types to index, None for all. Defaults to the
+                tourism POIs only.
+            weights: weight per subtype for the weighted activity,
+                subtypes not listed weigh 1
+        """
+        if types is not None:
+            pois = pois.loc[pois["type"].isin(list(types))]
+        codes, subtypes = pd.factorize(pois["subtype"], sort=True)
+        self.subtypes = [str(s) for s in subtypes]
+        self.codes = codes.astype(np.int32)
+
+        weights = weights or {}
+        self.subtype_weights = np.array(
+            [weights.get(s, 1.0) for s in self.subtypes], dtype=np.float64)
+
+        X = np.deg2rad(pois[["lat", "lon"]].to_numpy(dtype=np.float64))
+        # BallTree needs at least one point; without POIs nothing is found
+        self.tree = BallTree(X, metric="haversine") if len(X) else None
+
+    @classmethod
+    def from_csv(cls, paths: List[str], **kwargs) -> "ActivityIndex":
+        """ Builds the index from tourism/data*.csv files. """
+        return cls(tenc.read_pois(paths), **kwargs)
+
+    def query(self, lat: float, lng: float, radius: float = 5) -> dict:
+        """
+        Args:
+            lat, lng: location in degrees
+            radius: in km
+
+        Returns:
+            dict with
+                "count"    : int   : number of POIs within radius
+                "weighted" : float : sum of the subtype weights of these POIs
+                "subtypes" : dict  : count per subtype (only non-zero ones)
+        """
+        idx = self._query_radius(np.deg2rad([[lat, lng]]), radius)[0]
+        counts = np.bincount(self.codes[idx], minlength=len(self.subtypes))
+        nonzero = np.flatnonzero(counts)
+        return {
+            "count": int(len(idx)),
+            "weighted": float(counts @ self.subtype_weights),
+            "subtypes": {self.subtypes[i]: int(counts[i]) for i in nonzero},
+        }
+
+    def query_many(self, lat: np.ndarray, lng: np.ndarray,
+                   radius: float = 5) -> pd.DataFrame:
+        """
+        Batch variant of query.
+
+        Returns:
+            pandas.DataFrame with one row per location and the columns
+            count, weighted and one int32 count column per subtype
+        """
+        X = np.deg2rad(np.column_stack([np.asarray(lat, dtype=np.float64),
+                                        np.asarray(lng, dtype=np.float64)]))
+        n, n_sub = len(X), len(self.subtypes)
+        idx = self._query_radius(X, radius)
+        sizes = np.array([len(i) for i in idx], dtype=np.int64)
+        rows = np.repeat(np.arange(n), sizes)
+        found = np.concatenate(idx) if n else np.empty(0, dtype=np.intp)
+
+        counts = np.bincount(rows * n_sub + self.codes[found],
+                             minlength=n * n_sub).reshape(n, n_sub)
+        result = pd.DataFrame(counts.astype(np.int32), columns=self.subtypes)
+        result.insert(0, "weighted", counts @ self.subtype_weights)
+        result.insert(0, "count", sizes.astype(np.int32))
+        return result
+
+    def _query_radius(self, X: np.ndarray, radius: float) -> List[np.ndarray]:
+        """ Indices of the POIs within radius (km) of each row of X. """
+        if len(X) == 0:
+            return []
+        if self.tree is None:
+            return [np.empty(0, dtype=np.intp) for _ in range(len(X))]
+        return list(self.tree.query_radius(X, r=radius / EARTH_RADIUS_KM))
+
+
+class _ActivityRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /activity?lat=..&lng=..&radius=..        -> result of query
+    POST /activity  {"lat": [..], "lng": [..], "radius": ..}
+                                                   -> list of query results
+    """
+    def __init__(self, *args, index: ActivityIndex, **kwargs):
+        self.index = index
+        super().__init__(*args, **kwargs)
+
+    def _send(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/activity":
+            return self._send(404, {"error": "not found"})
+        params = parse_qs(url.query)
+        try:
+            lat = float(params["lat"][0])
+            lng = float(params["lng"][0])
+            radius = float(params.get("radius", [5])[0])
+        except (KeyError, ValueError) as e:
+            return self._send(400, {"error": f"bad parameters: {e}"})
+        self._send(200, self.index.query(lat, lng, radius))
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/activity":
+            return self._send(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            result = self.index.query_many(request["lat"], request["lng"],
+                                           float(request.get("radius", 5)))
+        except (KeyError, ValueError, TypeError) as e:
+            return self._send(400, {"error": f"bad request: {e}"})
+        self._send(200, result.to_dict(orient="records"))
+
+    def log_message(self, format, *args):
+        pass # no line per request on stderr
+
+
+def serve(index: ActivityIndex, port: int = 8080,
+          host: str = "localhost") -> None:
+    """ Serves the index over HTTP until interrupted. """
+    handler = partial(_ActivityRequestHandler, index=index)
+    with ThreadingHTTPServer((host, port), handler) as httpd:
+        print(f"Serving tourist activity at http://{host}:{port}/activity")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve tourist activity radius queries over HTTP.")
+    parser.add_argument("--csv", nargs="+", required=True,
+                        help="tourism/data*.csv files")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args(argv)
+    serve(ActivityIndex.from_csv(args.csv), args.port, args.host)
+
+
+if __name__ == "__main__":
+    main()
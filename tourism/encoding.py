@@ -0,0 +1,202 @@
+"""
+Dictionary encoding of the POI tables written by tourism.py.
+
+type and subtype are stored as pandas categoricals whose categories come
+from a shared, versioned vocabulary (tourism/vocabulary.json), so that a
+code means the same type or subtype in every region. The vocabulary is
+append-only: new values get the next free code and bump the version, old
+codes never change, so tables encoded with an older version can be read
+with any newer one. With ~30 types and ~500 subtypes the codes fit into
+int8 and int16; coordinates are kept as float32 (< 1 m error).
+
+Comparisons like pois["type"] == "tourism" work as before and compare the
+integer codes.
+
+Example:
+    vocab = Vocabulary.load()
+    pois = read_pois(["tourism/data.csv", "tourism/data_galicia.csv"], vocab)
+    save_npz("tourism/data.npz", pois, vocab)
+    pois = load_npz("tourism/data.npz")
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from typing import Dict, Iterable, List, Optional
+
+# CONSTANTS
+# ----------------------------------------------------
+DEFAULT_VOCABULARY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "vocabulary.json")
+COLUMNS = ["lat", "lon", "type", "subtype"]
+COORD_DTYPE = np.float32
+# ----------------------------------------------------
+
+
+class Vocabulary():
+    """
+    Append-only list of POI types and subtypes. The position of a value
+    in types / subtypes is its code. All additions between two saves
+    share one new version.
+    """
+    def __init__(self, types: Optional[List[str]] = None,
+                 subtypes: Optional[List[str]] = None, version: int = 0):
+        self.types = list(types or [])
+        self.subtypes = list(subtypes or [])
+        self.version = version
+        self._type_codes = {t: i for i, t in enumerate(self.types)}
+        self._subtype_codes = {s: i for i, s in enumerate(self.subtypes)}
+        self._unsaved = False # True once the version was bumped
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_VOCABULARY) -> "Vocabulary":
+        with open(path, "rt") as f:
+            d = json.load(f)
+        return cls(d["types"], d["subtypes"], d["version"])
+
+    def save(self, path: str = DEFAULT_VOCABULARY) -> None:
+        with open(path, "wt") as f:
+            json.dump({"version": self.version, "types": self.types,
+                       "subtypes": self.subtypes}, f, indent=1)
+            f.write("\n")
+        self._unsaved = False
+
+    def type_code(self, value: str) -> int:
+        """ Code of a type, appended to the vocabulary if it is new. """
+        code = self._type_codes.get(value)
+        if code is None:
+            code = self._type_codes[value] = len(self.types)
+            self.types.append(value)
+            self._bump()
+        return code
+
+    def subtype_code(self, value: str) -> int:
+        """ Code of a subtype, appended to the vocabulary if it is new. """
+        code = self._subtype_codes.get(value)
+        if code is None:
+            code = self._subtype_codes[value] = len(self.subtypes)
+            self.subtypes.append(value)
+            self._bump()
+        return code
+
+    def extend(self, types: Iterable[str] = (),
+               subtypes: Iterable[str] = ()) -> bool:
+        """
+        Appends unknown values (in sorted order, so that the codes do not
+        depend on the order of the rows).
+
+        Returns:
+            True if the vocabulary changed
+        """
+        version = self.version
+        for t in sorted(set(types) - self._type_codes.keys()):
+            self.type_code(t)
+        for s in sorted(set(subtypes) - self._subtype_codes.keys()):
+            self.subtype_code(s)
+        return self.version != version
+
+    def _bump(self) -> None:
+        if not self._unsaved:
+            self.version += 1
+            self._unsaved = True
+
+    @property
+    def type_dtype(self) -> pd.CategoricalDtype:
+        return pd.CategoricalDtype(self.types)
+
+    @property
+    def subtype_dtype(self) -> pd.CategoricalDtype:
+        return pd.CategoricalDtype(self.subtypes)
+
+
+def from_codes(lat: np.ndarray, lon: np.ndarray, type_codes: np.ndarray,
+               subtype_codes: np.ndarray, vocab: Vocabulary) -> pd.DataFrame:
+    """ Builds the POI table from coordinates and vocabulary codes. """
+    return pd.DataFrame({
+        "lat": np.asarray(lat, dtype=COORD_DTYPE),
+        "lon": np.asarray(lon, dtype=COORD_DTYPE),
+        "type": pd.Categorical.from_codes(type_codes, dtype=vocab.type_dtype),
+        "subtype": pd.Categorical.from_codes(subtype_codes,
+                                             dtype=vocab.subtype_dtype),
+    })
+
+
+def encode(pois: pd.DataFrame, vocab: Vocabulary) -> pd.DataFrame:
+    """
+    Converts a POI table (strings or categoricals) to the compact
+    encoding of vocab. Unknown types and subtypes are added to vocab.
+    """
+    types = pois["type"].astype("category")
+    subtypes = pois["subtype"].astype("category")
+    vocab.extend(types.cat.categories, subtypes.cat.categories)
+    return pd.DataFrame({
+        "lat": pois["lat"].to_numpy(dtype=COORD_DTYPE),
+        "lon": pois["lon"].to_numpy(dtype=COORD_DTYPE),
+        "type": types.cat.set_categories(vocab.types).array,
+        "subtype": subtypes.cat.set_categories(vocab.subtypes).array,
+    })
+
+
+def read_pois(paths: List[str],
+              vocab: Optional[Vocabulary] = None) -> pd.DataFrame:
+    """
+    Reads and concatenates tourism/data*.csv files into the compact
+    encoding. Works for files with and without the unnamed index column
+    of older versions of tourism.py.
+
+    Args:
+        vocab: defaults to the vocabulary at DEFAULT_VOCABULARY. Values
+            missing from it are added (in memory only).
+    """
+    vocab = vocab or Vocabulary.load()
+    dtypes = {"lat": COORD_DTYPE, "lon": COORD_DTYPE,
+              "type": "category", "subtype": "category"}
+    dfs = [encode(pd.read_csv(p, usecols=COLUMNS, dtype=dtypes), vocab)
+           for p in paths]
+    # same categories in all parts, so concat keeps the categoricals
+    return pd.concat(dfs, axis=0, ignore_index=True)
+
+
+def save_npz(path: str, pois: pd.DataFrame, vocab: Vocabulary) -> None:
+    """
+    Writes an encoded POI table (see encode) as numpy arrays. The codes
+    refer to vocab, whose version is stored alongside.
+    """
+    np.savez(path,
+             lat=pois["lat"].to_numpy(dtype=COORD_DTYPE),
+             lon=pois["lon"].to_numpy(dtype=COORD_DTYPE),
+             type=pois["type"].cat.codes.to_numpy(),
+             subtype=pois["subtype"].cat.codes.to_numpy(),
+             vocabulary_version=vocab.version)
+
+
+def load_npz(path: str, vocab: Optional[Vocabulary] = None) -> pd.DataFrame:
+    """
+    Reads a table written by save_npz.
+
+    Raises:
+        ValueError if vocab is older than the vocabulary the file was
+        written with
+    """
+    vocab = vocab or Vocabulary.load()
+    with np.load(path) as npz:
+        if int(npz["vocabulary_version"]) > vocab.version:
+            raise ValueError(
+                f"{path} needs vocabulary version "
+                f"{int(npz['vocabulary_version'])}, got {vocab.version}")
+        return from_codes(npz["lat"], npz["lon"], npz["type"],
+                          npz["subtype"], vocab)
+
+
+def build_vocabulary(paths: List[str]) -> Vocabulary:
+    """ A version 1 vocabulary with the sorted values found in paths. """
+    types, subtypes = set(), set()
+    for p in paths:
+        df = pd.read_csv(p, usecols=["type", "subtype"], dtype="category")
+        types.update(df["type"].cat.categories)
+        subtypes.update(df["subtype"].cat.categories)
+    vocab = Vocabulary()
+    vocab.extend(types, subtypes)
+    return vocab
@@ -8,15 +8,35 @@ Tourism tags: {'aquarium', 'yes', 'chalet', 'alpine_hut', 'motel', 'attraction',
 # Library for loading open street map data
 # Introduction docs: https://github.com/osmcode/pyosmium/blob/master/doc/intro.rst
 import osmium
-import pandas as pd
+import os
 import sys
+import threading
+from array import array
+
+if __name__ == "__main__" and not __package__:
+    # run as `python tourism/tourism.py`: this file's directory comes first
+    # on sys.path and its tourism.py shadows the tourism package
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+import tourism.encoding as tenc
+
+# default POIs for get_tourist_activity
+DEFAULT_ACTIVITY_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'data.csv')
+_activity_index = None
+_activity_index_lock = threading.Lock()
 
 class TourismCounterHandler(osmium.SimpleHandler):
-    def __init__(self):
+    def __init__(self, vocab=None):
         super().__init__()
         
-        # collect geo points while traversing through the loaded data
-        self.geo_points = []
+        # collect geo points while traversing through the loaded data,
+        # as typed columns; type and subtype as codes of the vocabulary
+        # (see tourism/encoding.py), which grows with unknown values
+        self.vocab = vocab or tenc.Vocabulary.load()
+        self.lats = array('f')
+        self.lons = array('f')
+        self.type_codes = array('h')
+        self.subtype_codes = array('h')
 
         # track how many data points we currently still ignore
         self.num_uncounted = 0
@@ -90,8 +110,10 @@ class TourismCounterHandler(osmium.SimpleHandler):
                     break  
         
         if node_type:
-            point = (node.location.lat, node.location.lon, node_type, node_subtype)
-            self.geo_points.append(point)
+            self.lats.append(node.location.lat)
+            self.lons.append(node.location.lon)
+            self.type_codes.append(self.vocab.type_code(node_type))
+            self.subtype_codes.append(self.vocab.subtype_code(node_subtype))
 
     def way(self, w):
         # TODO: include ways by finding a mean location or something
@@ -105,28 +127,63 @@ class TourismCounterHandler(osmium.SimpleHandler):
 
     def get_dataframe(self):
         """
-        Return a pandas dataframe of the aggregated geo data
+        Return a pandas dataframe of the aggregated geo data, with
+        float32 lat, lon and categorical type, subtype (see tourism/encoding.py)
         """
-        return pd.DataFrame(data=self.geo_points,
-                            columns=['lat', 'lon', 'type', 'subtype'])
+        return tenc.from_codes(self.lats, self.lons,
+                               self.type_codes, self.subtype_codes, self.vocab)
+
+
+def set_activity_index(index):
+    """
+    Sets the tourism.activity.ActivityIndex used by get_tourist_activity,
+    e.g. one built over several regions or with subtype weights.
+    """
+    global _activity_index
+    with _activity_index_lock:
+        _activity_index = index
 
 
 def get_tourist_activity(lat, lng, when, radius=5):
     """
     Determine the tourism activity at a given location.
-    """
-    raise NotImplementedError
 
+    Args:
+        lat, lng: location in degrees
+        when: time of interest. Not used yet, the POI data has no
+            temporal dimension.
+        radius: in km
+
+    Returns:
+        dict with the number of tourism POIs within radius ("count"),
+        their weighted sum ("weighted") and the count per subtype
+        ("subtypes"), see tourism.activity.ActivityIndex.query
 
-def load(fname):
+    The index is built from DEFAULT_ACTIVITY_CSV on first use unless one
+    was set with set_activity_index. For arrays of locations, use
+    ActivityIndex.query_many.
+    """
+    global _activity_index
+    index = _activity_index
+    if index is None:
+        # double-checked, so that concurrent first calls build it once
+        with _activity_index_lock:
+            if _activity_index is None:
+                from tourism.activity import ActivityIndex
+                _activity_index = ActivityIndex.from_csv([DEFAULT_ACTIVITY_CSV])
+            index = _activity_index
+    return index.query(lat, lng, radius)
+
+
+def load(fname, vocab=None):
     print(f"Loading {fname}")
-    h = TourismCounterHandler()
+    h = TourismCounterHandler(vocab)
 
     h.apply_file(fname, 
                  locations=True,  # enable processing geometries of ways and areas
                  idx='flex_mem')  # cache that works for mid-sized data. Won;t be enough for Europe or planet
 
-    print(f"Number of nodes: {len(h.geo_points)}")
+    print(f"Number of nodes: {len(h.lats)}")
     print(f"Uncounted tourism locations: {h.num_uncounted}")
     print(f"Tags: {h.tags}")
 
@@ -134,6 +191,9 @@ def load(fname):
 
 
 if __name__ == "__main__":
+    # run from the repository root as `python tourism/tourism.py`
+    # or `python -m tourism.tourism`
+    vocab = tenc.Vocabulary.load()
     for region in ['asturias', 
                    'castilla_y_leon',
                    'galicia', 
@@ -145,10 +205,14 @@ if __name__ == "__main__":
 
         print(f"Loading from: {path_from}")
 
-        handler = load(path_from)
+        handler = load(path_from, vocab)
 
         print(f"Writing to: {path_to}")
 
         df = handler.get_dataframe()
-        df.to_csv(path_to)
+        df.to_csv(path_to, index=False)
+        tenc.save_npz(path_to.replace('.csv', '.npz'), df, vocab)
+
+    # new types / subtypes keep their codes for the next regions and runs
+    vocab.save()
 
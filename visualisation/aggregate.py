@@ -0,0 +1,148 @@
+"""
+Level-of-detail aggregation of point layers before they are handed to
+folium's HeatMap.
+
+Points are merged into weighted grid cells (one weighted point per
+non-empty cell at its centroid) either at a fixed resolution or at the
+finest quadtree level that fits into a point budget. Cells are square in
+Web Mercator coordinates, i.e. in screen pixels: rows are binned by the
+Mercator y of the latitude, so a cell spans cell_size degrees of
+longitude and cos(lat) * cell_size degrees of latitude. Leaflet.heat sums
+the intensities of all points that fall into one of its own cells, so as
+long as our cells are not larger than those at the maximum zoom of the
+map, the rendered heat map does not change beyond the shift of each
+point to its cell centroid.
+
+Leaflet.heat itself merges points on a grid of radius/2 screen pixels,
+so cells of that size at the maximum zoom are a safe default.
+
+Example:
+    data = heatmap_data(df['lat'], df['lon'], cell_size_for_zoom(10, 10/2))
+    HeatMap(data=data, radius=10).add_to(map)
+"""
+import numpy as np
+import pandas as pd
+
+from typing import List, Optional
+
+# CONSTANTS
+# ----------------------------------------------------
+TILE_SIZE = 256 # pixels per map tile in Leaflet
+# ----------------------------------------------------
+
+
+def cell_size_for_zoom(zoom: int, pixels: float = 1.0) -> float:
+    """
+    Cell size in degrees that corresponds to `pixels` screen pixels
+    (longitude direction) at the given Leaflet zoom level.
+    """
+    return pixels * 360.0 / (TILE_SIZE * 2**zoom)
+
+
+def aggregate_grid(lat: np.ndarray, lon: np.ndarray, cell_size: float,
+                   weights: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Merges points into cells that are square on a Web Mercator map.
+
+    Args:
+        lat, lon: point locations in degrees
+        cell_size: edge length of a cell in degrees of longitude (the
+            latitude edge is cos(lat) times that)
+        weights: optional weight per point, defaults to 1
+
+    Returns:
+        pandas.DataFrame with one row per non-empty cell and the columns
+            "lat", "lon" : float : weighted centroid of the points in the cell
+            "weight"     : float : sum of the weights in the cell
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    weights = np.ones(len(lat)) if weights is None \
+              else np.asarray(weights, dtype=np.float64)
+    if len(lat) == 0:
+        return pd.DataFrame({"lat": [], "lon": [], "weight": []})
+
+    y = _mercator_y(lat)
+    row = np.floor((y - y.min()) / cell_size).astype(np.int64)
+    col = np.floor((lon - lon.min()) / cell_size).astype(np.int64)
+    _, cell = np.unique(row * (col.max() + 1) + col, return_inverse=True)
+
+    weight = np.bincount(cell, weights=weights)
+    return pd.DataFrame({
+        "lat": np.bincount(cell, weights=weights * lat) / weight,
+        "lon": np.bincount(cell, weights=weights * lon) / weight,
+        "weight": weight,
+    })
+
+
+def aggregate_to_budget(lat: np.ndarray, lon: np.ndarray, max_points: int,
+                        weights: Optional[np.ndarray] = None,
+                        max_depth: int = 24) -> pd.DataFrame:
+    """
+    Quadtree summary: merges points into the cells of the finest quadtree
+    level over their bounding box that has at most max_points non-empty
+    cells. Returns the same table as aggregate_grid.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    weights = np.ones(len(lat)) if weights is None \
+              else np.asarray(weights, dtype=np.float64)
+    if len(lat) <= max_points:
+        return pd.DataFrame({"lat": lat, "lon": lon, "weight": weights})
+
+    # the cells of aggregate_grid, square in Mercator coordinates
+    y = _mercator_y(lat)
+    extent = max(y.max() - y.min(), lon.max() - lon.min()) or 1.0
+    # scale to [0, 1) once, the cell key at depth d is then a bit shift
+    scale = (1 << max_depth) / (extent * (1 + 1e-9))
+    row = ((y - y.min()) * scale).astype(np.int64)
+    col = ((lon - lon.min()) * scale).astype(np.int64)
+
+    # binary search for the deepest level within the budget,
+    # the number of non-empty cells grows monotonically with depth
+    lo, hi = 0, max_depth
+    while lo < hi:
+        depth = (lo + hi + 1) // 2
+        shift = max_depth - depth
+        n_cells = len(np.unique(((row >> shift) << depth) | (col >> shift)))
+        if n_cells <= max_points:
+            lo = depth
+        else:
+            hi = depth - 1
+    return aggregate_grid(lat, lon, extent / 2**lo * (1 + 1e-9), weights)
+
+
+def _mercator_y(lat: np.ndarray) -> np.ndarray:
+    """ Web Mercator y of lat, in degrees (the units of longitude). """
+    return np.rad2deg(np.arctanh(np.sin(np.deg2rad(lat))))
+
+
+def heatmap_data(lat: np.ndarray, lon: np.ndarray,
+                 cell_size: Optional[float] = None,
+                 max_points: Optional[int] = None,
+                 weights: Optional[np.ndarray] = None,
+                 ndigits: int = 5) -> List[List[float]]:
+    """
+    Aggregated [[lat, lon, weight], ...] list as accepted by
+    folium.plugins.HeatMap.
+
+    Args:
+        cell_size: aggregate at this resolution (degrees), see
+            cell_size_for_zoom
+        max_points: alternatively, aggregate to at most this many points
+        ndigits: coordinates are rounded to this many decimals
+            (5 decimals are about 1 m), which keeps the HTML small
+    """
+    if cell_size is not None:
+        cells = aggregate_grid(lat, lon, cell_size, weights)
+    elif max_points is not None:
+        cells = aggregate_to_budget(lat, lon, max_points, weights)
+    else:
+        raise ValueError("either cell_size or max_points must be given")
+
+    lat = cells["lat"].round(ndigits).tolist()
+    lon = cells["lon"].round(ndigits).tolist()
+    weight = cells["weight"].to_numpy()
+    if np.all(weight == np.round(weight)):
+        weight = weight.astype(np.int64) # "3" instead of "3.0" in the HTML
+    return [list(p) for p in zip(lat, lon, weight.tolist())]
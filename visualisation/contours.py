@@ -0,0 +1,310 @@
+"""
+Compact contour lines of KDE density grids for web maps.
+
+Replaces `plt.contour` + `geojsoncontour.contour_to_geojson(ndigits=10)`:
+isolines are computed with contourpy directly from the density grid (no
+pyplot figure is created), simplified with the Douglas-Peucker algorithm
+and written with coordinates quantized to a fraction of the grid spacing.
+Besides GeoJSON, lines can be written as TopoJSON (integer, delta-encoded
+coordinates) or as a zlib-compressed binary blob.
+
+Example:
+    x, y, z = kde_grid(df['lat'], df['lon'], limits)
+    lines = contour_lines(x, y, z, n_levels=30)
+    geojson = to_geojson(lines, cmap="plasma")
+"""
+import struct
+import zlib
+
+import numpy as np
+
+from typing import List, Tuple, Optional, Union
+
+# own stuff
+import analysis.scoring as ascore
+
+# (level, [line, ...]) with line an (n, 2) array of (lon, lat)
+Lines = List[Tuple[float, List[np.ndarray]]]
+
+BINARY_MAGIC   = b"KDEC"
+BINARY_VERSION = 1
+
+
+def kde_grid(lat: np.ndarray, lon: np.ndarray,
+             limits: Tuple[float, float, float, float],
+             shape: Tuple[int, int] = (200, 500),
+             bandwidth: float = ascore.BANDWIDTH, atol: float = ascore.ATOL
+             ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Evaluates a haversine KDE of the points on a regular grid.
+
+    Args:
+        limits: (lat_min, lat_max, lon_min, lon_max) of the grid
+        shape: (n_lat, n_lon) grid points, as in plot_kde of folium_map.py
+
+    Returns:
+        (x, y, z): x the n_lon grid longitudes, y the n_lat grid latitudes,
+        z the (n_lat, n_lon) density
+    """
+    lat_min, lat_max, lon_min, lon_max = limits
+    x = np.linspace(lon_min, lon_max, shape[1])
+    y = np.linspace(lat_min, lat_max, shape[0])
+    grid_lon, grid_lat = np.meshgrid(x, y)
+
+    kde = ascore.fit_kde(np.asarray(lat), np.asarray(lon), bandwidth, atol)
+    log_z = kde.score_samples(ascore.to_radians(grid_lat.ravel(),
+                                                grid_lon.ravel()))
+    return x, y, np.exp(log_z).reshape(grid_lon.shape)
+
+
+def simplify(line: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of an (n, 2) polyline. Points closer
+    than tolerance to the simplified line are dropped. The first and the
+    last point are always kept, so closed rings stay closed.
+    """
+    n = len(line)
+    if n < 3 or tolerance <= 0:
+        return line
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        a, b = line[first], line[last]
+        pts = line[first + 1:last]
+        ab = b - a
+        norm = np.hypot(ab[0], ab[1])
+        if norm == 0: # closed ring: distance to the start point
+            dist = np.hypot(pts[:, 0] - a[0], pts[:, 1] - a[1])
+        else:
+            dist = np.abs(ab[0] * (pts[:, 1] - a[1])
+                          - ab[1] * (pts[:, 0] - a[0])) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return line[keep]
+
+
+def contour_lines(x: np.ndarray, y: np.ndarray, z: np.ndarray,
+                  n_levels: int = 30,
+                  levels: Optional[np.ndarray] = None,
+                  tolerance: Optional[float] = None,
+                  quantum: Optional[float] = None) -> Lines:
+    """
+    Isolines of z on the grid (x, y).
+
+    Args:
+        n_levels: number of equally spaced levels strictly between
+            z.min() and z.max(); ignored if levels is given
+        tolerance: Douglas-Peucker tolerance in degrees. Defaults to half
+            the grid spacing, the accuracy of the isolines anyway.
+        quantum: coordinates are snapped to multiples of quantum (degrees).
+            Defaults to a tenth of the grid spacing.
+
+    Returns:
+        list of (level, lines), lines being (n, 2) arrays of (lon, lat)
+    """
+    import contourpy # the contouring backend of matplotlib, without pyplot
+
+    spacing = min(np.min(np.diff(x)), np.min(np.diff(y)))
+    tolerance = spacing / 2 if tolerance is None else tolerance
+    quantum = spacing / 10 if quantum is None else quantum
+    if levels is None:
+        levels = np.linspace(z.min(), z.max(), n_levels + 2)[1:-1]
+
+    gen = contourpy.contour_generator(x, y, z, line_type="Separate")
+    result = []
+    for level in levels:
+        lines = []
+        for line in gen.lines(level):
+            line = simplify(line, tolerance)
+            line = np.round(line / quantum) * quantum
+            # drop repeated points created by snapping
+            if len(line) > 1:
+                moved = np.any(np.diff(line, axis=0) != 0, axis=1)
+                line = line[np.concatenate([[True], moved])]
+            if len(line) >= 2:
+                lines.append(line)
+        result.append((float(level), lines))
+    return result
+
+
+def _level_colors(n: int, cmap: Union[str, "Colormap"],
+                  max_alpha: float = 0.9) -> List[Tuple[str, float]]:
+    """ (hex color, opacity) per level, with the alpha ramp of plot_kde. """
+    import matplotlib # no pyplot
+    from matplotlib.colors import to_hex
+    if isinstance(cmap, str):
+        cmap = matplotlib.colormaps[cmap]
+    rgba = cmap(np.linspace(0, 1, n)) if n > 1 else cmap([0.5])
+    alpha = np.linspace(0, max_alpha, n) if n > 1 else [max_alpha]
+    return [(to_hex(c, keep_alpha=False), float(a))
+            for c, a in zip(rgba, alpha)]
+
+
+def _decimals(quantum: float) -> int:
+    return max(0, int(np.ceil(-np.log10(quantum))))
+
+
+def to_geojson(lines: Lines, cmap: Union[str, "Colormap"] = "plasma",
+               stroke_width: float = 2, quantum: float = 1e-5) -> dict:
+    """
+    GeoJSON FeatureCollection with one MultiLineString per level. The
+    properties (stroke, stroke-width, title) are those written by
+    geojsoncontour, plus stroke-opacity.
+
+    Args:
+        quantum: quantum used in contour_lines, sets the decimals written
+    """
+    ndigits = _decimals(quantum)
+    features = []
+    for (level, level_lines), (color, opacity) in \
+            zip(lines, _level_colors(len(lines), cmap)):
+        if not level_lines:
+            continue
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "MultiLineString",
+                "coordinates": [np.round(l, ndigits).tolist()
+                                for l in level_lines],
+            },
+            "properties": {
+                "stroke": color,
+                "stroke-width": stroke_width,
+                "stroke-opacity": opacity,
+                "title": f"{level:.4g}",
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def to_topojson(lines: Lines, quantum: float = 1e-5,
+                cmap: Union[str, "Colormap"] = "plasma",
+                stroke_width: float = 2, name: str = "contours") -> dict:
+    """
+    TopoJSON topology with quantized, delta-encoded arcs (one arc per line)
+    and one MultiLineString geometry per level.
+    """
+    all_points = [l for _, level_lines in lines for l in level_lines]
+    origin = np.min([l.min(axis=0) for l in all_points], axis=0) \
+             if all_points else np.zeros(2)
+
+    arcs, geometries = [], []
+    for (level, level_lines), (color, opacity) in \
+            zip(lines, _level_colors(len(lines), cmap)):
+        if not level_lines:
+            continue
+        arc_ids = []
+        for l in level_lines:
+            q = np.round((l - origin) / quantum).astype(np.int64)
+            deltas = np.vstack([q[:1], np.diff(q, axis=0)])
+            arc_ids.append([len(arcs)])
+            arcs.append(deltas.tolist())
+        geometries.append({
+            "type": "MultiLineString",
+            "arcs": arc_ids,
+            "properties": {
+                "stroke": color,
+                "stroke-width": stroke_width,
+                "stroke-opacity": opacity,
+                "title": f"{level:.4g}",
+            },
+        })
+
+    return {
+        "type": "Topology",
+        "transform": {"scale": [quantum, quantum],
+                      "translate": [float(origin[0]), float(origin[1])]},
+        "objects": {name: {"type": "GeometryCollection",
+                           "geometries": geometries}},
+        "arcs": arcs,
+    }
+
+
+def to_binary(lines: Lines, quantum: float = 1e-5) -> bytes:
+    """
+    zlib-compressed binary encoding of the lines.
+
+    Layout (little endian), before compression:
+        4s magic "KDEC", B version, d origin_lon, d origin_lat, d quantum,
+        I n_levels, then per level: f level, I n_lines,
+        then per line: I n_points, n_points * (i lon, i lat) where the
+        first point is relative to the origin and the others are deltas
+        to the previous point, all in units of quantum.
+    """
+    all_points = [l for _, level_lines in lines for l in level_lines]
+    origin = np.min([l.min(axis=0) for l in all_points], axis=0) \
+             if all_points else np.zeros(2)
+
+    parts = [struct.pack("<4sBdddI", BINARY_MAGIC, BINARY_VERSION,
+                         origin[0], origin[1], quantum, len(lines))]
+    for level, level_lines in lines:
+        parts.append(struct.pack("<fI", level, len(level_lines)))
+        for l in level_lines:
+            q = np.round((l - origin) / quantum).astype(np.int64)
+            deltas = np.vstack([q[:1], np.diff(q, axis=0)]).astype("<i4")
+            parts.append(struct.pack("<I", len(deltas)))
+            parts.append(deltas.tobytes())
+    return zlib.compress(b"".join(parts), 9)
+
+
+def from_binary(blob: bytes) -> Lines:
+    """ Inverse of to_binary. """
+    raw = zlib.decompress(blob)
+    magic, version, x0, y0, quantum, n_levels = \
+        struct.unpack_from("<4sBdddI", raw, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("not a contour blob of a supported version")
+    offset = struct.calcsize("<4sBdddI")
+
+    lines = []
+    for _ in range(n_levels):
+        level, n_lines = struct.unpack_from("<fI", raw, offset)
+        offset += struct.calcsize("<fI")
+        level_lines = []
+        for _ in range(n_lines):
+            (n,) = struct.unpack_from("<I", raw, offset)
+            offset += 4
+            deltas = np.frombuffer(raw, dtype="<i4", count=2 * n,
+                                   offset=offset).reshape(n, 2)
+            offset += 8 * n
+            level_lines.append(np.cumsum(deltas, axis=0) * quantum
+                               + np.array([x0, y0]))
+        lines.append((float(level), level_lines))
+    return lines
+
+
+def kde_contours(lat: np.ndarray, lon: np.ndarray,
+                 limits: Tuple[float, float, float, float],
+                 n_levels: int = 30, fmt: str = "geojson",
+                 cmap: Union[str, "Colormap"] = "plasma",
+                 shape: Tuple[int, int] = (200, 500),
+                 bandwidth: float = ascore.BANDWIDTH,
+                 atol: float = ascore.ATOL,
+                 quantum: Optional[float] = None,
+                 tolerance: Optional[float] = None) -> Union[dict, bytes]:
+    """
+    KDE of the points -> contour lines in the requested format
+    ("geojson", "topojson" or "binary"). shape, bandwidth and atol are
+    passed to kde_grid.
+    """
+    x, y, z = kde_grid(lat, lon, limits, shape, bandwidth, atol)
+    if quantum is None:
+        quantum = min(np.min(np.diff(x)), np.min(np.diff(y))) / 10
+    lines = contour_lines(x, y, z, n_levels=n_levels,
+                          tolerance=tolerance, quantum=quantum)
+    if fmt == "geojson":
+        return to_geojson(lines, cmap=cmap, quantum=quantum)
+    elif fmt == "topojson":
+        return to_topojson(lines, quantum=quantum, cmap=cmap)
+    elif fmt == "binary":
+        return to_binary(lines, quantum=quantum)
+    raise ValueError(f"unknown format {fmt}")
@@ -1,57 +1,56 @@
 """
+Usage (from this directory):
+    python folium_map.py                 # everything embedded in folium_map.html
+    python folium_map.py --tiles tiles   # point layers as tile pyramids in tiles/,
+                                         # serve with `python tiles.py --serve tiles`
+    python folium_map.py --limits 41.7 43.8 -9.4 -4.3 --bandwidth 5e-4 --out map.html
 
+As part of the pipeline (see pipeline/), build_map is the "render" stage.
 """
 
 ################################################################################
 # %% IMPORT PACKAGES
 ################################################################################
 
+import argparse
+import os
+import sys
 import folium
 import pandas as pd
-import numpy as np
 from folium.plugins import HeatMap
-from tqdm import tqdm
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap
-import geojsoncontour
-from sklearn.neighbors import KernelDensity
+
+from typing import List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analysis.scoring as ascore
+import visualisation.aggregate as vagg
+import visualisation.contours as vcontours
+import visualisation.tiles as vtiles
+
+##### DEFAULTS (paths relative to this directory)
+LIMITS = [41.7, 43.8, -9.4, -4.3] # lat_min, lat_max, lon_min, lon_max
+POI_PATHS = ['../tourism/data.csv',
+             '../tourism/data_asturias.csv',
+             '../tourism/data_castilla_y_leon.csv']
+FIRE_PATH = '../fire/data/fires_spain_since_2010.csv'
+# the Stamen tile servers are gone, folium >= 0.15 rejects "Stamen Terrain"
+BASE_TILES = "OpenStreetMap"
+
+##### GRADIENTS FOR FIRES
+gradient_b = {.33: 'red', .66: 'brown', 1: 'yellow'}
+gradient_g = {.33: 'lightgreen', .66: 'blue', 1: 'navy'}
+gradient_p = {.33: 'orange', .66: 'red', 1: 'pink'}
 
 ################################################################################
 # %% PLOT KDE ON SET
 ################################################################################
 
-def plot_kde(map, data, limits, name, cmap):
+def plot_kde(map, data, limits, name, cmap, n_levels=30, bandwidth=5e-4):
 
-    lat_min, lat_max, lon_min, lon_max = limits
-
-    ##### GET KDES
-    bandwidth = 5e-4
-    kde = KernelDensity(kernel='gaussian', bandwidth=bandwidth, metric='haversine', atol=0.1)
-    kde.fit(np.pi/180.0*data[['lat', 'lon']])
-
-    x = np.linspace(lon_min, lon_max, 500)
-    y = np.linspace(lat_min, lat_max, 200)
-    lon, lat = np.meshgrid(x, y)
-
-    score = np.exp(kde.score_samples(np.pi/180.0*np.array([lat.reshape(-1), lon.reshape(-1)]).T))
-    score = score.reshape(lon.shape)/25e6
-
-    ##### SET CMAP WITH ALPHA
-    mycmap = cmap(np.arange(cmap.N))
-    mycmap[:,-1] = np.linspace(0, 0.9, cmap.N)
-    mycmap = ListedColormap(mycmap)
-
-    ##### CREATE CONTOUR THROUGH MPL
-    contour = plt.contour(lon, lat, score, 30, cmap=mycmap)
-
-    ##### CONVERT  CONTOUR TO GEOJSON OBJECT
-    geojson = geojsoncontour.contour_to_geojson(
-        contour=contour,
-        min_angle_deg=1.0,
-        ndigits=10,
-        stroke_width=2,
-        #fill_opacity=0.8
-        )
+    ##### GET KDE ON GRID AND CONTOUR IT DIRECTLY (NO PYPLOT FIGURE)
+    geojson = vcontours.kde_contours(data['lat'], data['lon'], limits,
+                                     n_levels=n_levels, cmap=cmap,
+                                     shape=(200, 500), bandwidth=bandwidth)
 
     ##### ADD GEOJSON OBJECT TO PLOT
     folium.GeoJson(
@@ -66,90 +65,122 @@ def plot_kde(map, data, limits, name, cmap):
 
 
 ################################################################################
-# %% PLOT MAP
+# %% PLOT HEAT MAPS (OR TILE PYRAMIDS)
 ################################################################################
 
-##### MAP LIMITS
-lat_min = 41.7
-lat_max = 43.8
-lon_min = -9.4
-lon_max = -4.3
-limits = [lat_min, lat_max, lon_min, lon_max]
-
-##### CREATE MAP OBJECT
-map = folium.Map(
-        location=((lat_max+lat_min)/2, (lon_max+lon_min)/2),
-        tiles = "Stamen Terrain",
-        zoom_start=9,
-        min_zoom=7,
-        max_zoom=10
-    )
-
-##### PULL POINT DATA
-raw_data = pd.read_csv('../tourism/data.csv', index_col=0)
-raw_data = raw_data.append(pd.read_csv('../tourism/data_asturias.csv', index_col=0))
-raw_data = raw_data.append(pd.read_csv('../tourism/data_castilla_y_leon.csv', index_col=0))
-fire_data = pd.read_csv('../fire/data/fires_spain_since_2010.csv')
-fire_data = fire_data[
-np.logical_and(
-    np.logical_and(
-        fire_data['lat']>lat_min,
-        fire_data['lat']<lat_max),
-    np.logical_and(
-        fire_data['lon']>lon_min,
-        fire_data['lon']<lon_max
-    ))]
-
-raw_data = raw_data[
-np.logical_and(
-    np.logical_and(
-        raw_data['lat']>lat_min,
-        raw_data['lat']<lat_max),
-    np.logical_and(
-        raw_data['lon']>lon_min,
-        raw_data['lon']<lon_max
-    ))]
-
-##### LIMIT TO TOURIST DATA
-tourism_data = raw_data.loc[raw_data['type'] == 'tourism']
-non_tourism_data = raw_data.loc[raw_data['type'] != 'tourism']
-
-##### GRADIENT FOR FIRES
-gradient_b = {.33: 'red', .66: 'brown', 1: 'yellow'}
-gradient_g = {.33: 'lightgreen', .66: 'blue', 1: 'navy'}
-gradient_p = {.33: 'orange', .66: 'red', 1: 'pink'}
+def add_point_layer(map, data, name, radius, gradient=None, cmap='plasma',
+                    tiles=None, tiles_url="http://localhost:8000"):
+    if tiles is None:
+        # merge points that leaflet.heat would merge anyway at max zoom (cells of radius/2 px)
+        points = vagg.heatmap_data(data['lat'], data['lon'], vagg.cell_size_for_zoom(10, radius/2))
+        HeatMap(data=points, gradient=gradient, radius=radius).add_to(folium.FeatureGroup(name=name).add_to(map))
+    else:
+        layer_dir = name.lower().replace(' ', '_')
+        meta = vtiles.build_pyramid(data['lat'], data['lon'], os.path.join(tiles, layer_dir),
+                                    zooms=(7, 10), radius_px=radius/2, cmap=cmap)
+        vtiles.add_tile_layer(map, f"{tiles_url}/{layer_dir}/{{z}}/{{x}}/{{y}}.png", name, meta)
 
-##### PLOT HEAT MAPS
-HeatMap(data=tourism_data[['lat', 'lon']], radius=10).add_to(folium.FeatureGroup(name='Tourism').add_to(map))
-HeatMap(data=non_tourism_data[['lat', 'lon']], radius=4).add_to(folium.FeatureGroup(name='Non-Tourism').add_to(map))
-HeatMap(data=fire_data[['lat', 'lon']], gradient=gradient_b, radius=12).add_to(folium.FeatureGroup(name='Forest Fires').add_to(map))
 
-##### GET KDES
-bandwidth = 5e-4
-kde_tourism = KernelDensity(kernel='gaussian', bandwidth=bandwidth, metric='haversine', atol=0.1)
-kde_tourism.fit(np.pi/180.0*tourism_data[['lat', 'lon']])
-score_tourism = np.exp(kde_tourism.score_samples(np.pi/180.0*fire_data[['lat', 'lon']]))
+################################################################################
+# %% LOAD DATA
+################################################################################
 
-kde_non_tourism = KernelDensity(kernel='gaussian', bandwidth=bandwidth, metric='haversine', atol=0.1)
-kde_non_tourism.fit(np.pi/180.0*non_tourism_data[['lat', 'lon']])
-score_non_tourism = np.exp(kde_non_tourism.score_samples(np.pi/180.0*fire_data[['lat', 'lon']]))
+def load_data(poi_paths: List[str], fire_path: str, limits):
+    """
+    Returns (pois, fires) inside limits (borders excluded).
+    """
+    pois = ascore.filter_bbox(ascore.load_pois(poi_paths), limits)
+    fires = ascore.filter_bbox(pd.read_csv(fire_path), limits)
+    return pois, fires
 
-##### TOURISM
-HeatMap(data=fire_data.loc[score_tourism > score_non_tourism][['lat', 'lon']], gradient=gradient_g, radius=12).add_to(folium.FeatureGroup(name='Tourism Correlated Fires').add_to(map))
-HeatMap(data=fire_data.loc[score_tourism < score_non_tourism][['lat', 'lon']], gradient=gradient_p, radius=12).add_to(folium.FeatureGroup(name='Non-Tourism Correlated Fires').add_to(map))
 
-##### TOURISM
-cmap = plt.cm.plasma
-name = "KDE-Tourism"
-plot_kde(map, tourism_data, limits, name, cmap)
+################################################################################
+# %% PLOT MAP
+################################################################################
 
-##### NON-TOURISM
-cmap = plt.cm.plasma
-name = "KDE-Non-Tourism"
-plot_kde(map, non_tourism_data, limits, name, cmap)
+def build_map(pois: pd.DataFrame, fires: pd.DataFrame, limits,
+              bandwidth: float = ascore.BANDWIDTH, out: str = 'folium_map.html',
+              tiles: Optional[str] = None,
+              tiles_url: str = "http://localhost:8000",
+              scores: Optional[pd.DataFrame] = None) -> folium.Map:
+    """
+    Args:
+        pois, fires: tables inside limits, see load_data
+        limits: [lat_min, lat_max, lon_min, lon_max]
+        tiles: if given, point layers are exported as tile pyramids
+            into this directory, served under tiles_url
+        scores: fires with the columns score_tourism and score_non_tourism
+            (see analysis.scoring.AttributionModel.attribute). If None,
+            these columns of fires are used if it has them (e.g. the
+            scores.csv of the pipeline), else the fires are scored here.
+    """
+    lat_min, lat_max, lon_min, lon_max = limits
 
-##### ADD LAYER CONTROL
-folium.LayerControl().add_to(map)
+    ##### CREATE MAP OBJECT
+    map = folium.Map(
+            location=((lat_max+lat_min)/2, (lon_max+lon_min)/2),
+            tiles = BASE_TILES,
+            zoom_start=9,
+            min_zoom=7,
+            max_zoom=10
+        )
 
-##### SAVE!
-map.save('folium_map.html')
+    ##### LIMIT TO TOURIST DATA
+    tourism_data = pois.loc[pois['type'] == 'tourism']
+    non_tourism_data = pois.loc[pois['type'] != 'tourism']
+
+    layer = dict(tiles=tiles, tiles_url=tiles_url)
+    add_point_layer(map, tourism_data, 'Tourism', 10, **layer)
+    add_point_layer(map, non_tourism_data, 'Non-Tourism', 4, **layer)
+    add_point_layer(map, fires, 'Forest Fires', 12, gradient_b, cmap='hot', **layer)
+
+    ##### GET KDES (log densities, compared like the densities)
+    if scores is None and {'score_tourism', 'score_non_tourism'} <= set(fires.columns):
+        scores = fires
+    elif scores is None:
+        model = ascore.AttributionModel.from_pois(pois, bandwidth=bandwidth)
+        scores = model.attribute(fires)
+    score_tourism = scores['score_tourism'].to_numpy()
+    score_non_tourism = scores['score_non_tourism'].to_numpy()
+
+    ##### TOURISM
+    add_point_layer(map, fires.loc[score_tourism > score_non_tourism], 'Tourism Correlated Fires', 12, gradient_g, cmap='winter', **layer)
+    add_point_layer(map, fires.loc[score_tourism < score_non_tourism], 'Non-Tourism Correlated Fires', 12, gradient_p, cmap='autumn', **layer)
+
+    ##### TOURISM
+    plot_kde(map, tourism_data, limits, "KDE-Tourism", "plasma", bandwidth=bandwidth)
+
+    ##### NON-TOURISM
+    plot_kde(map, non_tourism_data, limits, "KDE-Non-Tourism", "plasma", bandwidth=bandwidth)
+
+    ##### ADD LAYER CONTROL
+    folium.LayerControl().add_to(map)
+
+    ##### SAVE!
+    if out:
+        map.save(out)
+    return map
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pois", nargs="+", default=POI_PATHS,
+                        help="tourism/data*.csv files")
+    parser.add_argument("--fires", default=FIRE_PATH, help="fire table (CSV)")
+    parser.add_argument("--limits", nargs=4, type=float, default=LIMITS,
+                        metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"))
+    parser.add_argument("--bandwidth", type=float, default=ascore.BANDWIDTH)
+    parser.add_argument("--out", default="folium_map.html")
+    parser.add_argument("--tiles", default=None, metavar="DIR",
+                        help="export point layers as z/x/y tile pyramids into DIR")
+    parser.add_argument("--tiles-url", default="http://localhost:8000",
+                        help="URL under which DIR is served")
+    args = parser.parse_args(argv)
+
+    pois, fires = load_data(args.pois, args.fires, args.limits)
+    build_map(pois, fires, args.limits, args.bandwidth, args.out,
+              args.tiles, args.tiles_url)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Pre-rendered z/x/y raster tile pyramids of point densities.
+
+Instead of embedding every point into the folium HTML, the densities are
+aggregated into 256x256 PNG tiles (Web Mercator, the "slippy map" scheme
+used by Leaflet/folium) for a range of zoom levels. The browser then only
+loads the tiles that are visible at the current zoom.
+
+Command line (from the repository root):
+    python -m visualisation.tiles --csv tourism/data.csv \\
+        --query "type == 'tourism'" --out tiles/tourism --zooms 5 12
+    python -m visualisation.tiles --serve tiles --port 8000
+
+Details:
+    Raster tiles are rendered instead of vector tiles (MVT): densities
+    are continuous surfaces, and PNGs need no extra encoder dependency.
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+from typing import List, Tuple, Optional
+
+# CONSTANTS
+# ----------------------------------------------------
+TILE_SIZE = 256
+MAX_LAT   = 85.0511287798 # latitude limit of the Web Mercator projection
+# ----------------------------------------------------
+
+
+def latlon_to_pixels(lat: np.ndarray, lon: np.ndarray,
+                     zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Global Web Mercator pixel coordinates (x to the east, y to the south)
+    of lat, lon in degrees at the given zoom level.
+    """
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_LAT, MAX_LAT)
+    lon = np.asarray(lon, dtype=np.float64)
+    world = TILE_SIZE * 2.0**zoom
+    x = (lon + 180.0) / 360.0 * world
+    sin_lat = np.sin(np.deg2rad(lat))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * world
+    return x, y
+
+
+def tile_bounds(x: int, y: int, zoom: int) -> Tuple[float, float, float, float]:
+    """
+    Returns (lat_min, lat_max, lon_min, lon_max) of tile z/x/y.
+    """
+    n = 2.0**zoom
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = np.rad2deg(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    lat_min = np.rad2deg(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1) / n))))
+    return lat_min, lat_max, lon_min, lon_max
+
+
+def make_colormap(name: str = "plasma", max_alpha: float = 0.9) -> np.ndarray:
+    """
+    (256, 4) uint8 RGBA lookup table with an alpha ramp from transparent
+    to max_alpha, like the colormap of plot_kde in folium_map.py.
+    """
+    import matplotlib # only needed when rendering
+    lut = matplotlib.colormaps[name].resampled(256)(np.arange(256))
+    lut[:, -1] = np.linspace(0, max_alpha, 256)
+    return np.round(lut * 255).astype(np.uint8)
+
+
+def _assign_tiles(px: np.ndarray, py: np.ndarray, weights: np.ndarray,
+                  zoom: int, halo: int):
+    """
+    Assigns every point to its tile and, if it lies within halo pixels of a
+    border, also to the neighboring tiles, so tiles can be smoothed without
+    seams. Returns points sorted by tile together with the tile list.
+    """
+    n_tiles = 2**zoom
+    tx0 = np.floor(px / TILE_SIZE).astype(np.int64)
+    ty0 = np.floor(py / TILE_SIZE).astype(np.int64)
+    fx = px - tx0 * TILE_SIZE
+    fy = py - ty0 * TILE_SIZE
+
+    keys, xs, ys, ws = [], [], [], []
+    for dx in (-1, 0, 1):
+        near_x = (fx < halo) if dx == -1 else \
+                 (fx >= TILE_SIZE - halo) if dx == 1 else True
+        for dy in (-1, 0, 1):
+            near_y = (fy < halo) if dy == -1 else \
+                     (fy >= TILE_SIZE - halo) if dy == 1 else True
+            sel = np.broadcast_to(near_x & near_y, px.shape)
+            tx, ty = tx0[sel] + dx, ty0[sel] + dy
+            valid = (tx >= 0) & (tx < n_tiles) & (ty >= 0) & (ty < n_tiles)
+            tx, ty = tx[valid], ty[valid]
+            keys.append(tx * n_tiles + ty)
+            # pixel position relative to the haloed tile origin
+            xs.append(px[sel][valid] - tx * TILE_SIZE + halo)
+            ys.append(py[sel][valid] - ty * TILE_SIZE + halo)
+            ws.append(weights[sel][valid])
+
+    keys = np.concatenate(keys)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    xs = np.concatenate(xs)[order].astype(np.int32)
+    ys = np.concatenate(ys)[order].astype(np.int32)
+    ws = np.concatenate(ws)[order]
+
+    tiles, starts = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(keys))
+    return xs, ys, ws, tiles // n_tiles, tiles % n_tiles, starts, ends
+
+
+def _render_tiles(job, zoom: int, halo: int, sigma: float, vmax: float,
+                  lut: np.ndarray, out_dir: str) -> int:
+    """ Renders and writes the tiles of one job. Runs in a worker process. """
+    from matplotlib.image import imsave
+    from scipy.ndimage import gaussian_filter
+
+    xs, ys, ws, txs, tys, starts, ends = job
+    size = TILE_SIZE + 2 * halo
+    n_written = 0
+    for tx, ty, s, e in zip(txs, tys, starts, ends):
+        grid = np.bincount(ys[s:e] * size + xs[s:e], weights=ws[s:e],
+                           minlength=size * size).reshape(size, size)
+        if sigma > 0:
+            # rescale so that an isolated point peaks at its own weight
+            grid = gaussian_filter(grid, sigma, mode="constant") \
+                   * (2 * np.pi * sigma**2)
+        grid = grid[halo:halo + TILE_SIZE, halo:halo + TILE_SIZE]
+        if not np.any(grid > 0):
+            continue
+        level = np.log1p(grid) / np.log1p(vmax)
+        rgba = lut[np.clip((level * 255).astype(np.int32), 0, 255)]
+
+        tile_dir = os.path.join(out_dir, str(zoom), str(tx))
+        os.makedirs(tile_dir, exist_ok=True)
+        imsave(os.path.join(tile_dir, f"{ty}.png"), rgba)
+        n_written += 1
+    return n_written
+
+
+def build_pyramid(lat: np.ndarray, lon: np.ndarray, out_dir: str,
+                  zooms: Tuple[int, int] = (5, 12),
+                  weights: Optional[np.ndarray] = None,
+                  radius_px: float = 6.0, cmap: str = "plasma",
+                  n_jobs: Optional[int] = None,
+                  tiles_per_job: int = 64) -> dict:
+    """
+    Renders density tiles of points into out_dir/{z}/{x}/{y}.png.
+
+    Args:
+        lat, lon: point locations in degrees
+        zooms: (min_zoom, max_zoom), both inclusive
+        weights: optional weight per point
+        radius_px: standard deviation of the gaussian smoothing, in
+            screen pixels, i.e. constant at every zoom like HeatMap's radius
+        cmap: name of a matplotlib colormap
+        n_jobs: number of worker processes (None: all cores)
+        tiles_per_job: tiles rendered per task sent to a worker
+
+    Returns:
+        dict with the layer metadata, also written to out_dir/metadata.json
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    weights = np.ones(len(lat)) if weights is None \
+              else np.asarray(weights, dtype=np.float64)
+    halo = int(np.ceil(3 * radius_px))
+    lut = make_colormap(cmap)
+
+    meta = {
+        "format": "png",
+        "tile_size": TILE_SIZE,
+        "min_zoom": int(zooms[0]),
+        "max_zoom": int(zooms[1]),
+        "bounds": [float(lat.min()), float(lat.max()),
+                   float(lon.min()), float(lon.max())] if len(lat) else None,
+        "n_points": int(len(lat)),
+        "tiles": {},
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        for zoom in range(zooms[0], zooms[1] + 1):
+            px, py = latlon_to_pixels(lat, lon, zoom)
+            xs, ys, ws, txs, tys, starts, ends = \
+                _assign_tiles(px, py, weights, zoom, halo)
+            if len(txs) == 0:
+                meta["tiles"][zoom] = 0
+                continue
+
+            # same color scale for all tiles of a zoom level: the largest
+            # weight that falls into a single (unsmoothed) pixel
+            pix = (np.floor(py).astype(np.int64) * TILE_SIZE * 2**zoom
+                   + np.floor(px).astype(np.int64))
+            _, inverse = np.unique(pix, return_inverse=True)
+            vmax = np.bincount(inverse, weights=weights).max()
+
+            jobs = []
+            for i in range(0, len(txs), tiles_per_job):
+                j = slice(i, i + tiles_per_job)
+                s, e = starts[j][0], ends[j][-1]
+                jobs.append((xs[s:e], ys[s:e], ws[s:e], txs[j], tys[j],
+                             starts[j] - s, ends[j] - s))
+            render = partial(_render_tiles, zoom=zoom, halo=halo,
+                             sigma=radius_px, vmax=vmax, lut=lut,
+                             out_dir=out_dir)
+            meta["tiles"][zoom] = int(sum(pool.map(render, jobs)))
+
+    with open(os.path.join(out_dir, "metadata.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def add_tile_layer(map, url_template: str, name: str,
+                   meta: Optional[dict] = None) -> None:
+    """
+    Adds a pre-rendered tile pyramid as an overlay to a folium map.
+
+    Args:
+        url_template: e.g. "http://localhost:8000/tourism/{z}/{x}/{y}.png"
+        meta: metadata returned by build_pyramid, limits the zoom range
+    """
+    import folium
+    kwargs = {}
+    if meta is not None:
+        kwargs = {"min_zoom": meta["min_zoom"],
+                  "max_native_zoom": meta["max_zoom"]}
+    folium.raster_layers.TileLayer(
+        tiles=url_template, attr=name, name=name,
+        overlay=True, control=True, **kwargs).add_to(map)
+
+
+def serve(directory: str, port: int = 8000, host: str = "localhost") -> None:
+    """
+    Serves a tile directory over HTTP until interrupted.
+    """
+    handler = partial(SimpleHTTPRequestHandler, directory=directory)
+    with ThreadingHTTPServer((host, port), handler) as httpd:
+        print(f"Serving {directory} at http://{host}:{port}/")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Render a z/x/y density tile pyramid or serve tiles.")
+    parser.add_argument("--csv", nargs="+", help="CSV files with lat, lon")
+    parser.add_argument("--query", default=None,
+                        help="pandas query to select points, "
+                             "e.g. \"type == 'tourism'\"")
+    parser.add_argument("--out", help="output directory of the pyramid")
+    parser.add_argument("--zooms", nargs=2, type=int, default=[5, 12])
+    parser.add_argument("--radius", type=float, default=6.0)
+    parser.add_argument("--cmap", default="plasma")
+    parser.add_argument("--n-jobs", type=int, default=None)
+    parser.add_argument("--serve", default=None, metavar="DIR",
+                        help="serve DIR over HTTP instead of rendering")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    df = pd.concat([pd.read_csv(p) for p in args.csv], axis=0)
+    if args.query:
+        df = df.query(args.query)
+    meta = build_pyramid(df["lat"].to_numpy(), df["lon"].to_numpy(),
+                         args.out, zooms=tuple(args.zooms),
+                         radius_px=args.radius, cmap=args.cmap,
+                         n_jobs=args.n_jobs)
+    print(f"{sum(meta['tiles'].values())} tiles written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()